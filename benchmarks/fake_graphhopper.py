@@ -0,0 +1,147 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FakeGraphHopperConfig:
+    """
+    GraphHopperの /route の代わりに応答するサーバーの設定。
+    """
+
+    def __init__(self, latency: float = 0.03, jitter: float = 0.01, polygon_cost: float = 0.0005,
+                 error_rate: float = 0.0, points: int = 200):
+        self.latency = latency
+        self.jitter = jitter
+        # custom_modelのポリゴン1つあたりに加える秒数（雨エリアが多いほど経路探索が遅くなるのを模す）
+        self.polygon_cost = polygon_cost
+        self.error_rate = error_rate
+        self.points = points
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+
+def count_polygons(custom_model: dict | None) -> int:
+    """
+    custom_modelのareasに含まれるポリゴンの数を数える。
+    Args:
+        custom_model (dict | None): リクエストのcustom_model
+    Returns:
+        int: ポリゴンの数
+    """
+    if not custom_model:
+        return 0
+    count = 0
+    for feature in custom_model.get("areas", {}).get("features", []):
+        geometry = feature.get("geometry", {})
+        count += len(geometry.get("coordinates", [])) if geometry.get("type") == "MultiPolygon" else 1
+    return count
+
+
+def _path(points: list, num_points: int) -> dict:
+    (lon1, lat1), (lon2, lat2) = points[0], points[-1]
+    coordinates = [
+        [lon1 + (lon2 - lon1) * i / (num_points - 1), lat1 + (lat2 - lat1) * i / (num_points - 1)]
+        for i in range(num_points)
+    ]
+    distance = math.hypot((lon2 - lon1) * 91_000, (lat2 - lat1) * 111_000) * 1.3
+    half = num_points // 2
+    return {
+        "distance": distance,
+        "weight": distance,
+        "time": int(distance / 10 * 1000),
+        "transfers": 0,
+        "points_encoded": False,
+        "bbox": [min(lon1, lon2), min(lat1, lat2), max(lon1, lon2), max(lat1, lat2)],
+        "points": {"type": "LineString", "coordinates": coordinates},
+        "instructions": [
+            {"distance": distance / 2, "heading": 0.0, "sign": 0, "interval": [0, half],
+             "text": "Continue", "time": int(distance / 20 * 1000), "street_name": ""},
+            {"distance": distance / 2, "sign": 4, "interval": [half, num_points - 1],
+             "text": "Arrive at destination", "time": int(distance / 20 * 1000), "street_name": ""},
+        ],
+        "snapped_waypoints": {"type": "LineString", "coordinates": [points[0], points[-1]]},
+    }
+
+
+def make_handler(config: FakeGraphHopperConfig):
+    class FakeGraphHopperHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request_body = json.loads(self.rfile.read(length) or b"{}")
+            polygons = count_polygons(request_body.get("custom_model"))
+            time.sleep(max(0.0, random.gauss(config.latency, config.jitter)) + polygons * config.polygon_cost)
+            with config.lock:
+                config.requests += 1
+                failed = random.random() < config.error_rate
+                if failed:
+                    config.errors += 1
+
+            if failed:
+                self._send(500, {"message": "fake internal error", "hints": []})
+                return
+            if self.path.split("?")[0] != "/route" or len(request_body.get("points", [])) < 2:
+                self._send(400, {"message": "Cannot find point", "hints": [{"message": "invalid points"}]})
+                return
+            self._send(200, {
+                "hints": {"visited_nodes.sum": 1000, "visited_nodes.average": 1000.0},
+                "info": {"copyrights": ["GraphHopper", "OpenStreetMap contributors"], "took": 1},
+                "paths": [_path(request_body["points"], max(2, config.points))],
+            })
+
+        def _send(self, status: int, content: dict):
+            body = json.dumps(content).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return FakeGraphHopperHandler
+
+
+def start(config: FakeGraphHopperConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    バックグラウンドのスレッドでサーバーを起動する。
+    Args:
+        config (FakeGraphHopperConfig): サーバーの設定
+        host (str): 待ち受けるアドレス
+        port (int): 待ち受けるポート（0なら空いているポート）
+    Returns:
+        ThreadingHTTPServer: 起動したサーバー（server_addressで実際のポートが分かる）
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-graphhopper").start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GraphHopperの /route の代わりに応答するサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18989)
+    parser.add_argument("--latency", type=float, default=0.03, help="応答までの平均秒数")
+    parser.add_argument("--jitter", type=float, default=0.01, help="応答までの秒数の標準偏差")
+    parser.add_argument("--polygon-cost", type=float, default=0.0005, help="custom_modelのポリゴン1つあたりに加える秒数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500を返すリクエストの割合")
+    parser.add_argument("--points", type=int, default=200, help="返す経路の点の数")
+    args = parser.parse_args()
+
+    config = FakeGraphHopperConfig(args.latency, args.jitter, args.polygon_cost, args.error_rate, args.points)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    print(f"Fake GraphHopper listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# 雨の有無を決めるセルの大きさ（度）。セル単位で決めることで雨域が塊になる
+RAIN_CELL_DEGREES = 0.05
+
+
+class FakeYahooConfig:
+    """
+    Yahoo!気象情報APIの代わりに応答するサーバーの設定。
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, rain_density: float = 0.2,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rain_density = rain_density
+        self.error_rate = error_rate
+        self.seed = seed
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+
+def rainfall_at(lon: float, lat: float, config: FakeYahooConfig) -> float:
+    """
+    座標の降水強度を返す。同じ座標とシードでは常に同じ値になる。
+    Args:
+        lon (float): 経度
+        lat (float): 緯度
+        config (FakeYahooConfig): サーバーの設定
+    Returns:
+        float: 降水強度（mm/h）
+    """
+    cell = f"{config.seed}:{int(lon // RAIN_CELL_DEGREES)}:{int(lat // RAIN_CELL_DEGREES)}"
+    value = zlib.crc32(cell.encode()) / 0xFFFFFFFF
+    if value >= config.rain_density:
+        return 0.0
+    return round(1.0 + 30.0 * value / max(config.rain_density, 1e-9), 2)
+
+
+def _feature(coord: str, config: FakeYahooConfig, now: time.struct_time) -> dict:
+    lon, lat = map(float, coord.split(","))
+    rainfall = rainfall_at(lon, lat, config)
+    date = time.strftime("%Y%m%d%H%M", now)
+    weather = [{"Type": "observation", "Date": date, "Rainfall": rainfall}]
+    weather += [{"Type": "forecast", "Date": date, "Rainfall": rainfall} for _ in range(6)]
+    return {
+        "Id": "",
+        "Name": f"地点({lon},{lat})の気象情報",
+        "Geometry": {"Type": "point", "Coordinates": coord},
+        "Property": {"WeatherAreaCode": 0, "WeatherList": {"Weather": weather}},
+    }
+
+
+def make_handler(config: FakeYahooConfig):
+    class FakeYahooHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(max(0.0, random.gauss(config.latency, config.jitter)))
+            with config.lock:
+                config.requests += 1
+                failed = random.random() < config.error_rate
+                if failed:
+                    config.errors += 1
+
+            if failed:
+                self._send(500, {"Error": {"Message": "fake internal error"}})
+                return
+
+            query = parse_qs(urlparse(self.path).query)
+            coords = query.get("coordinates", [""])[0].split()
+            if not coords or len(coords) > 10:
+                self._send(400, {"Error": {"Message": "invalid coordinates"}})
+                return
+            now = time.localtime()
+            self._send(200, {
+                "ResultInfo": {"Count": len(coords), "Total": len(coords), "Start": 1, "Status": 200},
+                "Feature": [_feature(coord, config, now) for coord in coords],
+            })
+
+        def _send(self, status: int, content: dict):
+            body = json.dumps(content, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return FakeYahooHandler
+
+
+def start(config: FakeYahooConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    バックグラウンドのスレッドでサーバーを起動する。
+    Args:
+        config (FakeYahooConfig): サーバーの設定
+        host (str): 待ち受けるアドレス
+        port (int): 待ち受けるポート（0なら空いているポート）
+    Returns:
+        ThreadingHTTPServer: 起動したサーバー（server_addressで実際のポートが分かる）
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-yahoo").start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Yahoo!気象情報APIの代わりに応答するサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--latency", type=float, default=0.05, help="応答までの平均秒数")
+    parser.add_argument("--jitter", type=float, default=0.02, help="応答までの秒数の標準偏差")
+    parser.add_argument("--rain-density", type=float, default=0.2, help="雨が降っているセルの割合")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500を返すリクエストの割合")
+    parser.add_argument("--seed", type=int, default=0, help="雨域の配置を決めるシード")
+    args = parser.parse_args()
+
+    config = FakeYahooConfig(args.latency, args.jitter, args.rain_density, args.error_rate, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    print(f"Fake Yahoo weather API listening on http://{args.host}:{args.port}/weather/V1/place")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
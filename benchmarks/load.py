@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+import httpx
+import numpy as np
+
+from . import fake_graphhopper, fake_yahoo
+
+KM_PER_DEG_LAT = 111.32
+
+
+def _parse_list(value: str, cast) -> list:
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def make_pairs(count: int, trip_km: float, center: tuple[float, float], spread_km: float,
+               rng: random.Random) -> list[tuple[str, str]]:
+    """
+    中心の周辺に開始地点を散らし、指定した距離だけ離れた目的地との組を作る。
+    Args:
+        count (int): 組の数
+        trip_km (float): 開始地点と目的地の距離（km）
+        center (tuple[float, float]): 中心の緯度・経度
+        spread_km (float): 開始地点を散らす半径（km）
+        rng (random.Random): 乱数生成器
+    Returns:
+        list[tuple[str, str]]: (開始地点, 目的地) の座標文字列の組
+    """
+    lat0, lon0 = center
+    km_per_deg_lon = KM_PER_DEG_LAT * math.cos(math.radians(lat0))
+    pairs = []
+    for _ in range(count):
+        start_lat = lat0 + rng.uniform(-spread_km, spread_km) / KM_PER_DEG_LAT
+        start_lon = lon0 + rng.uniform(-spread_km, spread_km) / km_per_deg_lon
+        bearing = rng.uniform(0, 2 * math.pi)
+        goal_lat = start_lat + trip_km * math.cos(bearing) / KM_PER_DEG_LAT
+        goal_lon = start_lon + trip_km * math.sin(bearing) / km_per_deg_lon
+        pairs.append((f"{start_lat:.6f},{start_lon:.6f}", f"{goal_lat:.6f},{goal_lon:.6f}"))
+    return pairs
+
+
+async def run_scenario(base_url: str, endpoint: str, pairs: list[tuple[str, str]], concurrency: int,
+                       timeout: float) -> dict:
+    """
+    同時実行数を保ちながらリクエストを送り、スループットとレイテンシを集計する。
+    Args:
+        base_url (str): APIのURL
+        endpoint (str): "route" または "normal_route"
+        pairs (list[tuple[str, str]]): (開始地点, 目的地) の組
+        concurrency (int): 同時に送るリクエスト数
+        timeout (float): 1リクエストのタイムアウト秒数
+    Returns:
+        dict: 集計結果
+    """
+    latencies = []
+    errors = 0
+    queue = list(reversed(pairs))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def worker():
+            nonlocal errors
+            while queue:
+                start, goal = queue.pop()
+                started = time.perf_counter()
+                try:
+                    response = await client.get(f"/{endpoint}/{start}/{goal}")
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99]) if latencies else (0.0, 0.0, 0.0)
+    return {
+        "endpoint": endpoint,
+        "requests": len(pairs),
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": len(pairs) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
+
+
+def _start_app(port: int):
+    # 環境変数を設定してから読み込む必要があるため、ここでimportする
+    import uvicorn
+
+    config = uvicorn.Config("src.modules.api:app", host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True, name="saferide-api")
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("API server failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+
+def _clear_caches():
+    from src.modules.prefetch import get_prefetcher
+    from src.modules.rain_cache import rain_cache
+    from src.modules.rain_grid import get_rain_grid
+    from src.modules.rain_store import get_rain_store
+    from src.modules.route_cache import route_cache
+
+    rain_cache.clear()
+    route_cache.cache.clear()
+    # RainData.getはキャッシュより先に格子・プリフェッチ・共有ストアを見るため、これらも空にする
+    get_rain_grid().clear()
+    prefetcher = get_prefetcher()
+    if prefetcher is not None:
+        prefetcher.clear()
+    store = get_rain_store()
+    if store is not None:
+        store.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/route と /normal_route の負荷試験")
+    parser.add_argument("--target", help="試験するAPIのURL（省略時は偽のYahoo!・GraphHopperとAPIをこのプロセスで起動する）")
+    parser.add_argument("--port", type=int, default=18000, help="このプロセスで起動するAPIのポート")
+    parser.add_argument("--endpoints", default="route,normal_route", help="試験するエンドポイント（カンマ区切り）")
+    parser.add_argument("--trip-km", default="2,10,30", help="開始地点と目的地の距離（km、カンマ区切り）")
+    parser.add_argument("--concurrency", default="1,8,32", help="同時に送るリクエスト数（カンマ区切り）")
+    parser.add_argument("--requests", type=int, default=100, help="条件ごとのリクエスト数")
+    parser.add_argument("--center", default="35.68,139.76", help="開始地点を散らす中心の緯度,経度")
+    parser.add_argument("--spread-km", type=float, default=20.0, help="開始地点を散らす半径（km）")
+    parser.add_argument("--seed", type=int, default=0, help="開始地点と雨域の配置を決めるシード")
+    parser.add_argument("--timeout", type=float, default=60.0, help="1リクエストのタイムアウト秒数")
+    parser.add_argument("--warm", action="store_true", help="条件ごとにキャッシュを消さない（このプロセスで起動した場合のみ）")
+    parser.add_argument("--output", help="結果をJSONで書き出すファイル")
+    parser.add_argument("--yahoo-latency", type=float, default=0.05)
+    parser.add_argument("--yahoo-jitter", type=float, default=0.02)
+    parser.add_argument("--yahoo-error-rate", type=float, default=0.0)
+    parser.add_argument("--rain-density", type=float, default=0.2)
+    parser.add_argument("--graphhopper-latency", type=float, default=0.03)
+    parser.add_argument("--graphhopper-jitter", type=float, default=0.01)
+    parser.add_argument("--graphhopper-polygon-cost", type=float, default=0.0005)
+    parser.add_argument("--graphhopper-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    in_process = args.target is None
+    base_url = args.target
+    if in_process:
+        yahoo_config = fake_yahoo.FakeYahooConfig(
+            args.yahoo_latency, args.yahoo_jitter, args.rain_density, args.yahoo_error_rate, args.seed)
+        graphhopper_config = fake_graphhopper.FakeGraphHopperConfig(
+            args.graphhopper_latency, args.graphhopper_jitter, args.graphhopper_polygon_cost,
+            args.graphhopper_error_rate)
+        yahoo_server = fake_yahoo.start(yahoo_config)
+        graphhopper_server = fake_graphhopper.start(graphhopper_config)
+
+        os.environ["YAHOO_WEATHER_URL"] = f"http://127.0.0.1:{yahoo_server.server_address[1]}/weather/V1/place"
+        os.environ["GRAPHHOPPER_URL"] = f"http://127.0.0.1:{graphhopper_server.server_address[1]}"
+        os.environ.setdefault("YAHOO_API_KEY", "benchmark")
+        # 偽のYahoo!サーバーには利用制限がないため、リクエスト数を制限しない
+        os.environ.setdefault("YAHOO_RATE_LIMIT", "0")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        os.environ.setdefault("LOG_FILE", "logs/benchmark.log")
+        server, thread = _start_app(args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    center = tuple(_parse_list(args.center, float))
+    rng = random.Random(args.seed)
+    results = []
+    print(f"{'endpoint':<14}{'trip_km':>8}{'conc':>6}{'reqs':>6}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for endpoint in _parse_list(args.endpoints, str):
+        for trip_km in _parse_list(args.trip_km, float):
+            for concurrency in _parse_list(args.concurrency, int):
+                if in_process and not args.warm:
+                    _clear_caches()
+                pairs = make_pairs(args.requests, trip_km, center, args.spread_km, rng)
+                result = asyncio.run(run_scenario(base_url, endpoint, pairs, concurrency, args.timeout))
+                result["trip_km"] = trip_km
+                results.append(result)
+                print(f"{endpoint:<14}{trip_km:>8g}{concurrency:>6}{result['requests']:>6}{result['errors']:>8}"
+                      f"{result['throughput']:>9.1f}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}")
+                sys.stdout.flush()
+
+    if in_process:
+        print(f"Fake Yahoo requests: {yahoo_config.requests} ({yahoo_config.errors} errors), "
+              f"fake GraphHopper requests: {graphhopper_config.requests} ({graphhopper_config.errors} errors)")
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
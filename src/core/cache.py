@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """
+    有効期限（TTL）とLRU追い出しを備えたスレッドセーフなキャッシュ。
+    """
+
+    def __init__(self, max_entries: int, ttl: float, max_weight: int | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        キーに対応する値を返す。期限切れまたは未登録の場合はdefaultを返す。
+        Args:
+            key (Hashable): キー
+            default (Any): 見つからなかった場合の値
+        Returns:
+            Any: キャッシュされた値
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None, weight: int = 1) -> None:
+        """
+        値を登録する。上限を超えた場合は最も古く使われたエントリから削除する。
+        Args:
+            key (Hashable): キー
+            value (Any): 値
+            ttl (float | None): このエントリの有効秒数（省略時はキャッシュ既定のTTL）
+            weight (int): このエントリの重み（max_weightの計算に使う。例: バイト数）
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, value, weight)
+            self.weight += weight
+            while len(self._entries) > self.max_entries or (
+                    self.max_weight is not None and self.weight > self.max_weight and len(self._entries) > 1):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key: Hashable) -> None:
+        self.weight -= self._entries.pop(key)[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+    def stats(self) -> dict:
+        """
+        ヒット・ミスなどのカウンタを返す。
+        Returns:
+            dict: キャッシュの統計情報
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "weight": self.weight,
+                "max_weight": self.max_weight,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -1,11 +1,25 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 LOG_FILE = os.getenv("LOG_FILE", "logs/app.log")
+# text: 人が読む形式、json: 1行1オブジェクトのJSON
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# 1ならログの書き出しをバックグラウンドのスレッドで行い、リクエスト処理を待たせない
+LOG_QUEUE = os.getenv("LOG_QUEUE", "1") == "1"
+# デバッグログに出すリクエスト・レスポンスの最大文字数と、出力する割合
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
 
 _logging_configured = False
+_listener: QueueListener | None = None
 
 def _ensure_log_dir(path: str) -> None:
     directory = os.path.dirname(path)
@@ -13,19 +27,78 @@ def _ensure_log_dir(path: str) -> None:
         os.makedirs(directory, exist_ok=True)
 
 
+class JsonFormatter(logging.Formatter):
+    """
+    ログレコードを1行のJSONに変換するフォーマッタ。
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class payload:
+    """
+    ログの引数に渡すと、実際に出力される時だけJSONに変換する。
+    LOG_PAYLOAD_MAX_CHARSを超える部分は切り詰め、LOG_PAYLOAD_SAMPLE_RATEの割合でのみ出力する。
+
+    例: logger.debug("Request body: %s", payload(request_body))
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self) -> str:
+        if LOG_PAYLOAD_SAMPLE_RATE < 1.0 and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+            return "<payload not sampled>"
+        try:
+            text = json.dumps(self.value, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            text = repr(self.value)
+        if len(text) > LOG_PAYLOAD_MAX_CHARS:
+            return f"{text[:LOG_PAYLOAD_MAX_CHARS]}... <{len(text) - LOG_PAYLOAD_MAX_CHARS} more chars>"
+        return text
+
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 def get_logger(name: str = "saferide") -> logging.Logger:
-    global _logging_configured
+    global _logging_configured, _listener
     if not _logging_configured:
         _ensure_log_dir(LOG_FILE)
+        formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
         handlers = [
             logging.StreamHandler(),
             RotatingFileHandler(LOG_FILE, maxBytes=1_000_000, backupCount=3),
         ]
-        logging.basicConfig(
-            level=LOG_LEVEL,
-            format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-            handlers=handlers,
-        )
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        if LOG_QUEUE:
+            # 呼び出し元はキューに積むだけにし、書き出しはリスナーのスレッドで行う
+            log_queue = queue.SimpleQueue()
+            _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+            _listener.start()
+            atexit.register(_stop_listener)
+            queue_handler = QueueHandler(log_queue)
+            # メッセージの組み立てだけを行い、書式はリスナー側のハンドラで適用する
+            queue_handler.setFormatter(logging.Formatter("%(message)s"))
+            handlers = [queue_handler]
+
+        logging.basicConfig(level=LOG_LEVEL, handlers=handlers)
         _logging_configured = True
     return logging.getLogger(name)
-
@@ -0,0 +1,179 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterable
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+# リクエストごとの処理段階の所要時間（Server-Timingヘッダ用）
+_request_timings: ContextVar[list | None] = ContextVar("request_timings", default=None)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """
+    単調増加するカウンタ。
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            for key, value in self._values.items():
+                yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    """
+    値の分布を累積バケットで記録するヒストグラム。
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # バケットごとの件数（最後は+Inf）、合計、件数
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{float(bound)}"'
+                    yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}"
+                yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+
+class Registry:
+    """
+    メトリクスをまとめ、Prometheusのテキスト形式で出力する。
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors: list[Callable[[], Iterable[str]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[str]]) -> None:
+        """
+        出力時に呼び出され、Prometheusのテキスト形式の行を返す関数を登録する。
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "saferide_stage_duration_seconds", "Duration of each request processing stage", ("stage",))
+request_seconds = registry.histogram(
+    "saferide_http_request_duration_seconds", "Duration of HTTP requests", ("path", "status"))
+yahoo_chunk_seconds = registry.histogram(
+    "saferide_yahoo_chunk_duration_seconds", "Duration of each Yahoo weather API chunk request")
+yahoo_chunk_failures = registry.counter(
+    "saferide_yahoo_chunk_failures_total", "Yahoo weather API chunk requests that returned no features", ("reason",))
+yahoo_hedged_requests = registry.counter(
+    "saferide_yahoo_hedged_requests_total", "Extra Yahoo requests sent for chunks slower than the hedge percentile")
+rain_tiles = registry.histogram(
+    "saferide_rain_tiles", "Number of tiles queried and detected as rainy per request", ("kind",), COUNT_BUCKETS)
+route_modes = registry.counter(
+    "saferide_route_mode_total", "Routes by how they were computed", ("mode",))
+routing_modes = registry.counter(
+    "saferide_graphhopper_routing_mode_total", "GraphHopper requests by routing speed-up mode", ("mode",))
+custom_model_areas = registry.histogram(
+    "saferide_custom_model_polygons", "Number of polygons sent in the GraphHopper custom_model", (), COUNT_BUCKETS)
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    処理段階の所要時間を計測し、ヒストグラムとリクエストごとのServer-Timingに記録する。
+    Args:
+        stage (str): 処理段階の名前
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def start_request_timings() -> list:
+    """
+    現在のリクエストで処理段階の所要時間の記録を始める。
+    Returns:
+        list: (段階名, 秒) を追加していくリスト
+    """
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings: list) -> str:
+    """
+    記録した所要時間をServer-Timingヘッダの値に変換する。
+    Args:
+        timings (list): (段階名, 秒) のリスト
+    Returns:
+        str: ヘッダの値
+    """
+    return ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in timings)
@@ -1,14 +1,104 @@
-from fastapi import FastAPI, Path, HTTPException
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from fastapi import FastAPI, Path, Query, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
-from typing import Dict, Any
+from starlette.middleware.gzip import GZipMiddleware
+from typing import Dict, Any, List
 
-from .service import get_route_from_graphhopper, get_rain_info
+from .service import (
+    get_route, get_routes, get_rain_info, get_rain_info_for_pairs, check_rain_on_path, with_rain_exposure, YAHOO_API_KEY, ROUTE_STRATEGY, JST,
+)
+from .rain_cache import rain_cache
+from .route_cache import route_cache
+from .prefetch import RainPrefetcher, RAIN_PREFETCH_BBOXES, parse_regions, set_prefetcher
+from .graphhopper import get_graphhopper_client, close_graphhopper_client
+from .compact import compact_route_response, pack_tiles, dumps_json
+from .trips import trip_manager, TRIP_KEEPALIVE
+from .overlay import encode_png, to_geojson, cells_to_geojson, grid_cells, geojson_size, etag, etag_matches, PNG_SIZE, RAIN_OVERLAY_MAX_AGE, RAIN_OVERLAY_PAST_MAX_AGE
+from .rain_cache import time_bucket, NOWCAST_INTERVAL_SECONDS
+from .rain_grid import get_rain_grid, NUM_SLOTS
 
-from src.core.logger import get_logger
+from src.core.logger import get_logger, payload
+from src.core.metrics import registry, request_seconds, route_modes, timed, start_request_timings, server_timing_header
 
 logger = get_logger(__name__)
 
-app = FastAPI()
+# このバイト数以上のレスポンスは、クライアントが対応していればgzipで圧縮する
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1024"))
+# /routes で一度に受け付ける組の数の上限
+ROUTES_BATCH_MAX_PAIRS = int(os.getenv("ROUTES_BATCH_MAX_PAIRS", "50"))
+# 1にすると処理段階ごとの所要時間をServer-Timingヘッダで返す
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING", "0") == "1"
+
+
+def _cache_metrics():
+    stats = {"rain": rain_cache.stats(), "route": route_cache.cache.stats()}
+    for key, metric_type in (("entries", "gauge"), ("weight", "gauge"),
+                             ("hits", "counter"), ("misses", "counter"), ("evictions", "counter")):
+        metric = f"saferide_cache_{key}" + ("_total" if metric_type == "counter" else "")
+        yield f"# TYPE {metric} {metric_type}"
+        for name, cache_stats in stats.items():
+            yield f'{metric}{{cache="{name}"}} {cache_stats[key]}'
+
+
+registry.register_collector(_cache_metrics)
+
+
+class RoutePair(BaseModel):
+    start: str = Field(..., description="開始地点の座標（緯度,経度）", examples=["35.6762,139.6503"])
+    goal: str = Field(..., description="目的地の座標（緯度,経度）", examples=["35.7169,139.7774"])
+
+    @field_validator("start", "goal")
+    @classmethod
+    def _check_coordinate(cls, value: str) -> str:
+        parts = value.split(",")
+        if len(parts) != 2:
+            raise ValueError("座標は「緯度,経度」の形式で指定してください")
+        lat, lon = map(float, parts)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError("座標が範囲外です")
+        return value
+
+
+class TripPosition(BaseModel):
+    lat: float = Field(..., ge=-90, le=90, description="現在地の緯度")
+    lon: float = Field(..., ge=-180, le=180, description="現在地の経度")
+
+
+class BatchRouteRequest(BaseModel):
+    pairs: List[RoutePair] = Field(..., min_length=1, description="開始地点と目的地の組のリスト")
+    avoid_rain: bool = Field(True, description="雨を考慮したルートを取得するかどうか")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # GraphHopperへのコネクションプールを起動時に作成する
+    get_graphhopper_client()
+
+    # サービス領域が設定されている場合は雨データをバックグラウンドで取得し続ける
+    prefetcher = None
+    regions = parse_regions(RAIN_PREFETCH_BBOXES)
+    if regions:
+        prefetcher = RainPrefetcher(YAHOO_API_KEY, regions)
+        set_prefetcher(prefetcher)
+        prefetcher.start()
+    # 走行中のトリップの雨をYahoo!の更新周期ごとに確認する
+    trip_manager.start()
+    yield
+    await trip_manager.stop()
+    if prefetcher is not None:
+        await prefetcher.stop()
+        set_prefetcher(None)
+    await close_graphhopper_client()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS設定を追加
 app.add_middleware(
@@ -18,11 +108,33 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+
+
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """
+    リクエストの所要時間を記録し、有効な場合は処理段階ごとの所要時間をServer-Timingヘッダで返す。
+    """
+    started = time.perf_counter()
+    timings = start_request_timings()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+
+    # パスごとではなくルートのテンプレートごとに集計する
+    route = request.scope.get("route")
+    path = getattr(route, "path", "other")
+    request_seconds.observe(elapsed, path=path, status=response.status_code)
+    if SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = server_timing_header(timings + [("total", elapsed)])
+    return response
+
 
 @app.get("/route/{start}/{goal}",
          description="雨を考慮したルートを取得する",
          response_model=Dict[str, Any])
 async def route(
+    http_response: Response,
     start: str = Path(
         ...,
         description="開始地点の座標（緯度,経度）",
@@ -32,6 +144,25 @@ async def route(
         ...,
         description="目的地の座標（緯度,経度）",
         example="35.7169,139.7774"
+    ),
+    format: str = Query(
+        "json",
+        pattern="^(json|compact)$",
+        description="レスポンス形式（compact: エンコード済みポリラインとまとめたタイル配列を返す）"
+    ),
+    simplify_zoom: int | None = Query(
+        None,
+        ge=0,
+        le=22,
+        description="compact形式で、このズームレベルで見分けられない点を間引く"
+    ),
+    include_rain_tiles: bool = Query(
+        True,
+        description="falseなら雨タイルのリストを返さない（雨は /rain/{z}/{x}/{y} と rain_status.nowcast_time で取得する）"
+    ),
+    include_rain_exposure: bool = Query(
+        False,
+        description="trueなら各経路に雨の中を通る距離・時間と雨の区間（rain_exposure）を付ける（経路のタイルの雨データを取得する）"
     )
 ):
     """
@@ -40,6 +171,10 @@ async def route(
     Args:
         start (str): 開始地点の座標（例: "35.6762,139.6503"）
         goal (str): 目的地の座標（例: "35.7169,139.7774"）
+        format (str): レスポンス形式（"json" または "compact"）
+        simplify_zoom (int | None): compact形式で経路を間引くズームレベル
+        include_rain_tiles (bool): 雨タイルのリストを含めるかどうか
+        include_rain_exposure (bool): 各経路にrain_exposureを付けるかどうか
         
     Returns:
         dict: 雨データとルート情報を含む辞書
@@ -48,8 +183,25 @@ async def route(
         HTTPException: GraphHopperへのリクエストが失敗した場合
     """
     logger.info("/route called with start=%s goal=%s", start, goal)
-    rain_data, rain_tile_list = get_rain_info(start, goal)
-    response = get_route_from_graphhopper(start, goal, rain_data)
+    response = None
+    first_route = None
+    if ROUTE_STRATEGY == "route_first":
+        # 先に通常のルートを求め、経路の周辺に雨がなければそのまま返す
+        response, cache_hit = await get_route(start, goal)
+        rain_tile_list = []
+        rain_status = None
+        route_mode = "normal"
+        if "error" not in response:
+            rain_on_path, rain_status = await run_in_threadpool(check_rain_on_path, response)
+            if rain_on_path:
+                first_route, response = response, None
+
+    if response is None:
+        # 雨データの取得はブロッキングI/Oのため、イベントループを止めないようスレッドで実行する
+        rain_data, rain_tile_list = await run_in_threadpool(get_rain_info, start, goal, first_route)
+        rain_status = rain_data.get("rain_status")
+        response, cache_hit = await get_route(start, goal, rain_data)
+        route_mode = "rain_avoiding"
     
     # GraphHopperからのエラーレスポンスをチェック
     if "error" in response:
@@ -64,14 +216,34 @@ async def route(
             # その他のエラーは500として返す
             raise HTTPException(status_code=500, detail=f"Internal server error: {error_message}")
     
-    logger.debug("Route response: %s", response)
-    return {"response": response, "rain_tile_list": rain_tile_list}
+    logger.debug("Route response: %s", payload(response))
+    if include_rain_exposure:
+        response = await run_in_threadpool(with_rain_exposure, response)
+    route_modes.inc(mode=route_mode)
+    headers = {"X-Route-Cache": "HIT" if cache_hit else "MISS", "X-Route-Mode": route_mode}
+    if format == "compact":
+        with timed("serialize"):
+            content = {
+                "response": compact_route_response(response, simplify_zoom),
+                "route_mode": route_mode,
+                "rain_status": rain_status,
+            }
+            if include_rain_tiles:
+                content["rain_tiles"] = pack_tiles(rain_tile_list)
+            body = dumps_json(content)
+        return Response(body, media_type="application/json", headers=headers)
+    http_response.headers.update(headers)
+    content = {"response": response, "route_mode": route_mode, "rain_status": rain_status}
+    if include_rain_tiles:
+        content["rain_tile_list"] = rain_tile_list
+    return content
 
 
 @app.get("/normal_route/{start}/{goal}",
          description="通常のルートを取得する",
          response_model=Dict[str, Any])
 async def normal_route(
+    http_response: Response,
     start: str = Path(
         ...,
         description="開始地点の座標（緯度,経度）",
@@ -81,6 +253,21 @@ async def normal_route(
         ...,
         description="目的地の座標（緯度,経度）",
         example="35.7169,139.7774"
+    ),
+    format: str = Query(
+        "json",
+        pattern="^(json|compact)$",
+        description="レスポンス形式（compact: エンコード済みポリラインとまとめたタイル配列を返す）"
+    ),
+    simplify_zoom: int | None = Query(
+        None,
+        ge=0,
+        le=22,
+        description="compact形式で、このズームレベルで見分けられない点を間引く"
+    ),
+    include_rain_exposure: bool = Query(
+        False,
+        description="trueなら各経路に雨の中を通る距離・時間と雨の区間（rain_exposure）を付ける（雨データを取得する）"
     )
 ):
     """
@@ -89,6 +276,9 @@ async def normal_route(
     Args:
         start (str): 開始地点の座標（例: "35.6762,139.6503"）
         goal (str): 目的地の座標（例: "35.7169,139.7774"）
+        format (str): レスポンス形式（"json" または "compact"）
+        simplify_zoom (int | None): compact形式で経路を間引くズームレベル
+        include_rain_exposure (bool): 各経路にrain_exposureを付けるかどうか
         
     Returns:
         dict: 通常のルート情報を含む辞書
@@ -97,7 +287,7 @@ async def normal_route(
         HTTPException: GraphHopperへのリクエストが失敗した場合
     """
     logger.info("/normal_route called with start=%s goal=%s", start, goal)
-    response = get_route_from_graphhopper(start, goal)
+    response, cache_hit = await get_route(start, goal)
     
     # GraphHopperからのエラーレスポンスをチェック
     if "error" in response:
@@ -112,5 +302,247 @@ async def normal_route(
             # その他のエラーは500として返す
             raise HTTPException(status_code=500, detail=f"Internal server error: {error_message}")
     
-    logger.debug("Normal route response: %s", response)
-    return response
\ No newline at end of file
+    logger.debug("Normal route response: %s", payload(response))
+    if include_rain_exposure:
+        response = await run_in_threadpool(with_rain_exposure, response)
+    cache_header = {"X-Route-Cache": "HIT" if cache_hit else "MISS"}
+    if format == "compact":
+        with timed("serialize"):
+            body = dumps_json(compact_route_response(response, simplify_zoom))
+        return Response(body, media_type="application/json", headers=cache_header)
+    http_response.headers.update(cache_header)
+    return response
+
+
+@app.post("/routes",
+          description="複数の開始地点と目的地の組のルートをまとめて取得する",
+          response_model=Dict[str, Any])
+async def routes(request: BatchRouteRequest):
+    """
+    複数の組のルートをまとめて取得するエンドポイント。
+    雨データはすべての組に必要なタイルを合わせて一度だけ取得し、同じ回避エリアを全組で使う。
+    
+    Args:
+        request (BatchRouteRequest): 開始地点と目的地の組のリスト
+        
+    Returns:
+        dict: 組ごとのルート情報またはエラーと、雨タイルのリスト
+        
+    Raises:
+        HTTPException: 組の数が上限を超えた場合
+    """
+    if len(request.pairs) > ROUTES_BATCH_MAX_PAIRS:
+        raise HTTPException(status_code=400, detail=f"Too many pairs: {len(request.pairs)} > {ROUTES_BATCH_MAX_PAIRS}")
+
+    pairs = [(pair.start, pair.goal) for pair in request.pairs]
+    logger.info("/routes called with %d pairs (avoid_rain=%s)", len(pairs), request.avoid_rain)
+
+    rain_data = None
+    rain_tile_list = []
+    rain_status = None
+    if request.avoid_rain:
+        rain_data, rain_tile_list = await run_in_threadpool(get_rain_info_for_pairs, pairs)
+        rain_status = rain_data.get("rain_status")
+
+    results = []
+    for (start, goal), (response, cache_hit) in zip(pairs, await get_routes(pairs, rain_data)):
+        if "error" in response:
+            results.append({
+                "start": start,
+                "goal": goal,
+                "error": response["error"],
+                "status_code": response.get("status_code", 500),
+            })
+        else:
+            results.append({"start": start, "goal": goal, "response": response, "cached": cache_hit})
+
+    return {"results": results, "rain_tile_list": rain_tile_list, "rain_status": rain_status}
+
+
+@app.get("/trips/stream/{start}/{goal}",
+         description="走行中のトリップを登録し、雨の変化とルートの変更をServer-Sent Eventsで受け取る")
+async def trip_stream(
+    start: str = Path(
+        ...,
+        description="開始地点の座標（緯度,経度）",
+        example="35.6762,139.6503"
+    ),
+    goal: str = Path(
+        ...,
+        description="目的地の座標（緯度,経度）",
+        example="35.7169,139.7774"
+    ),
+    format: str = Query(
+        "json",
+        pattern="^(json|compact)$",
+        description="ルートの形式（compact: エンコード済みポリライン）"
+    ),
+    simplify_zoom: int | None = Query(
+        None,
+        ge=0,
+        le=22,
+        description="compact形式で、このズームレベルで見分けられない点を間引く"
+    )
+):
+    """
+    トリップを登録し、接続が切れるまでイベントを送り続けるエンドポイント。
+    最初に route と rain イベントを送り、以降はYahoo!の更新周期ごとに残りの経路の周辺の雨を確認して、
+    変わった場合だけ雨のタイルの差分（rain）と、経路が変わった場合は新しいルート（route）を送る。
+    
+    Args:
+        start (str): 開始地点の座標（例: "35.6762,139.6503"）
+        goal (str): 目的地の座標（例: "35.7169,139.7774"）
+        format (str): ルートの形式（"json" または "compact"）
+        simplify_zoom (int | None): compact形式で経路を間引くズームレベル
+        
+    Returns:
+        StreamingResponse: text/event-stream
+        
+    Raises:
+        HTTPException: 座標が不正な場合、または登録中のトリップ数が上限に達している場合
+    """
+    try:
+        RoutePair(start=start, goal=goal)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=[error["msg"] for error in e.errors()])
+    if trip_manager.full:
+        raise HTTPException(status_code=503, detail="Too many active trips")
+    trip = await trip_manager.register(start, goal, format, simplify_zoom)
+
+    async def events():
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(trip.queue.get(), TRIP_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # 途中のプロキシに接続を切られないよう、コメント行を送る
+                    yield b": keepalive\n\n"
+        finally:
+            trip_manager.unregister(trip.trip_id)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Trip-Id": trip.trip_id}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+
+@app.post("/trips/{trip_id}/position",
+          description="走行中のトリップの現在地を更新する",
+          response_model=Dict[str, Any])
+async def trip_position(trip_id: str, position: TripPosition):
+    """
+    トリップの現在地を更新するエンドポイント。次の確認から、現在地より先の経路の周辺だけを見る。
+    
+    Args:
+        trip_id (str): トリップのID（route・rain イベントの trip_id）
+        position (TripPosition): 現在地
+        
+    Returns:
+        dict: 更新したトリップのID
+        
+    Raises:
+        HTTPException: トリップが登録されていない場合
+    """
+    if not trip_manager.update_position(trip_id, position.lat, position.lon):
+        raise HTTPException(status_code=404, detail=f"Trip not found: {trip_id}")
+    return {"trip_id": trip_id}
+
+
+@app.get("/rain/{z}/{x}/{y}",
+         description="雨の重ね合わせ用のXYZタイルを取得する")
+async def rain_tile(
+    request: Request,
+    z: int = Path(..., ge=0, le=22, description="ズームレベル"),
+    x: int = Path(..., ge=0, description="タイルのX座標"),
+    y: int = Path(..., ge=0, description="タイルのY座標"),
+    format: str = Query(
+        "png",
+        pattern="^(png|geojson)$",
+        description="png: 降水強度で色分けした256×256の画像、geojson: 雨のセルのFeatureCollection"
+    ),
+    slot: int | None = Query(
+        None,
+        ge=0,
+        lt=NUM_SLOTS,
+        description="0: 観測値、1〜6: 10〜60分先の予報値（省略時はすべてのうち最大の値）"
+    ),
+    t: int | None = Query(
+        None,
+        description="ナウキャストの時刻（UNIX時間、rain_status.nowcast_time）。省略時は最新"
+    )
+):
+    """
+    雨の格子から、指定したタイルの範囲の雨を返すエンドポイント。
+    Yahoo!には問い合わせず、ルートの計算や先読みで取得済みのセルだけを返す（未取得のセルは雨なしと区別して返す）。
+    内容が同じ間はETagが変わらないため、リバースプロキシやCDNでキャッシュできる。
+    
+    Args:
+        z (int): ズームレベル
+        x (int): タイルのX座標
+        y (int): タイルのY座標
+        format (str): "png" または "geojson"
+        slot (int | None): 観測値・予報値の位置
+        t (int | None): ナウキャストの時刻（UNIX時間）
+        
+    Returns:
+        Response: PNGまたはGeoJSON（If-None-Matchが一致する場合は304）
+        
+    Raises:
+        HTTPException: タイル座標が範囲外、または指定した時刻の雨データを保持していない場合
+    """
+    if x >= 1 << z or y >= 1 << z:
+        raise HTTPException(status_code=400, detail=f"Tile out of range: {z}/{x}/{y}")
+
+    grid = get_rain_grid()
+    current = time_bucket(datetime.now(JST))
+    if t is None:
+        # 更新直後でまだ何も取得していなければ、直前の時間枠を返す
+        bucket = current if grid.snapshot(current) is not None or grid.snapshot(current - 1) is None else current - 1
+    else:
+        bucket = t // NOWCAST_INTERVAL_SECONDS
+        if grid.snapshot(bucket) is None:
+            raise HTTPException(status_code=404, detail=f"No rain data for nowcast time {t}")
+
+    max_age = RAIN_OVERLAY_MAX_AGE if bucket == current else RAIN_OVERLAY_PAST_MAX_AGE
+    headers = {
+        "Cache-Control": f"public, max-age={max_age}",
+        "X-Nowcast-Time": str(bucket * NOWCAST_INTERVAL_SECONDS),
+    }
+    # GeoJSONのセルが格子のセルと一致する場合は、範囲内の雨と未取得のセルを格子からまとめて読む
+    cells = grid_cells(grid, z, x, y, bucket, slot) if format == "geojson" else None
+    if cells is not None:
+        headers["ETag"] = etag(format, slot, bucket, cells[0].x.tobytes(), cells[0].y.tobytes(), cells[1].tobytes())
+    else:
+        size = PNG_SIZE if format == "png" else geojson_size(z, grid.zoom)
+        values = await run_in_threadpool(grid.tile_values, z, x, y, bucket, size, slot)
+        headers["ETag"] = etag(format, slot, bucket, values.tobytes())
+    if etag_matches(request.headers.get("if-none-match", ""), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if format == "png":
+        return Response(encode_png(values), media_type="image/png", headers=headers)
+    content = cells_to_geojson(*cells) if cells is not None else to_geojson(values, z, x, y)
+    return Response(dumps_json(content), media_type="application/geo+json", headers=headers)
+
+
+@app.get("/stats/cache",
+         description="キャッシュのヒット・ミス数を取得する",
+         response_model=Dict[str, Any])
+async def cache_stats():
+    """
+    雨データキャッシュの統計情報を返すエンドポイント。
+    
+    Returns:
+        dict: キャッシュごとのエントリ数・ヒット数・ミス数
+    """
+    return {"rain": rain_cache.stats(), "route": route_cache.cache.stats()}
+
+
+@app.get("/metrics",
+         description="Prometheus形式のメトリクスを取得する",
+         response_class=PlainTextResponse)
+async def metrics():
+    """
+    処理段階ごとの所要時間のヒストグラムやキャッシュの統計をPrometheusのテキスト形式で返すエンドポイント。
+    
+    Returns:
+        PlainTextResponse: Prometheusのテキスト形式のメトリクス
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,134 @@
+import os
+import numpy as np
+from dataclasses import dataclass
+from typing import List
+
+from .values import TileSet, num2deg_array
+
+# multipolygon: 結合した矩形を1つのMultiPolygon（in_rain）にまとめる
+# rectangles: 結合した矩形ごとにPolygonとpriorityルールを作る
+# off: タイルごとにPolygonとpriorityルールを作る（結合しない）
+RAIN_AREA_MERGE = os.getenv("RAIN_AREA_MERGE", "multipolygon")
+# この枚数以下のタイルの隙間は雨のエリアとして埋める
+RAIN_AREA_MERGE_TOLERANCE = int(os.getenv("RAIN_AREA_MERGE_TOLERANCE", "0"))
+
+
+@dataclass
+class TileRects:
+    """
+    タイル座標上の矩形の集合（x1, y1 は含まない）。
+    """
+    x0: np.ndarray
+    y0: np.ndarray
+    x1: np.ndarray
+    y1: np.ndarray
+    zoom: int
+
+    def __len__(self):
+        return len(self.x0)
+
+    def to_polygons(self) -> List[dict]:
+        """
+        矩形ごとのGeoJSONのPolygonジオメトリを返す。
+        Returns:
+            List[dict]: GeoJSON形式のジオメトリのリスト
+        """
+        lat_max, lon_min = num2deg_array(self.x0, self.y0, self.zoom)
+        lat_min, lon_max = num2deg_array(self.x1, self.y1, self.zoom)
+        return [
+            {"type": "Polygon", "coordinates": ring}
+            for ring in _rings(lon_min.tolist(), lat_min.tolist(), lon_max.tolist(), lat_max.tolist())
+        ]
+
+    def to_multipolygon(self) -> dict:
+        """
+        すべての矩形を1つのGeoJSONのMultiPolygonジオメトリにまとめる。
+        Returns:
+            dict: GeoJSON形式のジオメトリ
+        """
+        return {
+            "type": "MultiPolygon",
+            "coordinates": [polygon["coordinates"] for polygon in self.to_polygons()]
+        }
+
+
+def _rings(lon_min, lat_min, lon_max, lat_max):
+    for x0, y0, x1, y1 in zip(lon_min, lat_min, lon_max, lat_max):
+        yield [[
+            [x0, y0],
+            [x0, y1],
+            [x1, y1],
+            [x1, y0],
+            [x0, y0]
+        ]]
+
+
+def _fill_gaps(mask: np.ndarray, tolerance: int) -> None:
+    """
+    各行で、両側を雨のセルに挟まれたtolerance以下の隙間を埋める。
+    Args:
+        mask (np.ndarray): 2次元のbool配列（その場で書き換える）
+        tolerance (int): 埋める隙間の最大セル数
+    """
+    for row in mask:
+        (cells,) = np.nonzero(row)
+        if len(cells) < 2:
+            continue
+        gaps = np.diff(cells) - 1
+        small = (gaps > 0) & (gaps <= tolerance)
+        for start, gap in zip(cells[:-1][small].tolist(), gaps[small].tolist()):
+            row[start + 1:start + 1 + gap] = True
+
+
+def merge_tiles(tiles: TileSet, tolerance: int = RAIN_AREA_MERGE_TOLERANCE) -> TileRects:
+    """
+    隣り合うタイルを矩形に結合する。
+    ズームレベルが混在する場合は最も細かいズームレベルのグリッド上で結合する。
+    Args:
+        tiles (TileSet): 結合するタイル集合
+        tolerance (int): 埋めるタイルの隙間の最大枚数（0なら隙間は埋めない）
+    Returns:
+        TileRects: 結合後の矩形の集合
+    """
+    if len(tiles) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return TileRects(empty, empty, empty, empty, 13)
+
+    zoom = int(tiles.zoom.max())
+    scale = np.left_shift(1, zoom - tiles.zoom)
+    cx0 = tiles.x * scale
+    cy0 = tiles.y * scale
+    origin_x = int(cx0.min())
+    origin_y = int(cy0.min())
+    width = int((cx0 + scale).max()) - origin_x
+    height = int((cy0 + scale).max()) - origin_y
+
+    # 最も細かいズームレベルのグリッドに塗る
+    mask = np.zeros((height, width), dtype=bool)
+    if np.all(scale == 1):
+        mask[cy0 - origin_y, cx0 - origin_x] = True
+    else:
+        for x, y, size in zip((cx0 - origin_x).tolist(), (cy0 - origin_y).tolist(), scale.tolist()):
+            mask[y:y + size, x:x + size] = True
+
+    if tolerance > 0:
+        _fill_gaps(mask.T, tolerance)
+        _fill_gaps(mask, tolerance)
+
+    # 行ごとの連続区間を求め、同じ区間が続く行を縦にまとめる
+    rects = []
+    active = {}
+    for y in range(height + 1):
+        runs = set()
+        if y < height:
+            edges = np.diff(np.concatenate(([0], mask[y].view(np.int8), [0])))
+            runs = set(zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist()))
+        for run in list(active):
+            if run not in runs:
+                rects.append((run[0], active.pop(run), run[1], y))
+        for run in runs:
+            active.setdefault(run, y)
+
+    rects.sort(key=lambda r: (r[1], r[0]))
+    x0, y0, x1, y1 = (np.array(v, dtype=np.int64) for v in zip(*rects))
+    return TileRects(x0 + origin_x, y0 + origin_y, x1 + origin_x, y1 + origin_y, zoom)
@@ -0,0 +1,193 @@
+import json
+import numpy as np
+from typing import List
+
+from .values import tile
+
+try:
+    import orjson
+except ImportError:  # orjsonがない環境では標準のjsonで代用する
+    orjson = None
+
+
+def dumps_json(content) -> bytes:
+    """
+    レスポンス用にJSONをバイト列へ直列化する（orjsonがあればorjsonを使う）。
+    Args:
+        content: 直列化する値
+    Returns:
+        bytes: UTF-8のJSON
+    """
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads_json(data: bytes):
+    """
+    JSONのバイト列を読み込む（orjsonがあればorjsonを使う）。
+    Args:
+        data (bytes): UTF-8のJSON
+    Returns:
+        読み込んだ値
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode_polyline(coords: np.ndarray, precision: int = 5) -> str:
+    """
+    座標列をエンコード済みポリライン（Google形式、GraphHopperの points_encoded と同じ）に変換する。
+    Args:
+        coords (np.ndarray): [lon, lat] の配列（形状 (n, 2)）
+        precision (int): 小数点以下の桁数
+    Returns:
+        str: エンコード済みポリライン
+    """
+    if len(coords) == 0:
+        return ""
+    # lat, lon の順に整数化し、直前の点との差分をとる
+    scaled = np.round(np.asarray(coords, dtype=np.float64)[:, ::-1] * (10 ** precision)).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=[[0, 0]]).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist()
+
+    chars = []
+    for value in values:
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def simplify_path(coords: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Douglas-Peucker法で経路を単純化する。
+    Args:
+        coords (np.ndarray): [lon, lat] の配列（形状 (n, 2)）
+        tolerance (float): 許容する誤差（Webメルカトル座標で、経度1度と同じ長さを1とする単位）
+    Returns:
+        np.ndarray: 残す点の添字（昇順、始点と終点を含む）
+    """
+    n = len(coords)
+    if n <= 2 or tolerance <= 0:
+        return np.arange(n)
+
+    # 地図タイルと同じWebメルカトル座標に投影し、画素の大きさがどの緯度・方向でも同じになるようにする
+    points = np.asarray(coords, dtype=np.float64)[:, :2].copy()
+    points[:, 1] = np.degrees(np.arcsinh(np.tan(np.radians(points[:, 1]))))
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        segment = points[last] - points[first]
+        offsets = points[first + 1:last] - points[first]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+def zoom_tolerance(zoom: int) -> float:
+    """
+    指定したズームレベルで1ピクセル（256pxタイル）に相当するWebメルカトル座標の長さを返す。
+    Args:
+        zoom (int): ズームレベル
+    Returns:
+        float: 許容誤差（経度1度と同じ長さを1とする単位）
+    """
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def pack_tiles(tiles: List[tile]) -> dict:
+    """
+    タイルのリストをズームレベルごとの [x, y] 配列にまとめる。
+    Args:
+        tiles (List[tile]): タイルのリスト
+    Returns:
+        dict: ズームレベル（文字列）をキー、[[x, y], ...] を値とする辞書
+    """
+    packed = {}
+    for t in tiles:
+        packed.setdefault(str(t.zoom), []).append([int(t.x), int(t.y)])
+    return packed
+
+
+def _points_dimension(points: dict) -> int:
+    coordinates = points.get("coordinates") or [[0, 0]]
+    return len(coordinates[0])
+
+
+def _remap_interval(kept: np.ndarray, start: int, end: int) -> list:
+    return [
+        int(np.searchsorted(kept, start, side="right") - 1),
+        int(np.searchsorted(kept, end, side="left")),
+    ]
+
+
+def _compact_path(path: dict, simplify_zoom: int | None) -> dict:
+    points = path.get("points")
+    if not isinstance(points, dict):
+        return path
+
+    coords = np.asarray(points.get("coordinates", []), dtype=np.float64).reshape(-1, _points_dimension(points))
+    kept = np.arange(len(coords))
+    if simplify_zoom is not None:
+        kept = simplify_path(coords[:, :2], zoom_tolerance(simplify_zoom))
+
+    compact = {key: value for key, value in path.items() if key not in ("points", "snapped_waypoints", "instructions")}
+    compact["points"] = encode_polyline(coords[kept, :2])
+    compact["points_encoded"] = True
+    compact["num_points"] = len(kept)
+
+    snapped = path.get("snapped_waypoints")
+    if isinstance(snapped, dict):
+        snapped_coords = np.asarray(snapped.get("coordinates", []), dtype=np.float64).reshape(-1, _points_dimension(snapped))
+        compact["snapped_waypoints"] = encode_polyline(snapped_coords[:, :2])
+
+    # 単純化で点の添字が変わるため、区間を残した点の添字に付け替える
+    instructions = path.get("instructions")
+    if instructions is not None:
+        remapped = []
+        for instruction in instructions:
+            instruction = dict(instruction)
+            if "interval" in instruction:
+                instruction["interval"] = _remap_interval(kept, *instruction["interval"])
+            remapped.append(instruction)
+        compact["instructions"] = remapped
+
+    exposure = path.get("rain_exposure")
+    if isinstance(exposure, dict) and "intervals" in exposure:
+        compact["rain_exposure"] = {
+            **exposure,
+            "intervals": [_remap_interval(kept, start, end) + rest for start, end, *rest in exposure["intervals"]],
+        }
+    return compact
+
+
+def compact_route_response(response: dict, simplify_zoom: int | None = None) -> dict:
+    """
+    GraphHopperのレスポンスを、エンコード済みポリラインを使う小さな形式に変換する。
+    元のレスポンス（キャッシュされている場合がある）は変更しない。
+    Args:
+        response (dict): GraphHopperのレスポンス（points_encoded: False）
+        simplify_zoom (int | None): このズームレベルで見分けられない点を間引く（Noneなら間引かない）
+    Returns:
+        dict: 変換後のレスポンス
+    """
+    compact = {key: value for key, value in response.items() if key != "paths"}
+    compact["paths"] = [_compact_path(path, simplify_zoom) for path in response.get("paths", [])]
+    return compact
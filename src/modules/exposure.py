@@ -0,0 +1,122 @@
+import numpy as np
+
+from .rain_data import RainData, RAIN_ETA_SLOT_MARGIN
+from .rain_grid import NUM_SLOTS, SLOT_SECONDS
+from .values import TileSet, deg2num_array, haversine_km
+
+
+def path_coordinates(path: dict) -> np.ndarray:
+    """
+    GraphHopperの経路の点を [lon, lat] の配列で返す。
+    Args:
+        path (dict): GraphHopperのレスポンスの paths の要素（points_encoded: False）
+    Returns:
+        np.ndarray: (点の数, 2) の配列
+    """
+    points = path.get("points")
+    coordinates = points.get("coordinates") if isinstance(points, dict) else None
+    if not coordinates:
+        return np.zeros((0, 2))
+    return np.asarray(coordinates, dtype=np.float64)[:, :2]
+
+
+def segment_midpoints(coords: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    経路の区間（隣り合う2点の間）ごとの中点の緯度経度を返す。
+    Args:
+        coords (np.ndarray): [lon, lat] の配列
+    Returns:
+        (lat, lon): 中点の緯度・経度の配列（区間の数）
+    """
+    mid = (coords[:-1] + coords[1:]) / 2
+    return mid[:, 1], mid[:, 0]
+
+
+def _lookup(rain_data: RainData, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    # 取得したタイルのズームレベルごとに、点を含むタイルの添字を二分探索で求める（-1は未取得）
+    tiles = rain_data.feature_tiles
+    found = np.full(len(lat), -1, dtype=np.int64)
+    for zoom in np.unique(tiles.zoom).tolist():
+        index = np.flatnonzero(tiles.zoom == zoom)
+        keys = (tiles.x[index] << zoom) | tiles.y[index]
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+        x, y = deg2num_array(lat, lon, zoom)
+        point_keys = (x << zoom) | y
+        position = np.minimum(np.searchsorted(sorted_keys, point_keys), len(sorted_keys) - 1)
+        hit = (sorted_keys[position] == point_keys) & (found < 0)
+        found[hit] = index[order[position[hit]]]
+    return found
+
+
+def _runs(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Trueが続く範囲の先頭と末尾の次の添字
+    edges = np.diff(np.concatenate([[0], mask.view(np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def score_path(coords: np.ndarray, time_ms: float, rain_data: RainData, now: float | None = None) -> dict:
+    """
+    経路のうち雨の中を通る距離・時間と、雨の区間を求める。
+    区間ごとに中点を含むタイルの降水強度を使う。nowを渡すと、経路の所要時間から各区間の到着時刻を
+    見積もり、その前後RAIN_ETA_SLOT_MARGIN個の予報だけで雨を判定する（渡さなければすべての予報の最大値）。
+    Args:
+        coords (np.ndarray): 経路の [lon, lat] の配列
+        time_ms (float): 経路の所要時間（ミリ秒）
+        rain_data (RainData): 経路の周辺のタイルを取得済みの雨データ
+        now (float | None): 出発時刻（UNIX時間）
+    Returns:
+        dict: distance（雨の中の距離、m）、time（雨の中の時間、ms）、max_intensity（最大の降水強度、mm/h）、
+            unknown_distance（雨データを取得できなかった距離、m）、
+            intervals（雨の区間の [開始点の添字, 終了点の添字, 最大の降水強度] のリスト）
+    """
+    if len(coords) < 2:
+        return {"distance": 0.0, "time": 0, "max_intensity": 0, "unknown_distance": 0.0, "intervals": []}
+
+    lat, lon = segment_midpoints(coords)
+    length = haversine_km(coords[:-1, 1], coords[:-1, 0], coords[1:, 1], coords[1:, 0]) * 1000
+    total = length.sum()
+    # 所要時間は距離に比例して各区間に割り振る
+    seconds = length * (time_ms / 1000 / total) if total > 0 else np.zeros(len(length))
+
+    found = _lookup(rain_data, lat, lon)
+    known = found >= 0
+    slots = np.zeros((len(found), NUM_SLOTS), dtype=np.uint8)
+    slots[known] = rain_data.slots[found[known]]
+    if now is None:
+        intensity = slots.max(axis=1)
+    else:
+        arrival_at = now + np.cumsum(seconds) - seconds / 2
+        arrival = np.rint((arrival_at - rain_data.observed_at) / SLOT_SECONDS).astype(np.int64)[:, None]
+        window = (np.abs(np.arange(NUM_SLOTS) - arrival) <= RAIN_ETA_SLOT_MARGIN) | (arrival >= NUM_SLOTS + RAIN_ETA_SLOT_MARGIN)
+        intensity = np.where(window, slots, 0).max(axis=1)
+    intensity = np.where(known, intensity, 0)
+    rainy = intensity > 0
+
+    starts, ends = _runs(rainy)
+    run_max = np.maximum.reduceat(intensity, starts) if len(starts) else np.zeros(0, dtype=np.uint8)
+    return {
+        "distance": round(float(length[rainy].sum()), 1),
+        "time": int(round(float(seconds[rainy].sum()) * 1000)),
+        "max_intensity": int(intensity.max()),
+        "unknown_distance": round(float(length[~known].sum()), 1),
+        # 区間 i は点 i から点 i+1 まで。GraphHopperのdetailsと同じく [開始点, 終了点, 値] の形にする
+        "intervals": [[int(s), int(e), int(m)] for s, e, m in zip(starts, ends, run_max)],
+    }
+
+
+def path_tiles(paths: list[dict], zoom_level: int = 13) -> TileSet:
+    """
+    経路の区間の中点を含むタイルを、すべての経路についてまとめて返す。
+    Args:
+        paths (list[dict]): GraphHopperのレスポンスの paths
+        zoom_level (int): ズームレベル
+    Returns:
+        TileSet: 重複のないタイル集合
+    """
+    midpoints = [segment_midpoints(coords) for coords in map(path_coordinates, paths) if len(coords) >= 2]
+    if not midpoints:
+        return TileSet([], [], [])
+    lat = np.concatenate([m[0] for m in midpoints])
+    lon = np.concatenate([m[1] for m in midpoints])
+    return TileSet.from_coordinates(lat, lon, zoom_level).unique()
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import os
+import httpx
+
+from src.core.logger import get_logger, payload
+from src.core.metrics import timed
+
+logger = get_logger(__name__)
+
+# GraphHopperエンドポイント（Dockerネットワーク内のサービス名を使用）
+GRAPHHOPPER_URL = os.getenv("GRAPHHOPPER_URL", "http://graphhopper:8989")
+GRAPHHOPPER_TIMEOUT = float(os.getenv("GRAPHHOPPER_TIMEOUT", "30"))
+GRAPHHOPPER_CONNECT_TIMEOUT = float(os.getenv("GRAPHHOPPER_CONNECT_TIMEOUT", "5"))
+GRAPHHOPPER_MAX_CONNECTIONS = int(os.getenv("GRAPHHOPPER_MAX_CONNECTIONS", "32"))
+GRAPHHOPPER_MAX_RETRIES = int(os.getenv("GRAPHHOPPER_MAX_RETRIES", "2"))
+GRAPHHOPPER_RETRY_BACKOFF = float(os.getenv("GRAPHHOPPER_RETRY_BACKOFF", "0.2"))
+
+
+class GraphHopperClient:
+    """
+    GraphHopperへの非同期クライアント。
+    コネクションプールをアプリケーション全体で共有し、接続エラーはバックオフしながら再試行する。
+    """
+
+    def __init__(self, base_url: str = GRAPHHOPPER_URL, timeout: float = GRAPHHOPPER_TIMEOUT,
+                 connect_timeout: float = GRAPHHOPPER_CONNECT_TIMEOUT, max_connections: int = GRAPHHOPPER_MAX_CONNECTIONS,
+                 max_retries: int = GRAPHHOPPER_MAX_RETRIES, retry_backoff: float = GRAPHHOPPER_RETRY_BACKOFF):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers={'Content-Type': 'application/json'},
+        )
+
+    async def route(self, request_body: dict) -> dict:
+        """
+        GraphHopperの /route にリクエストを送信する。
+
+        Args:
+            request_body (dict): リクエストボディ
+
+        Returns:
+            dict: GraphHopperからのルート情報。失敗した場合は "error" を含む辞書
+        """
+        url = f"{self.base_url}/route"
+        try:
+            logger.info("Sending route request to GraphHopper: %s", url)
+            logger.debug("Request body: %s", payload(request_body))
+
+            with timed("graphhopper"):
+                response = await self._post_with_retry("/route", request_body)
+
+            if response.status_code == 200:
+                route_data = response.json()
+                logger.info("Route calculation successful")
+                return route_data
+
+            # GraphHopperからのエラーレスポンスを詳細に処理
+            error_json = None
+            try:
+                error_json = response.json()
+                if "message" in error_json:
+                    error_detail = error_json["message"]
+                    # GraphHopperの具体的なエラーメッセージを含める
+                    if "hints" in error_json and error_json["hints"]:
+                        error_detail += " Details: " + "; ".join([
+                            hint.get("message", "") for hint in error_json["hints"]
+                        ])
+                else:
+                    error_detail = response.text
+            except (json.JSONDecodeError, ValueError):
+                error_detail = response.text
+
+            error_msg = f"GraphHopper API error: {response.status_code} - {error_detail}"
+            logger.error(error_msg)
+            return {
+                "error": error_msg,
+                "status_code": response.status_code,
+                "graphhopper_response": error_json if error_json is not None else response.text
+            }
+
+        except httpx.HTTPError as e:
+            error_msg = f"Request to GraphHopper failed: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "error": error_msg
+            }
+        except Exception as e:
+            error_msg = f"Unexpected error: {str(e)}"
+            logger.error(error_msg)
+            return {
+                "error": error_msg
+            }
+
+    async def _post_with_retry(self, path: str, request_body: dict) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                return await self._client.post(path, json=request_body)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                attempt += 1
+                logger.warning("GraphHopper connection failed (%s), retry %d/%d in %.2fs", e, attempt, self.max_retries, delay)
+                await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+_client: GraphHopperClient | None = None
+
+
+def get_graphhopper_client() -> GraphHopperClient:
+    """
+    アプリケーションで共有するGraphHopperClientを返す（未作成なら作成する）。
+    Returns:
+        GraphHopperClient: 共有クライアント
+    """
+    global _client
+    if _client is None:
+        _client = GraphHopperClient()
+    return _client
+
+
+async def close_graphhopper_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
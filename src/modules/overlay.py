@@ -0,0 +1,187 @@
+import hashlib
+import os
+import re
+import struct
+import zlib
+
+import numpy as np
+
+from .rain_grid import RainGrid, UNKNOWN
+from .values import TileSet
+
+# 現在の時間枠のタイルをキャッシュしてよい秒数（時間枠の途中でも取得済みのセルは増える）
+RAIN_OVERLAY_MAX_AGE = int(os.getenv("RAIN_OVERLAY_MAX_AGE", "60"))
+# 過去の時間枠のタイルをキャッシュしてよい秒数
+RAIN_OVERLAY_PAST_MAX_AGE = int(os.getenv("RAIN_OVERLAY_PAST_MAX_AGE", "600"))
+
+# PNGの1辺の画素数と、GeoJSONで1タイルを分割する最大の数（1辺）
+PNG_SIZE = 256
+GEOJSON_MAX_SIZE = 32
+
+# 降水強度（mm/h）の下限と色。気象庁の降水ナウキャストに近い配色
+_COLOR_LEVELS = [
+    (1, (160, 210, 255)),
+    (5, (33, 140, 255)),
+    (10, (0, 65, 255)),
+    (20, (250, 245, 0)),
+    (30, (255, 153, 0)),
+    (50, (255, 40, 0)),
+    (80, (180, 0, 104)),
+]
+_RAIN_ALPHA = 200
+# 未取得のセルの色（雨なしと区別するため薄い灰色で塗る）
+_UNKNOWN_COLOR = (128, 128, 128)
+_UNKNOWN_ALPHA = 80
+
+
+def _build_palette() -> tuple[bytes, bytes]:
+    # 画素の値（降水強度）をそのままパレットの番号として使う。0（雨なし）は透明、未取得は灰色
+    colors = np.zeros((256, 3), dtype=np.uint8)
+    alpha = np.zeros(256, dtype=np.uint8)
+    for lower, color in _COLOR_LEVELS:
+        colors[lower:UNKNOWN] = color
+    alpha[1:UNKNOWN] = _RAIN_ALPHA
+    colors[UNKNOWN] = _UNKNOWN_COLOR
+    alpha[UNKNOWN] = _UNKNOWN_ALPHA
+    return colors.tobytes(), alpha.tobytes()
+
+
+_PALETTE, _TRANSPARENCY = _build_palette()
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+
+def encode_png(values: np.ndarray) -> bytes:
+    """
+    降水強度の配列をパレット形式のPNGに変換する。
+    Args:
+        values (np.ndarray): (高さ, 幅) のuint8配列
+    Returns:
+        bytes: PNGファイルの内容
+    """
+    height, width = values.shape
+    # 各行の先頭にフィルタの種類（0: なし）を付ける
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), values.astype(np.uint8)]).tobytes()
+    header = struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", header),
+        _png_chunk(b"PLTE", _PALETTE),
+        _png_chunk(b"tRNS", _TRANSPARENCY),
+        _png_chunk(b"IDAT", zlib.compress(raw, 6)),
+        _png_chunk(b"IEND", b""),
+    ])
+
+
+def geojson_size(z: int, grid_zoom: int) -> int:
+    """
+    GeoJSONで1タイルを分割する数（1辺）を返す。格子のセルより細かくは分割しない。
+    Args:
+        z (int): タイルのズームレベル
+        grid_zoom (int): 格子のズームレベル
+    Returns:
+        int: 1辺の分割数
+    """
+    return 1 << max(0, min(GEOJSON_MAX_SIZE.bit_length() - 1, grid_zoom - z))
+
+
+def cells_to_geojson(cells: TileSet, values: np.ndarray) -> dict:
+    """
+    セルと降水強度を、雨と未取得のセルのGeoJSONに変換する。
+    Args:
+        cells (TileSet): セルのタイル集合
+        values (np.ndarray): セルごとの降水強度（uint8、UNKNOWNは未取得）
+    Returns:
+        dict: GeoJSON形式のFeatureCollection（未取得のセルは unknown: true、rainfall: null）
+    """
+    features = []
+    for geometry, value, cx, cy, cz in zip(cells.to_polygons(), values.tolist(), cells.x.tolist(), cells.y.tolist(),
+                                           cells.zoom.tolist()):
+        unknown = value == UNKNOWN
+        features.append({
+            "type": "Feature",
+            "geometry": geometry,
+            "properties": {
+                "rainfall": None if unknown else value,
+                "unknown": unknown,
+                "tile_x": cx,
+                "tile_y": cy,
+                "tile_z": cz,
+            },
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def to_geojson(values: np.ndarray, z: int, x: int, y: int) -> dict:
+    """
+    タイルを分割した降水強度の配列を、雨と未取得のセルのGeoJSONに変換する。
+    Args:
+        values (np.ndarray): (size, size) のuint8配列
+        z (int): タイルのズームレベル
+        x (int): タイルのX座標
+        y (int): タイルのY座標
+    Returns:
+        dict: GeoJSON形式のFeatureCollection
+    """
+    size = values.shape[0]
+    rows, cols = np.nonzero(values > 0)
+    cells = TileSet(x * size + cols, y * size + rows, z + size.bit_length() - 1)
+    return cells_to_geojson(cells, values[rows, cols])
+
+
+def grid_cells(grid: RainGrid, z: int, x: int, y: int, bucket: int,
+               slot: int | None = None) -> tuple[TileSet, np.ndarray] | None:
+    """
+    格子のセルがGeoJSONの分割と一致し、タイル全体が格子の範囲内なら、タイルの雨と未取得のセルを格子から直接読む。
+    Args:
+        grid (RainGrid): 雨の格子
+        z (int): タイルのズームレベル
+        x (int): タイルのX座標
+        y (int): タイルのY座標
+        bucket (int): 10分単位の時間枠
+        slot (int | None): 観測値・予報値の位置（Noneならすべてのうち最大の値）
+    Returns:
+        tuple[TileSet, np.ndarray] | None: セルと降水強度（直接読めない場合はNone）
+    """
+    if z + geojson_size(z, grid.zoom).bit_length() - 1 != grid.zoom:
+        return None
+    shift = grid.zoom - z
+    corners = TileSet([x << shift, ((x + 1) << shift) - 1], [y << shift, ((y + 1) << shift) - 1], grid.zoom)
+    if not grid.contains(corners).all():
+        return None
+    lat, lon = corners.centers()
+    return grid.rainy_in_bbox(lat.min(), lon.min(), lat.max(), lon.max(), bucket, slot=slot, include_unknown=True)
+
+
+def etag(*parts) -> str:
+    """
+    タイルの内容からETagを求める。
+    Args:
+        *parts: 内容を決める値（bytesはそのまま、それ以外は文字列にして使う）
+    Returns:
+        str: 引用符付きのETag
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()[:20]}"'
+
+
+def etag_matches(if_none_match: str, tag: str) -> bool:
+    """
+    If-None-Matchヘッダーのいずれかのエンティティタグが、弱い比較でETagと一致するかどうかを返す。
+    Args:
+        if_none_match (str): If-None-Matchヘッダーの値（カンマ区切りのエンティティタグ、または *）
+        tag (str): 引用符付きのETag
+    Returns:
+        bool: 一致すればTrue
+    """
+    opaque = tag[2:] if tag.startswith("W/") else tag
+    for match in re.finditer(r'\*|(?:W/)?"[^"]*"', if_none_match):
+        value = match.group()
+        if value == "*" or (value[2:] if value.startswith("W/") else value) == opaque:
+            return True
+    return False
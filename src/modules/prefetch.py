@@ -0,0 +1,171 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+
+from .rain_cache import run_every_bucket, time_bucket
+from .rain_grid import get_rain_grid, NUM_SLOTS, UNKNOWN
+from .rain_store import get_rain_store
+from .values import bounding_box, coordinate, TileSet
+from .yahoo_client import get_yahoo_client
+from src.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+JST = timezone(timedelta(hours=9))
+
+# 例: "35.5,139.4,35.9,140.0;34.5,135.3,34.9,135.7"（南西の緯度,経度,北東の緯度,経度をセミコロン区切り）
+RAIN_PREFETCH_BBOXES = os.getenv("RAIN_PREFETCH_BBOXES", "")
+# Yahoo!のデータ更新を待つため、10分境界から何秒後に取得するか
+RAIN_PREFETCH_OFFSET = float(os.getenv("RAIN_PREFETCH_OFFSET", "60"))
+RAIN_PREFETCH_ZOOM = int(os.getenv("RAIN_PREFETCH_ZOOM", "13"))
+
+
+def parse_regions(value: str) -> list[bounding_box]:
+    """
+    環境変数の文字列からプリフェッチ対象の領域を読み込む。
+    Args:
+        value (str): "lat1,lon1,lat2,lon2" をセミコロンで区切った文字列
+    Returns:
+        list[bounding_box]: 領域のリスト
+    """
+    regions = []
+    for part in value.split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        lat1, lon1, lat2, lon2 = map(float, part.split(","))
+        regions.append(bounding_box(coordinate(lat1, lon1), coordinate(lat2, lon2)))
+    return regions
+
+
+class RainPrefetcher:
+    """
+    サービス領域内のタイルの雨データをYahoo!の更新周期ごとに取得し、
+    リクエスト処理からはメモリ上のグリッドを参照できるようにする。
+    """
+
+    def __init__(self, appid: str, regions: list[bounding_box], zoom_level: int = RAIN_PREFETCH_ZOOM,
+                 offset: float = RAIN_PREFETCH_OFFSET):
+        self.appid = appid
+        self.zoom_level = zoom_level
+        self.offset = offset
+        # 取得した時間枠とタイルごとの値。読み出し中に差し替わっても食い違わないよう、組にして保持する
+        self.snapshot: tuple[int | None, dict[tuple[int, int, int], bytes]] = (None, {})
+        self.updated_at: datetime | None = None
+        self._task: asyncio.Task | None = None
+
+        tiles = TileSet.concatenate([region.create_tile_set(zoom_level=zoom_level) for region in regions]).unique()
+        self.tiles = tiles
+        self.tile_keys = tiles.keys()
+        self.tile_centers = tiles.to_coordinates()
+        logger.info("Rain prefetcher covers %d tiles in %d regions", len(self.tile_keys), len(regions))
+
+    def lookup(self, key: tuple[int, int, int], bucket: int) -> bytes | None:
+        """
+        プリフェッチ済みのタイルの雨データを返す。
+        Args:
+            key (tuple[int, int, int]): タイルの (x, y, zoom)
+            bucket (int): 10分単位の時間枠
+        Returns:
+            bytes | None: 観測値・予報値の降水強度（領域外、未取得、または別の時間枠の値しかない場合はNone）
+        """
+        snapshot_bucket, grid = self.snapshot
+        if snapshot_bucket != bucket:
+            return None
+        return grid.get(key)
+
+    def clear(self) -> None:
+        """
+        プリフェッチ済みのグリッドを空にする（次の更新まで、リクエストはYahoo!から取得する）。
+        """
+        self.snapshot = (None, {})
+        self.updated_at = None
+
+    def refresh(self) -> None:
+        """
+        領域内の全タイルの雨データを取得し、グリッドを差し替える。
+        同じ時間枠の値を格子・共有ストアにすでに持つタイルは問い合わせない。共有ストアを使う場合は、
+        時間枠ごとに1つのワーカープロセスだけがYahoo!に問い合わせ、他のプロセスはストアの値を使う。
+        取得に失敗したタイルは、同じ時間枠の前回の値があれば残す（前の時間枠の値は引き継がない）。
+        """
+        now = datetime.now(JST)
+        bucket = time_bucket(now)
+        started = time.monotonic()
+        previous_bucket, previous = self.snapshot
+        snapshot = dict(previous) if previous_bucket == bucket else {}
+
+        # リクエスト処理や他のワーカープロセスが取得済みのタイル
+        rain_grid = get_rain_grid()
+        if self.zoom_level == rain_grid.zoom:
+            slots = rain_grid.values(self.tiles, bucket)
+            for i in np.flatnonzero(slots[:, 0] != UNKNOWN).tolist():
+                snapshot[self.tile_keys[i]] = slots[i].tobytes()
+        missing = [i for i, key in enumerate(self.tile_keys) if key not in snapshot]
+        store = get_rain_store()
+        if store is not None and missing:
+            found = store.get_many([self.tile_keys[i] for i in missing], bucket)
+            snapshot.update(found)
+            stored = [i for i in missing if self.tile_keys[i] in found]
+            if stored:
+                records = b"".join(found[self.tile_keys[i]] for i in stored)
+                rain_grid.update(self.tiles[np.array(stored)], np.frombuffer(records, dtype=np.uint8).reshape(len(stored), NUM_SLOTS), bucket)
+            missing = [i for i in missing if self.tile_keys[i] not in found]
+
+        if missing and store is not None and not store.claim("prefetch", bucket):
+            # 他のワーカープロセスが先読みしている。リクエスト処理はストアから読む
+            self.snapshot = (bucket, snapshot)
+            logger.info("Rain prefetch for this bucket runs in another process; %d/%d tiles loaded from store",
+                        len(snapshot), len(self.tile_keys))
+            return
+
+        fetched_count = 0
+        if missing:
+            index = np.array(missing, dtype=np.int64)
+            fetched = get_yahoo_client().fetch([self.tile_centers[i] for i in missing], self.appid,
+                                               now.strftime('%Y%m%d%H%M'), prefetch=True)
+            ok = fetched[:, 0] != UNKNOWN
+            items = [(self.tile_keys[i], row.tobytes()) for i, row in zip(index[ok].tolist(), fetched[ok])]
+            snapshot.update(items)
+            # 雨の重ね合わせ（/rain/{z}/{x}/{y}）でも使えるよう、雨の格子にも書き込む
+            rain_grid.update(self.tiles[index[ok]], fetched[ok], bucket)
+            if store is not None:
+                store.put_many(items, bucket)
+            fetched_count = len(items)
+        self.snapshot = (bucket, snapshot)
+        self.updated_at = now
+        logger.info("Rain prefetch refreshed %d/%d tiles (%d fetched) in %.1fs",
+                    len(snapshot), len(self.tile_keys), fetched_count, time.monotonic() - started)
+
+    async def _refresh(self) -> None:
+        try:
+            await asyncio.to_thread(self.refresh)
+        except Exception as e:
+            logger.error("Rain prefetch failed: %s", e)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(run_every_bucket(self.offset, self._refresh, immediately=True))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+_prefetcher: RainPrefetcher | None = None
+
+
+def get_prefetcher() -> RainPrefetcher | None:
+    return _prefetcher
+
+
+def set_prefetcher(prefetcher: RainPrefetcher | None) -> None:
+    global _prefetcher
+    _prefetcher = prefetcher
@@ -0,0 +1,43 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from src.core.cache import TTLCache
+
+# Yahoo!の雨雲レーダーは10分ごとに更新される
+NOWCAST_INTERVAL_SECONDS = 600
+RAIN_CACHE_TTL = float(os.getenv("RAIN_CACHE_TTL", str(NOWCAST_INTERVAL_SECONDS)))
+RAIN_CACHE_MAX_ENTRIES = int(os.getenv("RAIN_CACHE_MAX_ENTRIES", "200000"))
+
+# キー: (x, y, zoom, time_bucket)、値: 観測値・予報値の降水強度（NUM_SLOTSバイトのbytes）
+rain_cache = TTLCache(max_entries=RAIN_CACHE_MAX_ENTRIES, ttl=RAIN_CACHE_TTL)
+
+
+def time_bucket(date: datetime) -> int:
+    """
+    日時を10分単位のナウキャスト時間枠に変換する。
+    Args:
+        date (datetime): 日時（タイムゾーン付き）
+    Returns:
+        int: 時間枠の番号
+    """
+    return int(date.timestamp()) // NOWCAST_INTERVAL_SECONDS
+
+
+async def run_every_bucket(offset: float, fn: Callable[[], Awaitable[None]], immediately: bool = False) -> None:
+    """
+    10分境界からoffset秒後ごとにfnを実行し続ける（タスクがキャンセルされるまで戻らない）。
+    Args:
+        offset (float): 10分境界から実行までの秒数（Yahoo!のデータ更新を待つ）
+        fn (Callable[[], Awaitable[None]]): 実行する非同期関数（例外は呼び出し側で処理する）
+        immediately (bool): Trueなら最初の境界を待たずに1回実行する
+    """
+    if immediately:
+        await fn()
+    while True:
+        now = time.time()
+        next_run = (now // NOWCAST_INTERVAL_SECONDS + 1) * NOWCAST_INTERVAL_SECONDS + offset
+        await asyncio.sleep(max(1.0, next_run - now))
+        await fn()
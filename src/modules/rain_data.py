@@ -1,162 +1,482 @@
 import json
-import requests
+import os
+import time
+import numpy as np
 from datetime import datetime
 
-from .values import coordinate, _deg2num, tile
+from .values import coordinate, TileSet
+from .area_merge import merge_tiles, RAIN_AREA_MERGE
+from .prefetch import get_prefetcher
+from .rain_cache import rain_cache, time_bucket
+from .rain_grid import get_rain_grid, shift_slots, NUM_SLOTS, SLOT_SECONDS, UNKNOWN
+from .rain_store import get_rain_store
+from .yahoo_client import get_yahoo_client, get_yahoo_scheduler
 from src.core.logger import get_logger
 
 logger = get_logger(__name__)
 
+# 期限までに取得できなかったタイルに、何個前の時間枠までの値を使うか（0なら使わない）
+RAIN_STALE_MAX_BUCKETS = int(os.getenv("RAIN_STALE_MAX_BUCKETS", "1"))
+# 到着予定時刻で雨を判定する場合に、前後いくつの予報（10分ごと）まで雨とみなすか
+RAIN_ETA_SLOT_MARGIN = int(os.getenv("RAIN_ETA_SLOT_MARGIN", "1"))
+
+
+def _ancestors(tiles: TileSet, zoom: int, ancestor_zoom: int) -> TileSet:
+    shift = zoom - ancestor_zoom
+    return TileSet(tiles.x >> shift, tiles.y >> shift, ancestor_zoom)
+
+
+def _children(tiles: TileSet) -> TileSet:
+    dx = np.array([0, 1, 0, 1])
+    dy = np.array([0, 0, 1, 1])
+    return TileSet(
+        (tiles.x[:, None] * 2 + dx).ravel(),
+        (tiles.y[:, None] * 2 + dy).ravel(),
+        np.repeat(tiles.zoom + 1, 4),
+    )
+
+
+def _int_keys(tiles: TileSet) -> np.ndarray:
+    # タイルを1つの整数にまとめる（np.isinで集合の演算をするため）
+    return (tiles.zoom << 50) | (tiles.x << 25) | tiles.y
+
+
+def _from_records(records) -> np.ndarray:
+    # キャッシュ・ストアの値（NUM_SLOTSバイトのbytes）をまとめて配列に変換する
+    return np.frombuffer(b"".join(records), dtype=np.uint8).reshape(-1, NUM_SLOTS)
+
+
+def _previous_slots(grid, tiles: TileSet, keys: list[tuple], bucket: int) -> np.ndarray:
+    # 以前の時間枠の格子の値と、格子にないタイル（粗いタイルなど）のプリフェッチ・キャッシュの値
+    slots = grid.values(tiles, bucket)
+    prefetcher = get_prefetcher()
+    for i in np.flatnonzero(slots[:, 0] == UNKNOWN).tolist():
+        record = prefetcher.lookup(keys[i], bucket) if prefetcher is not None else None
+        if record is None:
+            record = rain_cache.get(keys[i] + (bucket,))
+        if record is not None:
+            slots[i] = _from_records([record])[0]
+    return slots
+
+
+def _late_writer(keys: list[tuple], bucket: int):
+    # 期限後に返った結果も捨てずにキャッシュ・ストア・格子に書き込み、次のリクエストで使う
+    def on_late(index: int, row: np.ndarray) -> None:
+        key = keys[index]
+        record = row.tobytes()
+        rain_cache.set(key + (bucket,), record)
+        store = get_rain_store()
+        if store is not None:
+            store.put_many([(key, record)], bucket)
+        x, y, zoom = key
+        get_rain_grid().update(TileSet([x], [y], [zoom]), row[None, :], bucket)
+    return on_late
+
+
 class RainData:
     def __init__(self, appid: str):
         self.appid = appid
         self.num_rain_tiles = 0
         self.rain_tile_list = []
+        self.rain_tiles = TileSet([], [], [])
+        # to_request_jsonで結合する前のタイル数と結合後のポリゴン数
+        self.num_areas_before = 0
+        self.num_areas_after = 0
+        # 雨データを取得できたタイルと、タイルごとの観測値・予報値の降水強度（0は雨なし）
+        self.feature_tiles = TileSet([], [], [])
+        self.slots = np.zeros((0, NUM_SLOTS), dtype=np.uint8)
+        # 観測値の時刻（UNIX時間）と、タイルごとの到着時刻に対応する予報の位置（Noneなら時刻を考慮しない）
+        self.observed_at = 0.0
+        self.arrival_slots = None
+        # 期限までに取得できず以前の時間枠の値で補ったタイルと、値がまったくないタイル
+        self.stale_tiles = TileSet([], [], [])
+        self.unknown_tiles = TileSet([], [], [])
+
+    @property
+    def intensity(self) -> np.ndarray:
+        """
+        タイルごとの観測値・予報値のうち最大の降水強度。
+        """
+        return self.slots.max(axis=1) if len(self.slots) else np.zeros(0, dtype=np.uint8)
 
+    @property
+    def complete(self) -> bool:
+        """
+        すべてのタイルで現在の時間枠の雨データを取得できたかどうか。
+        """
+        return len(self.stale_tiles) == 0 and len(self.unknown_tiles) == 0
 
-    def get(self, coordinate_list: list[coordinate], date: datetime):
+    def status(self) -> dict:
+        """
+        取得状況をレスポンスに含める形式で返す。
+        Returns:
+            dict: complete、stale_tiles、unknown_tiles（タイル数）、nowcast_time（観測値の時刻、UNIX時間）
+        """
+        return {
+            "complete": self.complete,
+            "stale_tiles": len(self.stale_tiles),
+            "unknown_tiles": len(self.unknown_tiles),
+            "nowcast_time": int(self.observed_at),
+        }
+
+
+    def get(self, coordinate_list: list[coordinate] | TileSet, date: datetime, zoom_level: int = 13,
+            deadline: float | None = None):
+        """
+        座標（またはタイル集合の各タイルの中心）の雨データを取得する。
+        期限までにYahoo!から返らなかったタイルは、以前の時間枠の値があればそれで補う。
+        Args:
+            coordinate_list (list[coordinate] | TileSet): 座標のリスト、またはタイル集合
+            date (datetime): 取得日時
+            zoom_level (int): 座標のリストを渡した場合に、キャッシュのキーとするタイルのズームレベル
+            deadline (float | None): Yahoo!の応答を待つ期限（time.monotonic()の値、Noneなら完了まで待つ）
+        """
         date_str = date.strftime('%Y%m%d%H%M')
-        logger.debug("Starting rain data fetch for %d coordinates on %s", len(coordinate_list), date_str)
-        
-        # coordinate_listを10個ずつに分割
-        chunk_size = 10
-        chunks = [coordinate_list[i:i + chunk_size] for i in range(0, len(coordinate_list), chunk_size)]
-        logger.debug("Split coordinates into %d chunks of size %d", len(chunks), chunk_size)
-        
-        merged_data = {"Feature": []}
-        total_features = 0
-
-
-        # URLは一度に10座標が上限だった
-        for chunk_index, chunk in enumerate(chunks):
-            coord_pairs = ' '.join([f'{coord.lon},{coord.lat}' for coord in chunk])
-            url = f'https://map.yahooapis.jp/weather/V1/place?coordinates={coord_pairs}&appid={self.appid}&output=json&date={date_str}'
-            logger.debug("Processing chunk %d/%d with %d coordinates", chunk_index + 1, len(chunks), len(chunk))
-                
-            try:
-                response = requests.get(url)
-                logger.debug("Response status: %d for chunk %d", response.status_code, chunk_index + 1)
-                
-                if response.status_code != 200:
-                    logger.error("Error fetching data for chunk %d: %s - %s", chunk_index + 1, response.status_code, response.text)
-                    continue
-                
-                chunk_data = response.json()
-                
-                if "Feature" in chunk_data:
-                    features_count = len(chunk_data["Feature"])
-                    merged_data["Feature"].extend(chunk_data["Feature"])
-                    total_features += features_count
-                    logger.debug("Added %d features from chunk %d, total features: %d", features_count, chunk_index + 1, total_features)
-                else:
-                    logger.debug("No 'Feature' key found in chunk %d response", chunk_index + 1)
-                    
-            except Exception as e:
-                logger.error("Exception while processing chunk %d: %s", chunk_index + 1, e)
-                continue
-        
-        self.data = merged_data
-        logger.debug("Rain data fetch completed. Total features: %d", total_features)
-        
-
-    def to_tile_geojson(self, zoom_level: int = 13):
-        """
-        雨データをタイル座標に変換し、GeoJSON形式のFeatureCollectionを返す
+        bucket = time_bucket(date)
+        self.observed_at = float(bucket * SLOT_SECONDS)
+        self.arrival_slots = None
+
+        if isinstance(coordinate_list, TileSet):
+            tiles = coordinate_list
+            coordinate_list = None
+        else:
+            tiles = TileSet.from_coordinates(
+                np.array([coord.lat for coord in coordinate_list]),
+                np.array([coord.lon for coord in coordinate_list]),
+                zoom_level,
+            )
+        logger.debug("Starting rain data fetch for %d coordinates on %s", len(tiles), date_str)
+
+        # 格子に現在の時間枠の値があるタイルは、キャッシュを参照せずにそのまま使う
+        grid = get_rain_grid()
+        slots = grid.values(tiles, bucket)
+        pending = np.flatnonzero(slots[:, 0] == UNKNOWN).tolist()
+
+        # プリフェッチ済み・キャッシュ済みのタイルはYahoo!に問い合わせない
+        prefetcher = get_prefetcher()
+        tile_keys = tiles.keys()
+        records = {}
+        prefetched = 0
+        for i in pending:
+            record = prefetcher.lookup(tile_keys[i], bucket) if prefetcher is not None else None
+            if record is not None:
+                prefetched += 1
+            else:
+                record = rain_cache.get(tile_keys[i] + (bucket,))
+            if record is not None:
+                records[i] = record
+        missing = [i for i in pending if i not in records]
+        cached = len(records) - prefetched
+
+        # 他のワーカープロセスや再起動前に取得したタイルは共有ストアから読む
+        store = get_rain_store()
+        stored = 0
+        if store is not None and missing:
+            found = store.get_many([tile_keys[i] for i in missing], bucket)
+            for i in missing:
+                record = found.get(tile_keys[i])
+                if record is not None:
+                    records[i] = record
+                    rain_cache.set(tile_keys[i] + (bucket,), record)
+            stored = len(found)
+            missing = [i for i in missing if i not in records]
+
+        # 新たに得た値を格子に書き込む
+        if records:
+            index = np.fromiter(records.keys(), dtype=np.int64, count=len(records))
+            slots[index] = _from_records(records.values())
+            grid.update(tiles[index], slots[index], bucket)
+        logger.debug("Rain tiles from grid: %d, prefetch: %d, cache hits: %d, store hits: %d, misses: %d",
+                     len(tiles) - len(pending), prefetched, cached, stored, len(missing))
+
+        if missing and deadline is not None and time.monotonic() >= deadline:
+            logger.warning("Rain fetch budget exhausted before querying %d tiles", len(missing))
+        elif missing:
+            if coordinate_list is None:
+                missing_coords = tiles[np.array(missing)].to_coordinates()
+            else:
+                missing_coords = [coordinate_list[i] for i in missing]
+            # チャンクは並列に取得されるが、結果は座標の順番どおりに返る
+            missing_keys = [tile_keys[i] for i in missing]
+            on_late = _late_writer(missing_keys, bucket) if deadline is not None else None
+            scheduler = get_yahoo_scheduler()
+            if scheduler is not None:
+                # 他のリクエストの座標とまとめ、同じタイルの問い合わせは共有する
+                fetched = scheduler.fetch(missing_keys, missing_coords, self.appid, date_str, deadline, on_late)
+            else:
+                fetched = get_yahoo_client().fetch(missing_coords, self.appid, date_str, deadline, on_late)
+            ok = fetched[:, 0] != UNKNOWN
+            index = np.array(missing, dtype=np.int64)[ok]
+            slots[index] = fetched[ok]
+            grid.update(tiles[index], slots[index], bucket)
+            items = [(tile_keys[i], row.tobytes()) for i, row in zip(index.tolist(), fetched[ok])]
+            for key, record in items:
+                rain_cache.set(key + (bucket,), record)
+            if store is not None:
+                store.put_many(items, bucket)
+
+        # 取得できなかったタイルは以前の時間枠の値で補う（現在の時間枠の格子には書き込まない）
+        stale = np.zeros(len(tiles), dtype=bool)
+        for age in range(1, RAIN_STALE_MAX_BUCKETS + 1):
+            unknown = np.flatnonzero(slots[:, 0] == UNKNOWN)
+            if len(unknown) == 0:
+                break
+            previous = _previous_slots(grid, tiles[unknown], [tile_keys[i] for i in unknown], bucket - age)
+            slots[unknown] = shift_slots(previous, age)
+            stale[unknown] = slots[unknown, 0] != UNKNOWN
+
+        found = slots[:, 0] != UNKNOWN
+        self.feature_tiles = tiles[found]
+        self.slots = slots[found]
+        self.stale_tiles = tiles[stale]
+        self.unknown_tiles = tiles[~found]
+        if not self.complete:
+            logger.warning("Rain data incomplete: %d stale tiles, %d unknown tiles",
+                           len(self.stale_tiles), len(self.unknown_tiles))
+        logger.debug("Rain data fetch completed. Total tiles: %d", len(self.feature_tiles))
+
+
+    def get_adaptive(self, tiles: TileSet, date: datetime, coarse_zoom: int = 11, deadline: float | None = None):
+        """
+        粗いズームレベルから雨データを取得し、必要なタイルだけを細かいズームレベルで取得し直す。
+        雨が観測されたタイルと、隣接タイルと雨の有無が異なるタイルを1段ずつ細分化する。
+        周囲8タイルがすべて雨のタイルは細分化せず、そのズームレベルのまま雨のタイルとする。
+        取得範囲の端のタイルは範囲外の隣接タイルを雨なしとみなして細分化するため、粗いタイルのまま残るのは
+        雨の領域の内部だけになる（内部の粗いタイルは、中の細かいタイルに雨なしがあっても全体を雨とする）。
+        値のないタイルは、期限までに時間が残っていれば細分化して取得し直す。
+        Args:
+            tiles (TileSet): 最終的に対象とするタイル集合（同じズームレベル）
+            date (datetime): 取得日時
+            coarse_zoom (int): 最初に取得するズームレベル
+            deadline (float | None): Yahoo!の応答を待つ期限（time.monotonic()の値、Noneなら完了まで待つ）
+        """
+        if len(tiles) == 0:
+            self.get(tiles, date, deadline=deadline)
+            return
+        target_zoom = int(tiles.zoom.max())
+        coarse_zoom = min(coarse_zoom, target_zoom)
+
+        leaf_tiles = []
+        leaf_slots = []
+        stale_tiles = []
+        unknown_tiles = []
+        num_queried = 0
+        current = _ancestors(tiles, target_zoom, coarse_zoom).unique()
+        for zoom in range(coarse_zoom, target_zoom + 1):
+            self.get(current, date, deadline=deadline)
+            num_queried += len(current)
+            fetched = self.feature_tiles
+            rainy = self.rain_mask()
+
+            if zoom == target_zoom:
+                keep = np.ones(len(fetched), dtype=bool)
+                refine_keys = set()
+            else:
+                rain_by_key = dict(zip(fetched.keys(), rainy.tolist()))
+                refine_keys = set()
+                for key, is_rainy in rain_by_key.items():
+                    x, y, z = key
+                    # 取得範囲外・値のない隣接タイル（None）は雨なしとみなす
+                    neighbors = [rain_by_key.get((x + dx, y + dy, z)) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+                    if is_rainy and not all(neighbors):
+                        refine_keys.add(key)
+                    elif not is_rainy and any(neighbors):
+                        refine_keys.add(key)
+                # 取得できなかったタイルも、期限までに時間が残っていれば細分化して取得し直す
+                if deadline is None or time.monotonic() < deadline:
+                    refine_keys.update(self.unknown_tiles.keys())
+                keep = np.array([key not in refine_keys for key in fetched.keys()], dtype=bool)
+
+            leaf_tiles.append(fetched[keep])
+            leaf_slots.append(self.slots[keep])
+            kept_keys = set(fetched[keep].keys())
+            stale_keys = self.stale_tiles.keys()
+            stale_tiles.append(self.stale_tiles[np.array([key in kept_keys for key in stale_keys], dtype=bool)])
+            unknown_keys = self.unknown_tiles.keys()
+            unknown_tiles.append(self.unknown_tiles[np.array([key not in refine_keys for key in unknown_keys], dtype=bool)])
+            if not refine_keys:
+                break
+
+            refine = TileSet(*(np.array(v, dtype=np.int64) for v in zip(*refine_keys)))
+            children = _children(refine)
+            wanted = set(_ancestors(tiles, target_zoom, zoom + 1).keys())
+            current = children[np.array([key in wanted for key in children.keys()], dtype=bool)]
+            logger.debug("Adaptive sampling: refining %d tiles at zoom %d into %d tiles", len(refine), zoom, len(current))
+
+        self.feature_tiles = TileSet.concatenate(leaf_tiles)
+        self.slots = np.concatenate(leaf_slots)
+        # 細分化しなかったタイルを、すべてのズームレベルについて数える
+        self.stale_tiles = TileSet.concatenate(stale_tiles)
+        self.unknown_tiles = TileSet.concatenate(unknown_tiles)
+        logger.info("Adaptive sampling queried %d tiles instead of %d (coarse zoom %d)", num_queried, len(tiles), coarse_zoom)
+
+
+    def set_arrival(self, eta_seconds: np.ndarray, now: float):
+        """
+        タイルごとの到着予定時刻を設定し、以降はその時刻の予報だけで雨を判定する。
         Args:
-            zoom_level (int): タイルのズームレベル
+            eta_seconds (np.ndarray): self.feature_tiles に対応する到着までの秒数。
+                複数の出発地点がある場合は (出発地点数, タイル数) の配列で、いずれかの到着時刻に雨なら雨とする
+            now (float): 出発時刻（UNIX時間）
+        """
+        eta_seconds = np.atleast_2d(np.asarray(eta_seconds, dtype=np.float64))
+        arrival = np.rint((now + eta_seconds - self.observed_at) / SLOT_SECONDS).astype(np.int64)
+        # 予報の範囲より先に到着するタイルは、すべての予報を考慮する（-1）
+        arrival[arrival >= NUM_SLOTS + RAIN_ETA_SLOT_MARGIN] = -1
+        self.arrival_slots = arrival
+
+    def effective_intensity(self, index: np.ndarray | None = None) -> np.ndarray:
+        """
+        雨の判定に使う、タイルごとの降水強度を返す。
+        到着予定時刻が設定されていれば、その前後RAIN_ETA_SLOT_MARGIN個の予報のうち最大の値、なければ全体の最大値。
+        Args:
+            index (np.ndarray | None): 対象とするタイルの添字（Noneならすべてのタイル）
+        Returns:
+            np.ndarray: self.feature_tiles（indexを渡した場合はその添字のタイル）に対応するuint8配列
+        """
+        slots = self.slots if index is None else self.slots[index]
+        if len(slots) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        if self.arrival_slots is None:
+            return slots.max(axis=1)
+        arrival = (self.arrival_slots if index is None else self.arrival_slots[:, index])[:, :, None]
+        window = (np.abs(np.arange(NUM_SLOTS) - arrival) <= RAIN_ETA_SLOT_MARGIN) | (arrival < 0)
+        return np.where(window, slots[None, :, :], 0).max(axis=(0, 2)).astype(np.uint8)
+
+    def _rain_candidates(self) -> np.ndarray:
+        # 現在の時間枠の格子から範囲内の雨のセルをまとめて読み、雨の可能性があるタイルだけに絞る。
+        # 格子のセルは観測値・予報値のいずれかが雨なら雨とするため、到着時刻で絞る前の候補として使える。
+        # 以前の時間枠の値で補ったタイルと、格子のセルでないタイル（粗いズームレベルなど）は格子にないため常に候補とする
+        tiles = self.feature_tiles
+        grid = get_rain_grid()
+        bucket = int(self.observed_at // SLOT_SECONDS)
+        direct = grid.contains(tiles)
+        if len(self.stale_tiles):
+            direct &= ~np.isin(_int_keys(tiles), _int_keys(self.stale_tiles))
+        if not direct.any() or grid.snapshot(bucket) is None:
+            return np.ones(len(tiles), dtype=bool)
+        lat, lon = tiles[direct].centers()
+        cells, _ = grid.rainy_in_bbox(lat.min(), lon.min(), lat.max(), lon.max(), bucket)
+        return ~direct | np.isin(_int_keys(tiles), _int_keys(cells))
+
+    def rainy_tiles(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        雨のタイルの添字と降水強度を返す（重複するタイルは最初のものだけ）。
+        Returns:
+            tuple[np.ndarray, np.ndarray]: self.feature_tiles の添字と、その降水強度（uint8）
+        """
+        index = np.flatnonzero(self._rain_candidates())
+        intensity = self.effective_intensity(index)
+        rainy = intensity > 0
+        index, intensity = index[rainy], intensity[rainy]
+        first_index = self.feature_tiles[index].unique_index()
+        return index[first_index], intensity[first_index]
+
+    def rain_mask(self) -> np.ndarray:
+        """
+        取得したタイルごとに雨かどうかを返す。
+        Returns:
+            np.ndarray: self.feature_tiles に対応するbool配列
+        """
+        return self.effective_intensity() > 0
+
+
+    def to_tile_geojson(self):
+        """
+        雨のタイルをGeoJSON形式のFeatureCollectionに変換する
         Returns:
             dict: GeoJSON形式のFeatureCollection
         """
-        logger.debug("Converting rain data to tile-based GeoJSON with zoom_level: %d", zoom_level)
+        logger.debug("Converting rain data to tile-based GeoJSON")
+        rain_index, intensity = self.rainy_tiles()
+        rain_tiles = self.feature_tiles[rain_index]
+
+        self.rain_tiles = rain_tiles
+        self.rain_tile_list = rain_tiles.to_tiles()
+        self.num_rain_tiles = len(rain_tiles)
+
         features = []
-        processed_features = 0
-        rain_features = 0
-        unique_tiles = set()  # 重複タイルを防ぐためのセット
-        
-        # タイルリストをクリア
-        self.num_rain_tiles = 0
-        self.rain_tile_list = []
+        for rainfall, geometry, tile_obj in zip(intensity.tolist(), rain_tiles.to_polygons(), self.rain_tile_list):
+            features.append({
+                "type": "Feature",
+                "geometry": geometry,
+                "properties": {
+                    "rainfall": rainfall,
+                    "rain": True,
+                    "tile_x": tile_obj.x,
+                    "tile_y": tile_obj.y,
+                    "tile_z": tile_obj.zoom
+                }
+            })
 
-        for feat in self.data.get("Feature", []):
-            processed_features += 1
-            try:
-                lon, lat = map(float, feat["Geometry"]["Coordinates"].split(","))
-                weather_list = feat["Property"]["WeatherList"]["Weather"]
-
-                # いずれかでrainfall>0ならタイルポリゴン作成
-                if any(w.get("Rainfall", 0) > 0 for w in weather_list):
-                    tile_obj = _deg2num(coordinate(lat, lon), zoom_level)
-                    tile_key = (tile_obj.x, tile_obj.y, tile_obj.zoom)
-                    
-                    # 既に処理済みのタイルかチェック
-                    if tile_key not in unique_tiles:
-                        unique_tiles.add(tile_key)
-                        rain_features += 1
-                        self.num_rain_tiles += 1
-                        self.rain_tile_list.append(tile_obj)
-                        tile_geojson = tile_obj.to_geojson()
-                        features.append({
-                            "type": "Feature",
-                            "geometry": tile_geojson["features"][0]["geometry"],
-                            "properties": {
-                                "id": feat.get("Id"),
-                                "rain": True,
-                                "tile_x": tile_obj.x,
-                                "tile_y": tile_obj.y,
-                                "tile_z": tile_obj.zoom
-                            }
-                        })
-                else:
-                    continue
-            except Exception as e:
-                logger.warning("Skip feature %d due to error: %s", processed_features, e)
-                continue
-        
         # with open('rain_data.geojson', 'w', encoding='utf-8') as f:
         #     json.dump({"type": "FeatureCollection", "features": features}, f, ensure_ascii=False, indent=2)
         #     logger.debug("Rain data written to rain_data.geojson with %d features", len(features))
-        logger.debug("Tile-based GeoJSON conversion completed. Processed: %d features, Rain features: %d", processed_features, rain_features)
+        logger.debug("Tile-based GeoJSON conversion completed. Processed: %d tiles, Rain features: %d", len(self.feature_tiles), len(features))
         return {
             "type": "FeatureCollection",
             "features": features
         }
 
 
-    def to_request_json(self):
+    def to_request_json(self, tiles: TileSet | None = None):
         """
         RainDataのGeoJSONをGraphHopperのリクエスト形式に変換
         雨が降るエリアを回避するためのpriority設定とareas定義を生成
-        
+        隣接する雨のタイルはRAIN_AREA_MERGEの設定に従って矩形に結合する
+
+        Args:
+            tiles (TileSet | None): 回避するタイル集合（省略時は取得した雨データから求める）
         Returns:
             dict: GraphHopperリクエスト用のpriority・areas設定
             list[tile]: タイルリスト
         """
         logger.debug("Converting rain data to GraphHopper request format")
-        geojson = self.to_tile_geojson()
-        features = geojson.get("features", [])
-        logger.debug("Got %d features from GeoJSON conversion", len(features))
-        
+        if tiles is None:
+            self.to_tile_geojson()
+            tiles = self.rain_tiles
+        else:
+            tiles = tiles.unique()
+        tile_list = tiles.to_tiles()
+        self.num_areas_before = len(tiles)
+
+        if RAIN_AREA_MERGE == "off":
+            area_ids = [str(i) for i in range(len(tiles))]
+            geometries = tiles.to_polygons()
+            self.num_areas_after = len(tiles)
+        else:
+            rects = merge_tiles(tiles)
+            self.num_areas_after = len(rects)
+            if RAIN_AREA_MERGE == "rectangles":
+                area_ids = [str(i) for i in range(len(rects))]
+                geometries = rects.to_polygons()
+            elif len(rects) > 0:
+                area_ids = ["rain"]
+                geometries = [rects.to_multipolygon()]
+            else:
+                area_ids = []
+                geometries = []
+
         # priority設定を生成（各エリアのmultiply_byを0にして回避）
         priority = []
         modified_features = []
-        
-        for i, feature in enumerate(features):
+
+        for area_id, geometry in zip(area_ids, geometries):
             # priorityにif条件を追加
             priority.append({
-                "if": f"in_{i}",
+                "if": f"in_{area_id}",
                 "multiply_by": "0"
             })
-            
+
             # featureにidを追加し、propertiesを空にする
             modified_feature = {
                 "type": "Feature",
-                "id": str(i),
+                "id": area_id,
                 "properties": {},
-                "geometry": feature["geometry"]
+                "geometry": geometry
             }
             modified_features.append(modified_feature)
-            logger.debug("Created priority rule and modified feature for area %d", i)
-        
+
         result = {
             "priority": priority,
             "areas": {
@@ -164,6 +484,7 @@ class RainData:
                 "features": modified_features
             }
         }
+        logger.info("Rain areas: %d tiles merged into %d polygons, %d rules (mode=%s)",
+                    self.num_areas_before, self.num_areas_after, len(priority), RAIN_AREA_MERGE)
         logger.debug("GraphHopper request format conversion completed. Priority rules: %d, Areas: %d", len(priority), len(modified_features))
-        return result, self.rain_tile_list
-
+        return result, tile_list
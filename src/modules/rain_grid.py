@@ -0,0 +1,332 @@
+import math
+import os
+import threading
+
+import numpy as np
+
+from .values import TileSet, deg2num_array
+from src.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 格子で保持する範囲（南西の緯度,経度,北東の緯度,経度）。既定は日本全域（南鳥島・沖ノ鳥島を含む）
+RAIN_GRID_BOUNDS = os.getenv("RAIN_GRID_BOUNDS", "20,122,46,154")
+RAIN_GRID_ZOOM = int(os.getenv("RAIN_GRID_ZOOM", "13"))
+# 保持する時間枠の数（現在の時間枠と、その直前の時間枠）
+RAIN_GRID_BUCKETS = int(os.getenv("RAIN_GRID_BUCKETS", "2"))
+# 設定すると格子をこのディレクトリのファイルにメモリマップし、ワーカープロセス間で共有する
+RAIN_GRID_DIR = os.getenv("RAIN_GRID_DIR", "")
+
+# セルの値: 0 は雨なし、1〜254 は降水強度（mm/h、切り上げ）、255 は未取得
+UNKNOWN = 255
+MAX_INTENSITY = 254
+# 1セルあたりの値の数（Yahoo!の観測値1つと、10分ごと60分先までの予報値6つ）
+NUM_SLOTS = 7
+SLOT_SECONDS = 600
+
+
+def _to_intensity(rainfall: float) -> int:
+    if rainfall <= 0:
+        return 0
+    return min(MAX_INTENSITY, max(1, math.ceil(rainfall)))
+
+
+def feature_slots(feat: dict) -> np.ndarray:
+    """
+    Yahoo!のFeatureの観測値・予報値を、時刻順に格子の値に変換する。
+    Args:
+        feat (dict): Yahoo!のFeature
+    Returns:
+        np.ndarray: 長さNUM_SLOTSのuint8配列（足りない予報は最後の値で埋める）
+    """
+    weather = sorted(feat["Property"]["WeatherList"]["Weather"], key=lambda w: w.get("Date", ""))
+    values = [_to_intensity(w.get("Rainfall", 0)) for w in weather[:NUM_SLOTS]] or [0]
+    values += [values[-1]] * (NUM_SLOTS - len(values))
+    return np.array(values, dtype=np.uint8)
+
+
+def shift_slots(slots: np.ndarray, age: int) -> np.ndarray:
+    """
+    age個前の時間枠の値を、現在の時間枠の予報の順に並べ直す。
+    Args:
+        slots (np.ndarray): (タイル数, NUM_SLOTS) の配列
+        age (int): 何個前の時間枠か
+    Returns:
+        np.ndarray: 先頭を現在の時刻とした配列（予報の範囲外は最後の値で埋める）
+    """
+    if age <= 0:
+        return slots
+    age = min(age, NUM_SLOTS - 1)
+    return np.concatenate([slots[:, age:], np.repeat(slots[:, -1:], age, axis=1)], axis=1)
+
+
+class RainGrid:
+    """
+    サービス範囲のタイルを1セルNUM_SLOTSバイト（観測値と予報値）の格子で保持する、時間枠ごとの雨のスナップショット。
+    タイルからセルへの変換は添字の計算だけで済み、範囲内の雨のセルもまとめて取り出せる。
+    """
+
+    def __init__(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                 zoom: int = RAIN_GRID_ZOOM, keep_buckets: int = RAIN_GRID_BUCKETS, directory: str = RAIN_GRID_DIR):
+        self.zoom = zoom
+        self.keep_buckets = max(1, keep_buckets)
+        self.directory = directory
+        x0, y0 = deg2num_array(np.array([max_lat]), np.array([min_lon]), zoom)
+        x1, y1 = deg2num_array(np.array([min_lat]), np.array([max_lon]), zoom)
+        self.x0, self.y0 = int(x0[0]), int(y0[0])
+        self.width = int(x1[0]) - self.x0 + 1
+        self.height = int(y1[0]) - self.y0 + 1
+        # 時間枠ごとの格子と、このプロセスが共有ファイルを作成した時間枠（削除してよいのはこれだけ）
+        self._snapshots: dict[int, np.ndarray] = {}
+        self._created: set[int] = set()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        logger.info("Rain grid covers %dx%d cells at zoom %d (%d KB per snapshot)",
+                    self.width, self.height, zoom, self.width * self.height * NUM_SLOTS // 1024)
+
+    def _path(self, bucket: int) -> str:
+        return os.path.join(self.directory, f"rain-z{self.zoom}-{self.x0}-{self.y0}-{self.width}x{self.height}x{NUM_SLOTS}-{bucket}.u8")
+
+    def snapshot(self, bucket: int, create: bool = False) -> np.ndarray | None:
+        """
+        時間枠の格子を返す。
+        Args:
+            bucket (int): 10分単位の時間枠
+            create (bool): なければ作成する（全セル未取得）
+        Returns:
+            np.ndarray | None: (height, width, NUM_SLOTS) のuint8配列
+        """
+        grid = self._snapshots.get(bucket)
+        if grid is not None or (not create and not self.directory):
+            return grid
+        with self._lock:
+            grid = self._snapshots.get(bucket)
+            if grid is None:
+                grid = self._open(bucket, create)
+                if grid is None:
+                    return None
+                self._snapshots[bucket] = grid
+                self._evict(bucket)
+        return grid
+
+    def _open(self, bucket: int, create: bool) -> np.ndarray | None:
+        shape = (self.height, self.width, NUM_SLOTS)
+        if not self.directory:
+            return np.full(shape, UNKNOWN, dtype=np.uint8)
+        path = self._path(bucket)
+        if os.path.exists(path):
+            # 他のプロセスが作成した格子を共有する
+            return np.memmap(path, dtype=np.uint8, mode="r+", shape=shape)
+        if not create:
+            return None
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        np.full(shape, UNKNOWN, dtype=np.uint8).tofile(tmp_path)
+        try:
+            os.link(tmp_path, path)
+            self._created.add(bucket)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+        return np.memmap(path, dtype=np.uint8, mode="r+", shape=shape)
+
+    def _evict(self, latest: int) -> None:
+        for bucket in [b for b in self._snapshots if b <= latest - self.keep_buckets]:
+            self._drop(bucket)
+
+    def _drop(self, bucket: int) -> None:
+        del self._snapshots[bucket]
+        # 他のプロセスが作成したファイルはまだ読み書きしている可能性があるため、作成したプロセスだけが削除する
+        if self.directory and bucket in self._created:
+            self._created.discard(bucket)
+            try:
+                os.remove(self._path(bucket))
+            except FileNotFoundError:
+                pass
+
+    def clear(self) -> None:
+        """
+        すべての時間枠の格子を破棄する（このプロセスが作成した共有ファイルも削除する）。
+        """
+        with self._lock:
+            for bucket in list(self._snapshots):
+                self._drop(bucket)
+
+    def _cells(self, tiles: TileSet) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # 格子のズームレベルのセルに変換する（細かいタイルは親のセルに対応付ける）
+        shift = np.maximum(tiles.zoom - self.zoom, 0)
+        col = (tiles.x >> shift) - self.x0
+        row = (tiles.y >> shift) - self.y0
+        inside = (tiles.zoom >= self.zoom) & (col >= 0) & (col < self.width) & (row >= 0) & (row < self.height)
+        return row, col, inside
+
+    def contains(self, tiles: TileSet) -> np.ndarray:
+        """
+        タイルが格子のセルそのもの（同じズームレベルで範囲内）かどうかを返す。
+        Args:
+            tiles (TileSet): タイル集合
+        Returns:
+            np.ndarray: タイルごとのbool配列
+        """
+        _, _, inside = self._cells(tiles)
+        return inside & (tiles.zoom == self.zoom)
+
+    def lookup(self, x: int, y: int, bucket: int) -> int | None:
+        """
+        格子のズームレベルのタイルの降水強度を返す。
+        Args:
+            x (int): タイルのX座標
+            y (int): タイルのY座標
+            bucket (int): 10分単位の時間枠
+        Returns:
+            int | None: 観測値・予報値のうち最大の降水強度（未取得または範囲外ならNone）
+        """
+        grid = self.snapshot(bucket)
+        row, col = y - self.y0, x - self.x0
+        if grid is None or not (0 <= row < self.height and 0 <= col < self.width):
+            return None
+        value = int(grid[row, col].max())
+        return None if value == UNKNOWN else value
+
+    def values(self, tiles: TileSet, bucket: int) -> np.ndarray:
+        """
+        タイルごとの観測値・予報値の降水強度を返す。
+        Args:
+            tiles (TileSet): タイル集合
+            bucket (int): 10分単位の時間枠
+        Returns:
+            np.ndarray: (タイル数, NUM_SLOTS) のuint8配列（未取得・範囲外・格子より粗いタイルはUNKNOWN）
+        """
+        result = np.full((len(tiles), NUM_SLOTS), UNKNOWN, dtype=np.uint8)
+        grid = self.snapshot(bucket)
+        if grid is None or len(tiles) == 0:
+            return result
+        row, col, inside = self._cells(tiles)
+        result[inside] = grid[row[inside], col[inside]]
+        return result
+
+    def update(self, tiles: TileSet, slots: np.ndarray, bucket: int) -> None:
+        """
+        タイルの降水強度を格子に書き込む。
+        格子より粗いタイルは中心の1点の値でしかないため書き込まない（細かいセルの値を上書きしないようにする）。
+        Args:
+            tiles (TileSet): タイル集合
+            slots (np.ndarray): (タイル数, NUM_SLOTS) の観測値・予報値の降水強度（0〜254）
+            bucket (int): 10分単位の時間枠
+        """
+        if len(tiles) == 0:
+            return
+        grid = self.snapshot(bucket, create=True)
+        slots = np.asarray(slots, dtype=np.uint8)
+        row, col, inside = self._cells(tiles)
+        grid[row[inside], col[inside]] = slots[inside]
+
+    def tile_values(self, z: int, x: int, y: int, bucket: int, size: int, slot: int | None = None) -> np.ndarray:
+        """
+        XYZタイルの範囲をsize×sizeの格子に並べ直した降水強度を返す（地図の重ね合わせ用）。
+        格子より細かい画素は対応するセルの値を使い、粗い画素は含まれるセルの最大値を使う。
+        Args:
+            z (int): タイルのズームレベル
+            x (int): タイルのX座標
+            y (int): タイルのY座標
+            bucket (int): 10分単位の時間枠
+            size (int): 1辺の画素数（2のべき乗）
+            slot (int | None): 観測値・予報値の位置（Noneならすべてのうち最大の値）
+        Returns:
+            np.ndarray: (size, size) のuint8配列（未取得・範囲外はUNKNOWN）
+        """
+        result = np.full((size, size), UNKNOWN, dtype=np.uint8)
+        grid = self.snapshot(bucket)
+        if grid is None:
+            return result
+        pixel_zoom = z + size.bit_length() - 1
+
+        if pixel_zoom >= self.zoom:
+            # 画素ごとに対応するセルを1つ選ぶ
+            shift = pixel_zoom - self.zoom
+            cols = (((x * size) + np.arange(size)) >> shift) - self.x0
+            rows = (((y * size) + np.arange(size)) >> shift) - self.y0
+            col_ok = (cols >= 0) & (cols < self.width)
+            row_ok = (rows >= 0) & (rows < self.height)
+            if not col_ok.any() or not row_ok.any():
+                return result
+            cells = grid[rows[row_ok]][:, cols[col_ok]]
+            cells = cells.max(axis=2) if slot is None else cells[:, :, slot]
+            result[np.ix_(row_ok, col_ok)] = cells
+            return result
+
+        # 画素に含まれるセルのうち、取得済みのセルの最大値をとる
+        shift = self.zoom - pixel_zoom
+        col0, col1 = max((x * size) << shift, self.x0), min(((x + 1) * size) << shift, self.x0 + self.width)
+        row0, row1 = max((y * size) << shift, self.y0), min(((y + 1) * size) << shift, self.y0 + self.height)
+        if col0 >= col1 or row0 >= row1:
+            return result
+        window = grid[row0 - self.y0:row1 - self.y0, col0 - self.x0:col1 - self.x0]
+        window = window.max(axis=2) if slot is None else window[:, :, slot]
+        known = window != UNKNOWN
+        pixel_cols = (np.arange(col0, col1) >> shift) - x * size
+        pixel_rows = (np.arange(row0, row1) >> shift) - y * size
+        index = (pixel_rows[:, None], pixel_cols[None, :])
+        values = np.zeros((size, size), dtype=np.uint8)
+        found = np.zeros((size, size), dtype=np.uint8)
+        np.maximum.at(values, index, np.where(known, window, 0).astype(np.uint8))
+        np.maximum.at(found, index, known.astype(np.uint8))
+        return np.where(found > 0, values, UNKNOWN).astype(np.uint8)
+
+    def rainy_in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float, bucket: int,
+                      threshold: int = 1, slot: int | None = None,
+                      include_unknown: bool = False) -> tuple[TileSet, np.ndarray]:
+        """
+        範囲内で降水強度がthreshold以上のセルを、タイル集合と降水強度の配列としてまとめて返す。
+        範囲の四隅を含むセルまでを対象とする。
+        Args:
+            min_lat (float): 南端の緯度
+            min_lon (float): 西端の経度
+            max_lat (float): 北端の緯度
+            max_lon (float): 東端の経度
+            bucket (int): 10分単位の時間枠
+            threshold (int): 雨とみなす降水強度の下限
+            slot (int | None): 観測値・予報値の位置（Noneならすべてのうち最大の値）
+            include_unknown (bool): Trueなら未取得のセルも値UNKNOWNとして含める
+        Returns:
+            tuple[TileSet, np.ndarray]: 雨のセル（格子のズームレベル）と、セルごとの降水強度（uint8）
+        """
+        empty = (TileSet([], [], []), np.zeros(0, dtype=np.uint8))
+        grid = self.snapshot(bucket)
+        if grid is None:
+            return empty
+        x0, y0 = deg2num_array(np.array([max_lat]), np.array([min_lon]), self.zoom)
+        x1, y1 = deg2num_array(np.array([min_lat]), np.array([max_lon]), self.zoom)
+        col0, col1 = max(int(x0[0]) - self.x0, 0), min(int(x1[0]) - self.x0 + 1, self.width)
+        row0, row1 = max(int(y0[0]) - self.y0, 0), min(int(y1[0]) - self.y0 + 1, self.height)
+        if col0 >= col1 or row0 >= row1:
+            return empty
+        window = grid[row0:row1, col0:col1]
+        # 観測値が未取得ならそのセルは未取得（値はすべての位置でまとめて書き込まれる）
+        unknown = window[:, :, 0] == UNKNOWN
+        window = window.max(axis=2) if slot is None else window[:, :, slot]
+        selected = (window >= threshold) & ~unknown
+        if include_unknown:
+            selected |= unknown
+        rows, cols = np.nonzero(selected)
+        values = np.where(unknown[rows, cols], UNKNOWN, window[rows, cols]).astype(np.uint8)
+        return TileSet(cols + col0 + self.x0, rows + row0 + self.y0, self.zoom), values
+
+
+_grid: RainGrid | None = None
+_grid_lock = threading.Lock()
+
+
+def get_rain_grid() -> RainGrid:
+    """
+    プロセス内で共有するRainGridを返す（未作成なら作成する）。
+    Returns:
+        RainGrid: 共有の格子
+    """
+    global _grid
+    with _grid_lock:
+        if _grid is None:
+            min_lat, min_lon, max_lat, max_lon = map(float, RAIN_GRID_BOUNDS.split(","))
+            _grid = RainGrid(min_lat, min_lon, max_lat, max_lon)
+    return _grid
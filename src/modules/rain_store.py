@@ -0,0 +1,205 @@
+import os
+import sqlite3
+import threading
+import time
+
+from .rain_cache import RAIN_CACHE_TTL
+from src.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 複数のワーカープロセス・再起動をまたいで共有する雨データのSQLiteファイル（未設定なら使わない）
+RAIN_STORE_PATH = os.getenv("RAIN_STORE_PATH", "")
+RAIN_STORE_TTL = float(os.getenv("RAIN_STORE_TTL", str(RAIN_CACHE_TTL)))
+# 期限切れの行を削除する間隔（秒）
+RAIN_STORE_PURGE_INTERVAL = float(os.getenv("RAIN_STORE_PURGE_INTERVAL", "60"))
+RAIN_STORE_BUSY_TIMEOUT = float(os.getenv("RAIN_STORE_BUSY_TIMEOUT", "1"))
+
+# 1回のSELECTで問い合わせるタイル数（SQLiteの変数の上限999に収まるようにする）
+_QUERY_CHUNK_SIZE = 300
+
+# slots: 観測値・予報値の降水強度（NUM_SLOTSバイト）
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rain_tile_slots (
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    zoom INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    slots BLOB NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (x, y, zoom, bucket)
+) WITHOUT ROWID
+"""
+
+
+# 時間枠ごとの処理をどのプロセスが担当するかの記録（bucket: 最後に担当者が決まった時間枠）
+_CLAIMS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rain_claims (
+    name TEXT PRIMARY KEY,
+    bucket INTEGER NOT NULL,
+    owner INTEGER NOT NULL
+)
+"""
+
+
+class RainStore:
+    """
+    タイルと10分単位の時間枠をキーに雨データを保存するSQLite（WALモード）のストア。
+    同じファイルを開いた全プロセスで共有され、再起動後も有効期限内のデータを使える。
+    """
+
+    def __init__(self, path: str, ttl: float = RAIN_STORE_TTL, purge_interval: float = RAIN_STORE_PURGE_INTERVAL,
+                 busy_timeout: float = RAIN_STORE_BUSY_TIMEOUT):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._last_purge = 0.0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute(_SCHEMA)
+        connection.execute(_CLAIMS_SCHEMA)
+        connection.execute("CREATE INDEX IF NOT EXISTS rain_tile_slots_expires_at ON rain_tile_slots (expires_at)")
+        connection.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3の接続はスレッドをまたいで使えないため、スレッドごとに開く
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get_many(self, keys: list[tuple[int, int, int]], bucket: int) -> dict[tuple[int, int, int], bytes]:
+        """
+        時間枠が一致し、有効期限内のタイルの雨データを返す。
+        Args:
+            keys (list[tuple[int, int, int]]): (x, y, zoom) のリスト
+            bucket (int): 10分単位の時間枠
+        Returns:
+            dict[tuple[int, int, int], bytes]: 見つかったタイルの観測値・予報値の降水強度
+        """
+        found = {}
+        if not keys:
+            return found
+        now = time.time()
+        try:
+            connection = self._connection()
+            for i in range(0, len(keys), _QUERY_CHUNK_SIZE):
+                chunk = keys[i:i + _QUERY_CHUNK_SIZE]
+                placeholders = ",".join(["(?, ?, ?)"] * len(chunk))
+                params = [int(v) for key in chunk for v in key]
+                rows = connection.execute(
+                    f"SELECT x, y, zoom, slots FROM rain_tile_slots "
+                    f"WHERE bucket = ? AND expires_at > ? AND (x, y, zoom) IN (VALUES {placeholders})",
+                    [bucket, now] + params,
+                ).fetchall()
+                for x, y, zoom, slots in rows:
+                    found[(x, y, zoom)] = bytes(slots)
+        except sqlite3.Error as e:
+            # ストアが使えなくてもYahoo!から取得して処理を続ける
+            logger.warning("Rain store read failed: %s", e)
+        return found
+
+    def put_many(self, items: list[tuple[tuple[int, int, int], bytes]], bucket: int) -> None:
+        """
+        タイルの雨データを保存する。
+        Args:
+            items (list[tuple[tuple[int, int, int], bytes]]): ((x, y, zoom), 観測値・予報値の降水強度) のリスト
+            bucket (int): 10分単位の時間枠
+        """
+        if not items:
+            return
+        now = time.time()
+        expires_at = now + self.ttl
+        rows = [
+            (int(x), int(y), int(zoom), bucket, slots, expires_at)
+            for (x, y, zoom), slots in items
+        ]
+        try:
+            connection = self._connection()
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO rain_tile_slots VALUES (?, ?, ?, ?, ?, ?)", rows)
+            if now - self._last_purge >= self.purge_interval:
+                self._last_purge = now
+                self.purge(now)
+        except sqlite3.Error as e:
+            logger.warning("Rain store write failed: %s", e)
+
+    def claim(self, name: str, bucket: int) -> bool:
+        """
+        時間枠の処理を担当する権利を得る。同じ名前・時間枠で最初に呼んだプロセスだけがTrueを受け取る。
+        Args:
+            name (str): 処理の名前
+            bucket (int): 10分単位の時間枠
+        Returns:
+            bool: このプロセスが担当するならTrue（ストアが使えない場合もTrue）
+        """
+        try:
+            connection = self._connection()
+            with connection:
+                cursor = connection.execute(
+                    "INSERT INTO rain_claims VALUES (?, ?, ?) "
+                    "ON CONFLICT (name) DO UPDATE SET bucket = excluded.bucket, owner = excluded.owner "
+                    "WHERE rain_claims.bucket < excluded.bucket",
+                    (name, bucket, os.getpid()),
+                )
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            logger.warning("Rain store claim failed: %s", e)
+            return True
+
+    def clear(self) -> None:
+        """
+        保存したすべての雨データと、処理の担当の記録を削除する。
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM rain_tile_slots")
+            connection.execute("DELETE FROM rain_claims")
+
+    def purge(self, now: float | None = None) -> int:
+        """
+        有効期限切れの行を削除する。
+        Args:
+            now (float | None): 現在時刻（UNIX時間、省略時は現在）
+        Returns:
+            int: 削除した行数
+        """
+        connection = self._connection()
+        with connection:
+            cursor = connection.execute("DELETE FROM rain_tile_slots WHERE expires_at <= ?", (time.time() if now is None else now,))
+        if cursor.rowcount:
+            logger.debug("Rain store purged %d expired tiles", cursor.rowcount)
+        return cursor.rowcount
+
+
+_store: RainStore | None = None
+_store_failed = False
+_store_lock = threading.Lock()
+
+
+def get_rain_store() -> RainStore | None:
+    """
+    RAIN_STORE_PATHが設定されていれば、プロセス内で共有するRainStoreを返す。
+    Returns:
+        RainStore | None: 共有ストア（無効な場合はNone）
+    """
+    global _store, _store_failed
+    if not RAIN_STORE_PATH or _store_failed:
+        return None
+    with _store_lock:
+        if _store is None and not _store_failed:
+            try:
+                _store = RainStore(RAIN_STORE_PATH)
+            except (sqlite3.Error, OSError) as e:
+                # 開けない場合はストアを使わずに動かす
+                logger.error("Failed to open rain store at %s: %s", RAIN_STORE_PATH, e)
+                _store_failed = True
+    return _store
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+
+from src.core.cache import TTLCache
+
+# 端点を丸める小数点以下の桁数（4桁で約10m）
+ROUTE_CACHE_PRECISION = int(os.getenv("ROUTE_CACHE_PRECISION", "4"))
+ROUTE_CACHE_NORMAL_TTL = float(os.getenv("ROUTE_CACHE_NORMAL_TTL", "86400"))
+ROUTE_CACHE_RAIN_TTL = float(os.getenv("ROUTE_CACHE_RAIN_TTL", "600"))
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "10000"))
+ROUTE_CACHE_MAX_BYTES = int(os.getenv("ROUTE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+NO_RAIN_FINGERPRINT = "none"
+
+
+def area_fingerprint(rain_avoidance_data: dict | None) -> str:
+    """
+    雨エリア回避設定のハッシュを求める。
+    Args:
+        rain_avoidance_data (dict | None): 雨エリア回避用のpriority・areas設定
+    Returns:
+        str: ハッシュ値（回避エリアがない場合は "none"）
+    """
+    if not rain_avoidance_data or not rain_avoidance_data.get("priority"):
+        return NO_RAIN_FINGERPRINT
+    payload = json.dumps(
+        [rain_avoidance_data["priority"], rain_avoidance_data["areas"]],
+        sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def estimate_bytes(response: dict) -> int:
+    """
+    GraphHopperのレスポンスのJSONのおおよそのバイト数を、直列化せずに見積もる。
+    Args:
+        response (dict): GraphHopperのレスポンス（points_encoded: False）
+    Returns:
+        int: 見積もったバイト数（キャッシュの重みに使う）
+    """
+    size = 256
+    for path in response.get("paths", []):
+        size += 512 + 160 * len(path.get("instructions") or [])
+        points = path.get("points")
+        if isinstance(points, dict):
+            # 座標の数値1つは "139.12345," のようにおよそ12バイト
+            coordinates = points.get("coordinates") or []
+            size += len(coordinates) * 12 * (len(coordinates[0]) if coordinates else 2)
+        elif isinstance(points, str):
+            size += len(points)
+    return size
+
+
+class RouteCache:
+    """
+    丸めた端点・ルートの種類・雨エリアのハッシュをキーとするルートのキャッシュ。
+    雨エリアが変わったルートは新しいキーで登録され、古いものは有効期限で消える。
+    """
+
+    def __init__(self, precision: int = ROUTE_CACHE_PRECISION, normal_ttl: float = ROUTE_CACHE_NORMAL_TTL,
+                 rain_ttl: float = ROUTE_CACHE_RAIN_TTL, max_entries: int = ROUTE_CACHE_MAX_ENTRIES,
+                 max_bytes: int = ROUTE_CACHE_MAX_BYTES):
+        self.precision = precision
+        self.normal_ttl = normal_ttl
+        self.rain_ttl = rain_ttl
+        self.cache = TTLCache(max_entries=max_entries, ttl=rain_ttl, max_weight=max_bytes)
+
+    def _key(self, start: str, goal: str, kind: str, fingerprint: str) -> tuple:
+        start_lat, start_lon = (round(float(v), self.precision) for v in start.split(','))
+        goal_lat, goal_lon = (round(float(v), self.precision) for v in goal.split(','))
+        return (kind, start_lat, start_lon, goal_lat, goal_lon, fingerprint)
+
+    def get(self, start: str, goal: str, kind: str, fingerprint: str = NO_RAIN_FINGERPRINT) -> dict | None:
+        """
+        キャッシュされたルートを返す。
+        Args:
+            start (str): 開始地点の座標
+            goal (str): 目的地の座標
+            kind (str): ルートの種類（"route" または "normal_route"）
+            fingerprint (str): 雨エリアのハッシュ
+        Returns:
+            dict | None: GraphHopperのレスポンス（なければNone）
+        """
+        return self.cache.get(self._key(start, goal, kind, fingerprint))
+
+    def set(self, start: str, goal: str, kind: str, response: dict, fingerprint: str = NO_RAIN_FINGERPRINT) -> None:
+        """
+        ルートをキャッシュする。
+        Args:
+            start (str): 開始地点の座標
+            goal (str): 目的地の座標
+            kind (str): ルートの種類（"route" または "normal_route"）
+            response (dict): GraphHopperのレスポンス
+            fingerprint (str): 雨エリアのハッシュ
+        """
+        ttl = self.normal_ttl if kind == "normal_route" else self.rain_ttl
+        self.cache.set(self._key(start, goal, kind, fingerprint), response, ttl=ttl, weight=estimate_bytes(response))
+
+
+route_cache = RouteCache()
@@ -1,57 +1,334 @@
+import asyncio
 import os
-import json
-import requests
+import time
+import numpy as np
 from datetime import datetime, timezone, timedelta
 
+from .exposure import path_coordinates, path_tiles, score_path
+from .graphhopper import get_graphhopper_client
 from .rain_data import RainData
-from .values import bounding_box, coordinate
-from src.core.logger import get_logger
+from .route_cache import route_cache, area_fingerprint
+from .values import bounding_box, coordinate, haversine_km, TileSet
+from src.core.logger import get_logger, payload
+from src.core.metrics import timed, rain_tiles, custom_model_areas, routing_modes
 
 logger = get_logger(__name__)
 
 YAHOO_API_KEY = os.environ.get('YAHOO_API_KEY')
 JST = timezone(timedelta(hours=9))
 
-def get_rain_info(start: str, goal: str):
+# bbox: 開始地点と目的地を含む矩形内の全タイル、corridor: 2点を結ぶ線分の周辺のタイルのみ
+RAIN_TILE_SELECTION = os.getenv("RAIN_TILE_SELECTION", "bbox")
+RAIN_CORRIDOR_MIN_KM = float(os.getenv("RAIN_CORRIDOR_MIN_KM", "5"))
+RAIN_CORRIDOR_RATIO = float(os.getenv("RAIN_CORRIDOR_RATIO", "0.1"))
+# fixed: 常にズームレベル13で取得、adaptive: 粗いズームレベルから必要な所だけ細分化して取得
+RAIN_SAMPLING = os.getenv("RAIN_SAMPLING", "fixed")
+RAIN_SAMPLING_COARSE_ZOOM = int(os.getenv("RAIN_SAMPLING_COARSE_ZOOM", "11"))
+# /routes で同時にGraphHopperへ送るリクエスト数の上限
+ROUTES_BATCH_CONCURRENCY = int(os.getenv("ROUTES_BATCH_CONCURRENCY", "8"))
+# rain_first: 常に雨データを取得して雨を考慮したルートを求める
+# route_first: 先に通常のルートを求め、その経路上に雨がある場合だけ雨を考慮したルートを求め直す
+ROUTE_STRATEGY = os.getenv("ROUTE_STRATEGY", "rain_first")
+# route_first で雨を確認する、経路が通るタイルの周囲のタイル数
+RAIN_PATH_BUFFER_TILES = int(os.getenv("RAIN_PATH_BUFFER_TILES", "1"))
+# 雨データの取得を待つ秒数（0なら完了まで待つ）。超えた分は以前の時間枠の値で補い、rain_statusで知らせる
+RAIN_FETCH_BUDGET = float(os.getenv("RAIN_FETCH_BUDGET", "3"))
+# route_first で経路上の雨を確認する時の待ち時間（秒、0なら完了まで待つ）
+RAIN_PATH_CHECK_BUDGET = float(os.getenv("RAIN_PATH_CHECK_BUDGET", str(RAIN_FETCH_BUDGET)))
+# any: 60分先までの予報のいずれかで雨のタイルを回避する
+# eta: 出発地点からの距離で各タイルへの到着時刻を見積もり、その時刻の予報で雨のタイルだけを回避する
+RAIN_TIME_MODE = os.getenv("RAIN_TIME_MODE", "any")
+# eta で到着時刻を見積もる速度（出発地点からの直線距離に対する速度、km/h）。通常のルートがあればその所要時間から求める
+RAIN_ETA_SPEED_KMH = float(os.getenv("RAIN_ETA_SPEED_KMH", "30"))
+# GraphHopperの探索方法。auto: custom_modelがなければCH、あればLM。ch / lm / flex: ベンチマーク用に固定する
+ROUTING_MODE = os.getenv("ROUTING_MODE", "auto")
+
+# 探索方法ごとのGraphHopperのリクエストパラメータ
+ROUTING_MODE_PARAMS = {
+    "ch": {"ch.disable": False},
+    "lm": {"ch.disable": True, "lm.disable": False},
+    "flex": {"ch.disable": True, "lm.disable": True},
+}
+
+def select_tiles(bbox: bounding_box, zoom_level: int = 13) -> TileSet:
     """
-    指定された開始地点と目的地の間の雨データを取得する関数。
+    RAIN_TILE_SELECTIONの設定に従って、雨データを取得するタイルを選ぶ。
     
     Args:
-        start (str): 開始地点の座標（例: "35.6762,139.6503"）
-        goal (str): 目的地の座標（例: "35.7169,139.7774"）
+        bbox (bounding_box): 開始地点と目的地のバウンディングボックス
+        zoom_level (int): ズームレベル
         
     Returns:
-        dict: 雨データを含む辞書
+        TileSet: 雨データを取得するタイル集合
     """
+    if RAIN_TILE_SELECTION != "corridor":
+        return bbox.create_tile_set(zoom_level=zoom_level)
+
+    # 移動距離が長いほど迂回の幅も広がるため、距離に比例して幅を広げる
+    trip_km = float(haversine_km(bbox.start.lat, bbox.start.lon, bbox.goal.lat, bbox.goal.lon))
+    buffer_km = max(RAIN_CORRIDOR_MIN_KM, RAIN_CORRIDOR_RATIO * trip_km)
+    tile_set = bbox.create_corridor_tile_set(zoom_level=zoom_level, buffer_km=buffer_km)
+    logger.info("Corridor selection: %d tiles within %.1f km of a %.1f km trip", len(tile_set), buffer_km, trip_km)
+    return tile_set
+
+
+def _deadline(budget: float) -> float | None:
+    return time.monotonic() + budget if budget > 0 else None
+
+
+def route_speed_kmh(response: dict | None) -> float:
+    """
+    通常のルートの所要時間から、出発地点からの直線距離に対する速度を求める（道路の迂回も含めた速度になる）。
+    Args:
+        response (dict | None): GraphHopperのレスポンス（points_encoded: False、Noneなら既定の速度）
+    Returns:
+        float: 速度（km/h）
+    """
+    paths = (response or {}).get("paths") or []
+    if not paths:
+        return RAIN_ETA_SPEED_KMH
+    time_ms = paths[0].get("time", 0)
+    coordinates = paths[0].get("points", {}).get("coordinates", [])
+    if time_ms <= 0 or len(coordinates) < 2:
+        return RAIN_ETA_SPEED_KMH
+    (lon1, lat1), (lon2, lat2) = coordinates[0][:2], coordinates[-1][:2]
+    crow_km = float(haversine_km(lat1, lon1, lat2, lon2))
+    if crow_km <= 0:
+        return RAIN_ETA_SPEED_KMH
+    return crow_km / (time_ms / 3_600_000)
 
-    logger.info("Fetching rain info between %s and %s", start, goal)
 
+def apply_arrival_times(rain_data: RainData, origins: list[coordinate], speed_kmh: float, now: datetime) -> None:
+    """
+    RAIN_TIME_MODEがetaの場合、出発地点から各タイルまでの到着時刻を見積もってRainDataに設定する。
+    Args:
+        rain_data (RainData): 取得済みの雨データ
+        origins (list[coordinate]): 出発地点のリスト
+        speed_kmh (float): 出発地点からの直線距離に対する速度（km/h）
+        now (datetime): 出発時刻
+    """
+    if RAIN_TIME_MODE != "eta" or not origins or speed_kmh <= 0:
+        return
+    lat, lon = rain_data.feature_tiles.centers()
+    origin_lat = np.array([o.lat for o in origins])[:, None]
+    origin_lon = np.array([o.lon for o in origins])[:, None]
+    eta_seconds = haversine_km(origin_lat, origin_lon, lat[None, :], lon[None, :]) / speed_kmh * 3600
+    rain_data.set_arrival(eta_seconds, now.timestamp())
+    logger.debug("Arrival times estimated for %d tiles at %.1f km/h", len(lat), speed_kmh)
+
+
+def _route_bbox(start: str, goal: str) -> bounding_box:
     s_lat, slon = map(float, start.split(','))
     g_lat, glon = map(float, goal.split(','))
 
-    now = datetime.now(JST)
-
     start_coord = coordinate(s_lat, slon)
     goal_coord = coordinate(g_lat, glon)
     
-    bbox = bounding_box(start_coord, goal_coord)
-    # grid_coordinates = bbox.create_grid()
-    tile_list = bbox.create_tiles(zoom_level=13)
-    tile_center_coord_list = bbox.get_tile_centers(tile_list)
+    return bounding_box(start_coord, goal_coord)
+
+
+def get_rain_info_for_tiles(tile_set: TileSet, origins: list[coordinate] | None = None,
+                            speed_kmh: float = RAIN_ETA_SPEED_KMH):
+    """
+    タイル集合の雨データを取得し、GraphHopperのリクエスト形式に変換する関数。
     
+    Args:
+        tile_set (TileSet): 雨データを取得するタイル集合
+        origins (list[coordinate] | None): RAIN_TIME_MODE=eta で到着時刻を見積もる出発地点
+        speed_kmh (float): 到着時刻を見積もる速度（km/h）
+        
+    Returns:
+        dict: 雨データを含む辞書（取得状況をrain_statusに含む）
+        list[tile]: 雨のタイルのリスト
+    """
+    now = datetime.now(JST)
+    deadline = _deadline(RAIN_FETCH_BUDGET)
+
     rain_data = RainData(YAHOO_API_KEY)
-    rain_data.get(coordinate_list=tile_center_coord_list, date=now)
+    with timed("rain_fetch"):
+        if RAIN_SAMPLING == "adaptive":
+            rain_data.get_adaptive(tile_set, date=now, coarse_zoom=RAIN_SAMPLING_COARSE_ZOOM, deadline=deadline)
+        else:
+            rain_data.get(coordinate_list=tile_set, date=now, deadline=deadline)
     
-    rain_request_data, rain_tile_list = rain_data.to_request_json()
+    with timed("rain_convert"):
+        apply_arrival_times(rain_data, origins or [], speed_kmh, now)
+        rain_request_data, rain_tile_list = rain_data.to_request_json()
 
     logger.info("Rain tiles detected: %d", rain_data.num_rain_tiles)
+    rain_tiles.observe(len(tile_set), kind="queried")
+    rain_tiles.observe(rain_data.num_rain_tiles, kind="rainy")
+    rain_tiles.observe(len(rain_data.stale_tiles), kind="stale")
+    rain_tiles.observe(len(rain_data.unknown_tiles), kind="unknown")
+    custom_model_areas.observe(rain_data.num_areas_after)
     
     result = rain_request_data
-    logger.debug("get_rain_info result: %s", json.dumps(result, ensure_ascii=False))
+    # GraphHopperのリクエストやルートキャッシュのキーには使わない
+    result["rain_status"] = rain_data.status()
+    logger.debug("get_rain_info result: %s", payload(result))
     return result, rain_tile_list
 
 
-def get_route_from_graphhopper(start: str, goal: str, rain_avoidance_data: dict = None):
+def get_rain_info(start: str, goal: str, first_route: dict | None = None):
+    """
+    指定された開始地点と目的地の間の雨データを取得する関数。
+    
+    Args:
+        start (str): 開始地点の座標（例: "35.6762,139.6503"）
+        goal (str): 目的地の座標（例: "35.7169,139.7774"）
+        first_route (dict | None): 先に求めた通常のルート（RAIN_TIME_MODE=eta で到着時刻の見積もりに使う）
+        
+    Returns:
+        dict: 雨データを含む辞書
+    """
+
+    logger.info("Fetching rain info between %s and %s", start, goal)
+
+    bbox = _route_bbox(start, goal)
+    # grid_coordinates = bbox.create_grid()
+    with timed("tiles"):
+        tile_set = select_tiles(bbox, zoom_level=13)
+    
+    return get_rain_info_for_tiles(tile_set, origins=[bbox.start], speed_kmh=route_speed_kmh(first_route))
+
+
+def check_rain_on_path(response: dict, zoom_level: int = 13) -> tuple[bool, dict]:
+    """
+    GraphHopperのルートが雨のタイルを通るかを、経路の周辺のタイルだけを取得して確認する。
+    取得できなかったタイルがある場合は、雨がある可能性があるものとして扱う。
+    
+    Args:
+        response (dict): GraphHopperのレスポンス（points_encoded: False）
+        zoom_level (int): ズームレベル
+        
+    Returns:
+        bool: 経路の周辺に雨がある（または確認できない）場合はTrue
+        dict: 雨データの取得状況（RainData.status()）
+    """
+    coordinates = [
+        point
+        for path in response.get("paths", [])
+        for point in path.get("points", {}).get("coordinates", [])
+    ]
+    if not coordinates:
+        return True, {"complete": False, "stale_tiles": 0, "unknown_tiles": 0, "nowcast_time": None}
+    lon, lat = np.asarray(coordinates, dtype=np.float64)[:, :2].T
+
+    with timed("tiles"):
+        tile_set = TileSet.from_path(lat, lon, zoom_level, buffer_tiles=RAIN_PATH_BUFFER_TILES)
+    now = datetime.now(JST)
+    rain_data = RainData(YAHOO_API_KEY)
+    with timed("rain_fetch"):
+        rain_data.get(coordinate_list=tile_set, date=now, zoom_level=zoom_level,
+                      deadline=_deadline(RAIN_PATH_CHECK_BUDGET))
+    apply_arrival_times(rain_data, [coordinate(lat[0], lon[0])], route_speed_kmh(response), now)
+
+    num_rainy = int(rain_data.rain_mask().sum())
+    num_unknown = len(rain_data.unknown_tiles)
+    logger.info("Rain check on path: %d tiles, %d rainy, %d stale, %d unknown",
+                len(tile_set), num_rainy, len(rain_data.stale_tiles), num_unknown)
+    return num_rainy > 0 or num_unknown > 0, rain_data.status()
+
+
+def with_rain_exposure(response: dict, zoom_level: int = 13) -> dict:
+    """
+    GraphHopperのルートの各経路に、雨の中を通る距離・時間と雨の区間（rain_exposure）を付ける。
+    経路の区間の中点を含むタイルだけを取得し、すべての点をまとめて判定する。
+    元のレスポンス（キャッシュされている場合がある）は変更しない。
+    
+    Args:
+        response (dict): GraphHopperのレスポンス（points_encoded: False）
+        zoom_level (int): ズームレベル
+        
+    Returns:
+        dict: 各経路にrain_exposureを付けたレスポンス
+    """
+    paths = response.get("paths") or []
+    with timed("tiles"):
+        tile_set = path_tiles(paths, zoom_level)
+    now = datetime.now(JST)
+    rain_data = RainData(YAHOO_API_KEY)
+    if len(tile_set):
+        with timed("rain_fetch"):
+            rain_data.get(coordinate_list=tile_set, date=now, zoom_level=zoom_level,
+                          deadline=_deadline(RAIN_PATH_CHECK_BUDGET))
+
+    with timed("rain_exposure"):
+        scored = []
+        for path in paths:
+            exposure = score_path(path_coordinates(path), path.get("time", 0), rain_data,
+                                  now.timestamp() if RAIN_TIME_MODE == "eta" else None)
+            scored.append({**path, "rain_exposure": exposure})
+    if scored:
+        logger.info("Rain exposure: %.0f m in rain, max %d mm/h, %.0f m unknown",
+                    scored[0]["rain_exposure"]["distance"], scored[0]["rain_exposure"]["max_intensity"],
+                    scored[0]["rain_exposure"]["unknown_distance"])
+    return {**response, "paths": scored}
+
+
+def get_rain_info_for_pairs(pairs: list[tuple[str, str]]):
+    """
+    複数の開始地点・目的地の組に必要なタイルをまとめ、雨データを一度だけ取得する関数。
+    
+    Args:
+        pairs (list[tuple[str, str]]): (開始地点, 目的地) の座標のリスト
+        
+    Returns:
+        dict: すべての組で共有する雨データを含む辞書
+        list[tile]: 雨のタイルのリスト
+    """
+    logger.info("Fetching rain info for %d route pairs", len(pairs))
+
+    with timed("tiles"):
+        bboxes = [_route_bbox(start, goal) for start, goal in pairs]
+        tile_set = TileSet.concatenate([select_tiles(bbox, zoom_level=13) for bbox in bboxes]).unique()
+    
+    # 回避エリアは全組で共有するため、いずれかの組の到着時刻に雨のタイルを回避する
+    return get_rain_info_for_tiles(tile_set, origins=[bbox.start for bbox in bboxes])
+
+
+async def get_routes(pairs: list[tuple[str, str]], rain_avoidance_data: dict = None) -> list[tuple[dict, bool]]:
+    """
+    複数の開始地点・目的地の組のルートを、同時実行数を制限しながら並行に取得する。
+    
+    Args:
+        pairs (list[tuple[str, str]]): (開始地点, 目的地) の座標のリスト
+        rain_avoidance_data (dict): すべての組で共有する雨エリア回避用のpriority・areas設定
+        
+    Returns:
+        list[tuple[dict, bool]]: 組ごとのルート情報とキャッシュから返したかどうか（入力順）
+    """
+    semaphore = asyncio.Semaphore(ROUTES_BATCH_CONCURRENCY)
+
+    async def _route(start: str, goal: str):
+        async with semaphore:
+            return await get_route(start, goal, rain_avoidance_data)
+
+    return await asyncio.gather(*(_route(start, goal) for start, goal in pairs))
+
+
+def plan_routing_mode(has_custom_model: bool) -> str:
+    """
+    GraphHopperの探索方法を選ぶ。
+    CHは事前計算した重みでしか探索できないため、custom_modelがある場合はLMを使う。
+    
+    Args:
+        has_custom_model (bool): リクエストにcustom_modelを含むかどうか
+        
+    Returns:
+        str: "ch"（Contraction Hierarchies）、"lm"（Landmarks）、"flex"（高速化なし）のいずれか
+    """
+    if ROUTING_MODE in ("lm", "flex"):
+        return ROUTING_MODE
+    if ROUTING_MODE == "ch" and has_custom_model:
+        logger.warning("ROUTING_MODE=ch cannot be used with a custom_model, falling back to lm")
+        return "lm"
+    if ROUTING_MODE not in ("auto", "ch"):
+        logger.warning("Unknown ROUTING_MODE %s, using auto", ROUTING_MODE)
+    return "lm" if has_custom_model else "ch"
+
+
+async def get_route_from_graphhopper(start: str, goal: str, rain_avoidance_data: dict = None):
     """
     GraphHopperサーバーにルートリクエストを送信し、雨エリア回避を考慮したルート情報を取得する。
     
@@ -64,9 +341,6 @@ def get_route_from_graphhopper(start: str, goal: str, rain_avoidance_data: dict
         dict: GraphHopperからのルート情報
     """
     
-    # GraphHopperエンドポイント（Dockerネットワーク内のサービス名を使用）
-    url = "http://graphhopper:8989/route"
-    
     # リクエストボディを構築
     # 座標をlon, lat形式に変換
     start_lat, start_lon = map(float, start.split(','))
@@ -79,63 +353,44 @@ def get_route_from_graphhopper(start: str, goal: str, rain_avoidance_data: dict
         ],
         "profile": "car",
         "points_encoded": False,
-        "ch.disable": True
     }
     
-    # 雨エリア回避設定を追加
-    if rain_avoidance_data and "priority" in rain_avoidance_data and "areas" in rain_avoidance_data:
+    # 雨エリア回避設定を追加（回避するエリアがなければcustom_modelを付けず、CHで探索できるようにする）
+    if rain_avoidance_data and rain_avoidance_data.get("priority") and "areas" in rain_avoidance_data:
         request_body["custom_model"] = {
             "priority": rain_avoidance_data["priority"],
             "areas": rain_avoidance_data["areas"]
         }
     
-    try:
-        logger.info("Sending route request to GraphHopper: %s", url)
-        logger.debug("Request body: %s", json.dumps(request_body, indent=2, ensure_ascii=False))
-        
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        
-        response = requests.post(url, json=request_body, headers=headers, timeout=30)
+    routing_mode = plan_routing_mode("custom_model" in request_body)
+    request_body.update(ROUTING_MODE_PARAMS[routing_mode])
+    logger.debug("Routing mode: %s", routing_mode)
+    routing_modes.inc(mode=routing_mode)
+    
+    return await get_graphhopper_client().route(request_body)
+
+
+async def get_route(start: str, goal: str, rain_avoidance_data: dict = None) -> tuple[dict, bool]:
+    """
+    ルートキャッシュを確認し、なければGraphHopperからルートを取得してキャッシュする。
+    
+    Args:
+        start (str): 開始地点の座標（例: "35.6762,139.6503"）
+        goal (str): 目的地の座標（例: "35.7169,139.7774"）
+        rain_avoidance_data (dict): 雨エリア回避用のpriority・areas設定（Noneなら通常のルート）
         
-        if response.status_code == 200:
-            route_data = response.json()
-            logger.info("Route calculation successful")
-            return route_data
-        else:
-            # GraphHopperからのエラーレスポンスを詳細に処理
-            try:
-                error_json = response.json()
-                if "message" in error_json:
-                    error_detail = error_json["message"]
-                    # GraphHopperの具体的なエラーメッセージを含める
-                    if "hints" in error_json and error_json["hints"]:
-                        error_detail += " Details: " + "; ".join([
-                            hint.get("message", "") for hint in error_json["hints"]
-                        ])
-                else:
-                    error_detail = response.text
-            except (json.JSONDecodeError, ValueError):
-                error_detail = response.text
-            
-            error_msg = f"GraphHopper API error: {response.status_code} - {error_detail}"
-            logger.error(error_msg)
-            return {
-                "error": error_msg,
-                "status_code": response.status_code,
-                "graphhopper_response": error_json if 'error_json' in locals() else response.text
-            }
-            
-    except requests.exceptions.RequestException as e:
-        error_msg = f"Request to GraphHopper failed: {str(e)}"
-        logger.error(error_msg)
-        return {
-            "error": error_msg
-        }
-    except Exception as e:
-        error_msg = f"Unexpected error: {str(e)}"
-        logger.error(error_msg)
-        return {
-            "error": error_msg
-        }
+    Returns:
+        dict: GraphHopperからのルート情報
+        bool: キャッシュから返した場合はTrue
+    """
+    kind = "normal_route" if rain_avoidance_data is None else "route"
+    fingerprint = area_fingerprint(rain_avoidance_data)
+    cached = route_cache.get(start, goal, kind, fingerprint)
+    if cached is not None:
+        logger.info("Route cache hit for %s -> %s (%s)", start, goal, kind)
+        return cached, True
+
+    response = await get_route_from_graphhopper(start, goal, rain_avoidance_data)
+    if "error" not in response:
+        route_cache.set(start, goal, kind, response, fingerprint)
+    return response, False
@@ -0,0 +1,244 @@
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from .compact import compact_route_response, pack_tiles, dumps_json
+from .prefetch import RAIN_PREFETCH_OFFSET
+from .rain_cache import run_every_bucket
+from .rain_data import RainData
+from .service import get_rain_info, get_route, apply_arrival_times, route_speed_kmh, JST, YAHOO_API_KEY, RAIN_PATH_BUFFER_TILES
+from .values import coordinate, haversine_km, TileSet
+from src.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 同時に登録できる走行中のトリップ数の上限
+TRIP_MAX_ACTIVE = int(os.getenv("TRIP_MAX_ACTIVE", "1000"))
+# 接続を保つためにコメント行を送る間隔（秒）
+TRIP_KEEPALIVE = float(os.getenv("TRIP_KEEPALIVE", "15"))
+# Yahoo!のデータ更新を待つため、10分境界から何秒後にトリップの雨を確認するか
+TRIP_CHECK_OFFSET = float(os.getenv("TRIP_CHECK_OFFSET", str(RAIN_PREFETCH_OFFSET)))
+# 雨を確認・ルートを再計算するトリップの同時実行数
+TRIP_CHECK_CONCURRENCY = int(os.getenv("TRIP_CHECK_CONCURRENCY", "8"))
+
+
+def format_event(event: str, data: dict) -> bytes:
+    """
+    Server-Sent Eventsの1イベントに変換する。
+    Args:
+        event (str): イベント名
+        data (dict): JSONで送るデータ
+    Returns:
+        bytes: "event: ...\\ndata: ...\\n\\n" の形式のバイト列
+    """
+    return b"event: " + event.encode() + b"\ndata: " + dumps_json(data) + b"\n\n"
+
+
+def _path_points(response: dict) -> np.ndarray:
+    paths = response.get("paths") or []
+    coordinates = paths[0].get("points", {}).get("coordinates", []) if paths else []
+    if not coordinates:
+        return np.zeros((0, 2))
+    return np.asarray(coordinates, dtype=np.float64)[:, :2]
+
+
+class Trip:
+    """
+    走行中のトリップ。現在のルートと、残りの経路の周辺で雨のタイルを保持する。
+    """
+
+    def __init__(self, start: str, goal: str, format: str = "json", simplify_zoom: int | None = None):
+        self.trip_id = uuid.uuid4().hex
+        self.goal = goal
+        self.format = format
+        self.simplify_zoom = simplify_zoom
+        lat, lon = map(float, start.split(","))
+        self.position = coordinate(lat, lon)
+        self.response: dict | None = None
+        # 経路の [lon, lat] の配列と、経路が変わったかを比べるための丸めた座標
+        self.points = np.zeros((0, 2))
+        self.path_signature = b""
+        self.rain_keys: set[tuple[int, int, int]] = set()
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue()
+
+    def remaining_points(self) -> np.ndarray:
+        """
+        経路のうち、現在地に最も近い点から先の部分を返す。
+        Returns:
+            np.ndarray: [lon, lat] の配列
+        """
+        if len(self.points) == 0:
+            return self.points
+        distance = haversine_km(self.position.lat, self.position.lon, self.points[:, 1], self.points[:, 0])
+        return self.points[int(np.argmin(distance)):]
+
+    def send(self, event: str, data: dict) -> None:
+        self.queue.put_nowait(format_event(event, {"trip_id": self.trip_id, **data}))
+
+
+def watched_rain(trip: Trip, zoom_level: int = 13) -> set[tuple[int, int, int]]:
+    """
+    残りの経路の周辺のタイルのうち、雨のタイルを返す。
+    Args:
+        trip (Trip): トリップ
+        zoom_level (int): ズームレベル
+    Returns:
+        set[tuple[int, int, int]]: 雨のタイルの (x, y, zoom)
+    """
+    points = trip.remaining_points()
+    if len(points) == 0:
+        return set()
+    tile_set = TileSet.from_path(points[:, 1], points[:, 0], zoom_level, buffer_tiles=RAIN_PATH_BUFFER_TILES)
+    now = datetime.now(JST)
+    rain_data = RainData(YAHOO_API_KEY)
+    rain_data.get(coordinate_list=tile_set, date=now, zoom_level=zoom_level)
+    apply_arrival_times(rain_data, [trip.position], route_speed_kmh(trip.response), now)
+    rain_index, _ = rain_data.rainy_tiles()
+    return set(rain_data.feature_tiles[rain_index].keys())
+
+
+def _to_tiles(keys) -> list:
+    keys = sorted(keys)
+    if not keys:
+        return []
+    return TileSet(*(np.array(v, dtype=np.int64) for v in zip(*keys))).to_tiles()
+
+
+class TripManager:
+    """
+    走行中のトリップを登録し、Yahoo!の更新周期ごとに残りの経路の周辺の雨を確認する。
+    雨のタイルが変わったトリップだけルートを再計算し、差分と変わったルートをイベントとして送る。
+    """
+
+    def __init__(self, max_active: int = TRIP_MAX_ACTIVE, offset: float = TRIP_CHECK_OFFSET):
+        self.max_active = max_active
+        self.offset = offset
+        self.trips: dict[str, Trip] = {}
+        self._task: asyncio.Task | None = None
+
+    @property
+    def full(self) -> bool:
+        return len(self.trips) >= self.max_active
+
+    async def register(self, start: str, goal: str, format: str = "json", simplify_zoom: int | None = None) -> Trip:
+        """
+        トリップを登録し、最初のルートと雨のタイルをイベントとして積む。
+        Args:
+            start (str): 開始地点の座標（例: "35.6762,139.6503"）
+            goal (str): 目的地の座標（例: "35.7169,139.7774"）
+            format (str): ルートの形式（"json" または "compact"）
+            simplify_zoom (int | None): compact形式で経路を間引くズームレベル
+        Returns:
+            Trip: 登録したトリップ
+        """
+        trip = Trip(start, goal, format, simplify_zoom)
+        self.trips[trip.trip_id] = trip
+        logger.info("Trip %s registered: %s -> %s (%d active)", trip.trip_id, start, goal, len(self.trips))
+        try:
+            await self.refresh(trip, initial=True)
+        except Exception:
+            # 最初の計算に失敗したトリップは残さない（上限に数えられ、確認され続けるため）
+            self.unregister(trip.trip_id)
+            raise
+        return trip
+
+    def unregister(self, trip_id: str) -> None:
+        if self.trips.pop(trip_id, None) is not None:
+            logger.info("Trip %s unregistered (%d active)", trip_id, len(self.trips))
+
+    def update_position(self, trip_id: str, lat: float, lon: float) -> bool:
+        """
+        トリップの現在地を更新する（次の確認から、現在地より先の経路だけを見る）。
+        Returns:
+            bool: トリップが見つかった場合はTrue
+        """
+        trip = self.trips.get(trip_id)
+        if trip is None:
+            return False
+        trip.position = coordinate(lat, lon)
+        return True
+
+    async def refresh(self, trip: Trip, initial: bool = False) -> None:
+        """
+        残りの経路の周辺の雨を確認し、変わっていればルートを再計算してイベントを積む。
+        Args:
+            trip (Trip): トリップ
+            initial (bool): 登録時の最初の計算の場合はTrue（雨の確認をせずにルートを求める）
+        """
+        # まだルートを求められていないトリップは、雨が変わらなくても再計算する
+        if not initial and trip.response is not None:
+            rain_keys = await run_in_threadpool(watched_rain, trip)
+            if rain_keys == trip.rain_keys:
+                logger.debug("Trip %s: rain unchanged on %d tiles", trip.trip_id, len(rain_keys))
+                return
+            self._send_rain_diff(trip, rain_keys)
+
+        position = f"{trip.position.lat},{trip.position.lon}"
+        rain_data, _ = await run_in_threadpool(get_rain_info, position, trip.goal, trip.response)
+        response, _ = await get_route(position, trip.goal, rain_data)
+        if "error" in response:
+            logger.error("Trip %s: reroute failed: %s", trip.trip_id, response["error"])
+            trip.send("error", {"error": response["error"], "status_code": response.get("status_code", 500)})
+            return
+
+        points = _path_points(response)
+        signature = np.round(points, 5).tobytes()
+        if signature != trip.path_signature:
+            trip.response = response
+            trip.points = points
+            trip.path_signature = signature
+            body = response if trip.format != "compact" else compact_route_response(response, trip.simplify_zoom)
+            trip.send("route", {"response": body, "rain_status": rain_data.get("rain_status")})
+            logger.info("Trip %s: route %s", trip.trip_id, "computed" if initial else "changed")
+
+        # 経路が変わった場合は、新しい経路の周辺の雨を次の比較の基準にする
+        rain_keys = await run_in_threadpool(watched_rain, trip)
+        if rain_keys != trip.rain_keys:
+            self._send_rain_diff(trip, rain_keys)
+
+    def _send_rain_diff(self, trip: Trip, rain_keys: set[tuple[int, int, int]]) -> None:
+        added, removed = rain_keys - trip.rain_keys, trip.rain_keys - rain_keys
+        trip.rain_keys = rain_keys
+        trip.send("rain", {"added": pack_tiles(_to_tiles(added)), "removed": pack_tiles(_to_tiles(removed))})
+        logger.debug("Trip %s: %d rain tiles added, %d removed", trip.trip_id, len(added), len(removed))
+
+    async def check_all(self) -> None:
+        """
+        登録中のすべてのトリップの雨を確認する。
+        """
+        semaphore = asyncio.Semaphore(TRIP_CHECK_CONCURRENCY)
+
+        async def _check(trip: Trip):
+            async with semaphore:
+                try:
+                    await self.refresh(trip)
+                except Exception as e:
+                    logger.error("Trip %s: rain check failed: %s", trip.trip_id, e)
+
+        started = time.monotonic()
+        trips = list(self.trips.values())
+        await asyncio.gather(*(_check(trip) for trip in trips))
+        if trips:
+            logger.info("Checked rain for %d trips in %.1fs", len(trips), time.monotonic() - started)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(run_every_bucket(self.offset, self.check_all))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.trips.clear()
+
+
+trip_manager = TripManager()
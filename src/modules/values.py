@@ -3,6 +3,10 @@ import numpy as np
 from typing import List
 import math
 
+# 緯度1度あたりの距離（km）
+KM_PER_DEG_LAT = 111.32
+EARTH_RADIUS_KM = 6371.0088
+
 @dataclass
 class coordinate:
     lat: float
@@ -95,13 +99,54 @@ class bounding_box:
         Returns:
             List[tile]: タイルリスト
         """
-        min_tile = _deg2num(coordinate(self.max_lat, self.min_lon), zoom_level)
-        max_tile = _deg2num(coordinate(self.min_lat, self.max_lon), zoom_level)
-        tiles = []
-        for xtile in range(min_tile.x, max_tile.x + 1):
-            for ytile in range(min_tile.y, max_tile.y + 1):
-                tiles.append(tile(xtile, ytile, zoom_level))
-        return tiles
+        return self.create_tile_set(zoom_level).to_tiles()
+
+    def create_tile_set(self, zoom_level: int = 13) -> "TileSet":
+        """
+        指定されたズームレベルでタイルを配列としてまとめて生成する。
+        並び順はcreate_tilesと同じ（x昇順、同じxの中でy昇順）。
+        Args:
+            zoom_level (int): ズームレベル（デフォルトは13）
+        Returns:
+            TileSet: タイル集合
+        """
+        return TileSet.from_bounds(self.min_lat, self.min_lon, self.max_lat, self.max_lon, zoom_level)
+
+    def create_corridor_tile_set(self, zoom_level: int = 13, buffer_km: float = 5.0) -> "TileSet":
+        """
+        開始地点と目的地を結ぶ線分から buffer_km 以内に掛かるタイルだけを生成する。
+        （線分を buffer_km だけ太らせた領域と重なる可能性のあるタイル）
+        Args:
+            zoom_level (int): ズームレベル（デフォルトは13）
+            buffer_km (float): 線分からの距離（km）
+        Returns:
+            TileSet: タイル集合（create_tile_setと同じ並び順）
+        """
+        km_per_deg_lon = KM_PER_DEG_LAT * math.cos(math.radians((self.start.lat + self.goal.lat) / 2))
+        pad_lat = buffer_km / KM_PER_DEG_LAT
+        pad_lon = buffer_km / km_per_deg_lon
+        candidates = TileSet.from_bounds(
+            min(self.start.lat, self.goal.lat) - pad_lat,
+            min(self.start.lon, self.goal.lon) - pad_lon,
+            max(self.start.lat, self.goal.lat) + pad_lat,
+            max(self.start.lon, self.goal.lon) + pad_lon,
+            zoom_level,
+        )
+
+        # 開始地点を原点とする平面座標（km）で線分までの距離を求める
+        lat, lon = candidates.centers()
+        px = (lon - self.start.lon) * km_per_deg_lon
+        py = (lat - self.start.lat) * KM_PER_DEG_LAT
+        gx = (self.goal.lon - self.start.lon) * km_per_deg_lon
+        gy = (self.goal.lat - self.start.lat) * KM_PER_DEG_LAT
+        length2 = gx * gx + gy * gy
+        t = np.clip((px * gx + py * gy) / length2, 0.0, 1.0) if length2 > 0 else 0.0
+        distance = np.hypot(px - t * gx, py - t * gy)
+
+        # タイルの中心から角までの距離を加えて、一部でも掛かるタイルを残す
+        lon_min, lat_min, lon_max, lat_max = candidates.bounds()
+        half_diagonal = np.hypot((lon_max - lon_min) * km_per_deg_lon, (lat_max - lat_min) * KM_PER_DEG_LAT) / 2
+        return candidates[distance <= buffer_km + half_diagonal]
 
     def get_tile_centers(self, tiles: List[tile]) -> List[coordinate]:
         """
@@ -111,11 +156,223 @@ class bounding_box:
         Returns:
             List[coordinate]: タイルの中心座標のリスト
         """
-        centers = []
-        for t in tiles:
-            coord = _num2deg(t)
-            centers.append(coord)
-        return centers
+        return TileSet.from_tiles(tiles).to_coordinates()
+
+
+@dataclass
+class TileSet:
+    """
+    タイル座標を NumPy 配列で保持するタイル集合。
+    タイルごとにズームレベルを持つため、異なるズームレベルのタイルを混在できる。
+    """
+    x: np.ndarray
+    y: np.ndarray
+    zoom: np.ndarray
+
+    def __post_init__(self):
+        self.x = np.asarray(self.x, dtype=np.int64)
+        self.y = np.asarray(self.y, dtype=np.int64)
+        self.zoom = np.broadcast_to(np.asarray(self.zoom, dtype=np.int64), self.x.shape).copy()
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, index) -> "TileSet":
+        return TileSet(self.x[index], self.y[index], self.zoom[index])
+
+    @classmethod
+    def from_bounds(cls, min_lat: float, min_lon: float, max_lat: float, max_lon: float, zoom_level: int = 13) -> "TileSet":
+        """
+        緯度経度の範囲を覆うタイル集合を生成する。
+        Args:
+            min_lat, min_lon, max_lat, max_lon (float): 範囲
+            zoom_level (int): ズームレベル
+        Returns:
+            TileSet: タイル集合（x昇順、同じxの中でy昇順）
+        """
+        corner_x, corner_y = deg2num_array(np.array([max_lat, min_lat]), np.array([min_lon, max_lon]), zoom_level)
+        xs = np.arange(corner_x[0], corner_x[1] + 1)
+        ys = np.arange(corner_y[0], corner_y[1] + 1)
+        grid_x, grid_y = np.meshgrid(xs, ys, indexing="ij")
+        return cls(grid_x.ravel(), grid_y.ravel(), zoom_level)
+
+    @classmethod
+    def from_coordinates(cls, lat: np.ndarray, lon: np.ndarray, zoom_level: int = 13) -> "TileSet":
+        """
+        緯度経度の配列を、それぞれが含まれるタイルに変換する。
+        Args:
+            lat (np.ndarray): 緯度の配列
+            lon (np.ndarray): 経度の配列
+            zoom_level (int): ズームレベル
+        Returns:
+            TileSet: タイル集合
+        """
+        xs, ys = deg2num_array(lat, lon, zoom_level)
+        return cls(xs, ys, zoom_level)
+
+    @classmethod
+    def from_path(cls, lat: np.ndarray, lon: np.ndarray, zoom_level: int = 13, buffer_tiles: int = 0) -> "TileSet":
+        """
+        経路（折れ線）が通るタイル集合を生成する。
+        Args:
+            lat (np.ndarray): 経路の点の緯度の配列
+            lon (np.ndarray): 経路の点の経度の配列
+            zoom_level (int): ズームレベル
+            buffer_tiles (int): 通るタイルの周囲に加えるタイルの数
+        Returns:
+            TileSet: 重複のないタイル集合
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        if len(lat) == 0:
+            return cls([], [], [])
+        n = 1 << zoom_level
+        fx = (lon + 180.0) / 360.0 * n
+        fy = (1.0 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2.0 * n
+
+        # 長い線分の途中で通るタイルを落とさないよう、1/4タイル以下の間隔で点を補う
+        steps = np.maximum(np.ceil(np.maximum(np.abs(np.diff(fx)), np.abs(np.diff(fy))) * 4), 1).astype(np.int64)
+        segment = np.repeat(np.arange(len(steps)), steps)
+        t = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+        px = np.concatenate([fx[segment] + (fx[segment + 1] - fx[segment]) * t, fx[-1:]])
+        py = np.concatenate([fy[segment] + (fy[segment + 1] - fy[segment]) * t, fy[-1:]])
+        tiles = cls(np.floor(px), np.floor(py), zoom_level).unique()
+
+        if buffer_tiles > 0:
+            offsets = np.arange(-buffer_tiles, buffer_tiles + 1)
+            dx, dy = (v.ravel() for v in np.meshgrid(offsets, offsets, indexing="ij"))
+            tiles = cls((tiles.x[:, None] + dx).ravel(), (tiles.y[:, None] + dy).ravel(), zoom_level).unique()
+        return tiles
+
+    @classmethod
+    def from_tiles(cls, tiles: List[tile]) -> "TileSet":
+        return cls(
+            np.fromiter((t.x for t in tiles), dtype=np.int64, count=len(tiles)),
+            np.fromiter((t.y for t in tiles), dtype=np.int64, count=len(tiles)),
+            np.fromiter((t.zoom for t in tiles), dtype=np.int64, count=len(tiles)),
+        )
+
+    @classmethod
+    def concatenate(cls, tile_sets: List["TileSet"]) -> "TileSet":
+        if not tile_sets:
+            return cls([], [], [])
+        return cls(
+            np.concatenate([t.x for t in tile_sets]),
+            np.concatenate([t.y for t in tile_sets]),
+            np.concatenate([t.zoom for t in tile_sets]),
+        )
+
+    def to_tiles(self) -> List[tile]:
+        return [tile(x, y, z) for x, y, z in zip(self.x.tolist(), self.y.tolist(), self.zoom.tolist())]
+
+    def keys(self) -> List[tuple]:
+        """
+        タイルごとの (x, y, zoom) のタプルを返す。
+        Returns:
+            List[tuple]: キーのリスト
+        """
+        return list(zip(self.x.tolist(), self.y.tolist(), self.zoom.tolist()))
+
+    def unique(self) -> "TileSet":
+        """
+        重複するタイルを取り除く（最初に現れた順を保つ）。
+        Returns:
+            TileSet: 重複のないタイル集合
+        """
+        return self[self.unique_index()]
+
+    def unique_index(self) -> np.ndarray:
+        """
+        重複を除いたときに残るタイルの添字を返す。
+        Returns:
+            np.ndarray: 各タイルが最初に現れた位置（昇順）
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.int64)
+        stacked = np.stack([self.x, self.y, self.zoom], axis=1)
+        _, first_index = np.unique(stacked, axis=0, return_index=True)
+        return np.sort(first_index)
+
+    def centers(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        タイルの中心の緯度経度を返す。
+        Returns:
+            (lat, lon): 中心の緯度・経度の配列
+        """
+        return num2deg_array(self.x + 0.5, self.y + 0.5, self.zoom)
+
+    def to_coordinates(self) -> List[coordinate]:
+        """
+        タイルの中心座標をcoordinateのリストとして返す。
+        Returns:
+            List[coordinate]: タイルの中心座標のリスト
+        """
+        lat, lon = self.centers()
+        return [coordinate(la, lo) for la, lo in zip(lat.tolist(), lon.tolist())]
+
+    def bounds(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        タイルのバウンディングボックスを返す。
+        Returns:
+            (lon_min, lat_min, lon_max, lat_max): 各値の配列
+        """
+        lat_max, lon_min = num2deg_array(self.x, self.y, self.zoom)
+        lat_min, lon_max = num2deg_array(self.x + 1, self.y + 1, self.zoom)
+        return lon_min, lat_min, lon_max, lat_max
+
+    def to_polygons(self) -> List[dict]:
+        """
+        タイルごとのGeoJSONのPolygonジオメトリを返す。
+        Returns:
+            List[dict]: GeoJSON形式のジオメトリのリスト
+        """
+        lon_min, lat_min, lon_max, lat_max = (a.tolist() for a in self.bounds())
+        return [
+            {
+                "type": "Polygon",
+                "coordinates": [[
+                    [x0, y0],
+                    [x0, y1],
+                    [x1, y1],
+                    [x1, y0],
+                    [x0, y0]
+                ]]
+            }
+            for x0, y0, x1, y1 in zip(lon_min, lat_min, lon_max, lat_max)
+        ]
+
+
+def num2deg_array(x: np.ndarray, y: np.ndarray, zoom) -> tuple[np.ndarray, np.ndarray]:
+    """
+    タイル座標（小数可）を緯度経度にまとめて変換する。
+    Args:
+        x (np.ndarray): タイルのx座標
+        y (np.ndarray): タイルのy座標
+        zoom: ズームレベル（スカラーまたは配列）
+    Returns:
+        (lat, lon): 緯度・経度の配列
+    """
+    n = np.exp2(zoom)
+    lon_deg = x / n * 360.0 - 180.0
+    lat_deg = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n))))
+    return lat_deg, lon_deg
+
+
+def deg2num_array(lat: np.ndarray, lon: np.ndarray, zoom_level: int = 13) -> tuple[np.ndarray, np.ndarray]:
+    """
+    緯度経度をタイル座標にまとめて変換する。
+    Args:
+        lat (np.ndarray): 緯度の配列
+        lon (np.ndarray): 経度の配列
+        zoom_level (int): ズームレベル
+    Returns:
+        (x, y): タイル座標の配列
+    """
+    lat_rad = np.radians(np.asarray(lat, dtype=np.float64))
+    n = 1 << zoom_level
+    xtile = ((np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * n).astype(np.int64)
+    ytile = ((1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n).astype(np.int64)
+    return xtile, ytile
 
 
 def _num2deg(tile_obj: tile) -> coordinate:
@@ -149,3 +406,16 @@ def _deg2num(coord: coordinate, zoom_level: int = 13) -> tile:
     ytile = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
     return tile(xtile, ytile, zoom_level)
 
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    2点間の大円距離を求める（配列も可）。
+    Args:
+        lat1, lon1 (float | np.ndarray): 1点目の緯度経度
+        lat2, lon2 (float | np.ndarray): 2点目の緯度経度
+    Returns:
+        float | np.ndarray: 距離（km）
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
@@ -0,0 +1,428 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed, wait
+from typing import Callable
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from .compact import loads_json
+from .rain_grid import feature_slots, NUM_SLOTS, UNKNOWN
+from .values import coordinate
+from src.core.logger import get_logger
+from src.core.metrics import yahoo_chunk_seconds, yahoo_chunk_failures, yahoo_hedged_requests
+
+logger = get_logger(__name__)
+
+YAHOO_WEATHER_URL = os.getenv("YAHOO_WEATHER_URL", "https://map.yahooapis.jp/weather/V1/place")
+YAHOO_MAX_CONCURRENCY = int(os.getenv("YAHOO_MAX_CONCURRENCY", "8"))
+YAHOO_TIMEOUT = float(os.getenv("YAHOO_TIMEOUT", "5"))
+# 先読みが同時に発行するリクエスト数の上限（リクエスト処理用のYAHOO_MAX_CONCURRENCYとは別に確保する）
+YAHOO_PREFETCH_CONCURRENCY = int(os.getenv("YAHOO_PREFETCH_CONCURRENCY", "2"))
+# URLは一度に10座標が上限だった
+YAHOO_CHUNK_SIZE = 10
+# アプリケーションIDごとの1日のリクエスト数の上限（Yahoo!デベロッパーネットワークの利用制限）
+YAHOO_DAILY_LIMIT = int(os.getenv("YAHOO_DAILY_LIMIT", "50000"))
+# まとめて発行できるリクエスト数と、1秒あたりのリクエスト数の上限（0なら制限しない）。
+# 既定の上限は、まとめて発行した分を含めても1日の上限を超えない値
+YAHOO_RATE_BURST = int(os.getenv("YAHOO_RATE_BURST", "1000"))
+YAHOO_RATE_LIMIT = float(os.getenv("YAHOO_RATE_LIMIT", str(max(1, YAHOO_DAILY_LIMIT - YAHOO_RATE_BURST) / 86400)))
+# 1なら同時に処理中のリクエストの座標をまとめて10座標ずつ問い合わせる
+YAHOO_BATCHING = os.getenv("YAHOO_BATCHING", "1") == "1"
+# 10座標に満たないチャンクを発行するまでに他のリクエストの座標を待つ秒数
+YAHOO_BATCH_WINDOW = float(os.getenv("YAHOO_BATCH_WINDOW", "0.01"))
+# 直近の応答時間のこのパーセンタイルを超えたチャンクは、同じリクエストをもう1つ発行して早い方を使う（0なら行わない）
+YAHOO_HEDGE_PERCENTILE = float(os.getenv("YAHOO_HEDGE_PERCENTILE", "0"))
+# パーセンタイルを計算する直近の応答時間の数と、計算を始めるのに必要な数
+YAHOO_HEDGE_WINDOW = int(os.getenv("YAHOO_HEDGE_WINDOW", "200"))
+YAHOO_HEDGE_MIN_SAMPLES = int(os.getenv("YAHOO_HEDGE_MIN_SAMPLES", "20"))
+
+# 期限までに返らなかった座標の結果を、後から受け取る関数（引数: 座標の添字, 観測値・予報値の降水強度）
+LateCallback = Callable[[int, np.ndarray], None]
+
+
+class RateLimiter:
+    """
+    トークンバケット方式でリクエストの発行間隔を制限する。
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        トークンを1つ取得する（足りなければ補充されるまで待つ）。
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class YahooWeatherClient:
+    """
+    Yahoo!気象情報APIへのリクエストを並列に発行するクライアント。
+    keep-aliveのコネクションプールとスレッドプールをプロセス内で共有する。
+    """
+
+    def __init__(self, max_concurrency: int = YAHOO_MAX_CONCURRENCY, timeout: float = YAHOO_TIMEOUT,
+                 rate_limit: float = YAHOO_RATE_LIMIT, rate_burst: int = YAHOO_RATE_BURST,
+                 hedge_percentile: float = YAHOO_HEDGE_PERCENTILE,
+                 prefetch_concurrency: int = YAHOO_PREFETCH_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self.prefetch_concurrency = max(1, prefetch_concurrency)
+        self.timeout = timeout
+        # プリフェッチを含むすべてのリクエストで共有する
+        self.rate_limiter = RateLimiter(rate_limit, rate_burst)
+        self.hedge_percentile = hedge_percentile
+        self._latencies: deque[float] = deque(maxlen=YAHOO_HEDGE_WINDOW)
+        self._latencies_lock = threading.Lock()
+        # 追加のリクエストを発行する場合は、チャンクごとに最大2つの接続を使う
+        # 先読みの分も含め、リクエスト処理のスレッドが接続の空きを待たないようにする
+        pool_size = (self.max_concurrency + self.prefetch_concurrency) * (2 if hedge_percentile > 0 else 1)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="yahoo")
+        # 先読みの大量のチャンクがリクエスト処理のチャンクより先に並ばないよう、別のスレッドプールで実行する
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=self.prefetch_concurrency, thread_name_prefix="yahoo-prefetch")
+        self._http_executor = None
+        if hedge_percentile > 0:
+            self._http_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="yahoo-http")
+
+    def fetch(self, coordinate_list: list[coordinate], appid: str, date_str: str,
+              deadline: float | None = None, on_late: LateCallback | None = None,
+              prefetch: bool = False) -> np.ndarray:
+        """
+        座標リストを10個ずつのチャンクに分割し、並列に雨データを取得する。
+        Args:
+            coordinate_list (list[coordinate]): 取得する座標のリスト
+            appid (str): Yahoo!のアプリケーションID
+            date_str (str): 取得日時（YYYYMMDDHHMM）
+            deadline (float | None): 結果を待つ期限（time.monotonic()の値、Noneなら完了まで待つ）
+            on_late (LateCallback | None): 期限後に返った座標の結果を受け取る関数
+            prefetch (bool): 先読みの場合はTrue（YAHOO_PREFETCH_CONCURRENCY個のスレッドで取得する）
+        Returns:
+            np.ndarray: (座標数, NUM_SLOTS) の観測値・予報値の降水強度（入力順、取得できなかった・期限までに返らなかった座標はUNKNOWN）
+        """
+        chunks = [coordinate_list[i:i + YAHOO_CHUNK_SIZE] for i in range(0, len(coordinate_list), YAHOO_CHUNK_SIZE)]
+        executor = self.prefetch_executor if prefetch else self.executor
+        logger.debug("Split coordinates into %d chunks of size %d (concurrency=%d)", len(chunks), YAHOO_CHUNK_SIZE,
+                     self.prefetch_concurrency if prefetch else self.max_concurrency)
+
+        futures = [
+            executor.submit(self._fetch_chunk_hedged, chunk_index, len(chunks), chunk, appid, date_str)
+            for chunk_index, chunk in enumerate(chunks)
+        ]
+        # 結果はチャンクの順番どおりに書き込む
+        slots = np.full((len(coordinate_list), NUM_SLOTS), UNKNOWN, dtype=np.uint8)
+        for chunk_index, future in enumerate(futures):
+            offset = chunk_index * YAHOO_CHUNK_SIZE
+            try:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                chunk_slots = future.result(timeout=timeout)
+                if chunk_slots is not None:
+                    slots[offset:offset + len(chunk_slots)] = chunk_slots
+            except FutureTimeoutError:
+                logger.warning("Chunk %d/%d did not finish within the deadline", chunk_index + 1, len(chunks))
+                if on_late is not None:
+                    future.add_done_callback(lambda f, offset=offset: _deliver_late(f, offset, on_late))
+        return slots
+
+    def hedge_delay(self) -> float | None:
+        """
+        追加のリクエストを発行するまでの待ち時間（直近の応答時間のパーセンタイル）を返す。
+        Returns:
+            float | None: 秒数（追加のリクエストを行わない場合はNone）
+        """
+        if self._http_executor is None:
+            return None
+        with self._latencies_lock:
+            if len(self._latencies) < YAHOO_HEDGE_MIN_SAMPLES:
+                return None
+            samples = np.fromiter(self._latencies, dtype=np.float64)
+        return float(np.percentile(samples, self.hedge_percentile))
+
+    def _fetch_chunk_hedged(self, chunk_index: int, num_chunks: int, chunk: list[coordinate], appid: str,
+                            date_str: str) -> np.ndarray | None:
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._fetch_chunk(chunk_index, num_chunks, chunk, appid, date_str)
+
+        primary = self._http_executor.submit(self._fetch_chunk, chunk_index, num_chunks, chunk, appid, date_str)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        # 遅いチャンクは同じリクエストをもう1つ発行し、先に返った方を使う
+        logger.debug("Chunk %d exceeded %.3fs, sending a hedged request", chunk_index + 1, delay)
+        yahoo_hedged_requests.inc()
+        backup = self._http_executor.submit(self._fetch_chunk, chunk_index, num_chunks, chunk, appid, date_str)
+        first = next(as_completed([primary, backup]))
+        result = first.result()
+        if result is None:
+            # 先に返った方が失敗した場合はもう一方を待つ
+            result = (backup if first is primary else primary).result()
+        return result
+
+    def _fetch_chunk(self, chunk_index: int, num_chunks: int, chunk: list[coordinate], appid: str, date_str: str) -> np.ndarray | None:
+        coord_pairs = ' '.join([f'{coord.lon},{coord.lat}' for coord in chunk])
+        url = f'{YAHOO_WEATHER_URL}?coordinates={coord_pairs}&appid={appid}&output=json&date={date_str}'
+        logger.debug("Processing chunk %d/%d with %d coordinates", chunk_index + 1, num_chunks, len(chunk))
+
+        self.rate_limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            logger.debug("Response status: %d for chunk %d", response.status_code, chunk_index + 1)
+
+            if response.status_code != 200:
+                logger.error("Error fetching data for chunk %d: %s - %s", chunk_index + 1, response.status_code, response.text)
+                yahoo_chunk_failures.inc(reason="status")
+                return None
+
+            chunk_data = loads_json(response.content)
+
+            if "Feature" not in chunk_data:
+                logger.debug("No 'Feature' key found in chunk %d response", chunk_index + 1)
+                yahoo_chunk_failures.inc(reason="no_feature")
+                return None
+            with self._latencies_lock:
+                self._latencies.append(time.perf_counter() - started)
+            # レスポンスのJSONはここで降水強度の配列に変換し、以降は保持しない
+            return parse_features(chunk, chunk_data["Feature"])
+
+        except Exception as e:
+            logger.error("Exception while processing chunk %d: %s", chunk_index + 1, e)
+            yahoo_chunk_failures.inc(reason="exception")
+            return None
+        finally:
+            yahoo_chunk_seconds.observe(time.perf_counter() - started)
+
+
+def _deliver_late(future: Future, offset: int, on_late: LateCallback) -> None:
+    try:
+        chunk_slots = future.result()
+        if chunk_slots is None:
+            return
+        for i in np.flatnonzero(chunk_slots[:, 0] != UNKNOWN).tolist():
+            on_late(offset + i, chunk_slots[i])
+    except Exception as e:
+        logger.warning("Failed to store late Yahoo results: %s", e)
+
+
+def _deliver_late_item(future: Future, index: int, on_late: LateCallback) -> None:
+    try:
+        row = future.result()
+        if row is not None:
+            on_late(index, row)
+    except Exception as e:
+        logger.warning("Failed to store late Yahoo results: %s", e)
+
+
+def parse_features(chunk: list[coordinate], chunk_features: list[dict]) -> np.ndarray:
+    """
+    チャンクのレスポンスのFeatureを、座標の順番に並べた観測値・予報値の降水強度に変換する。
+    Args:
+        chunk (list[coordinate]): リクエストした座標
+        chunk_features (list[dict]): レスポンスのFeatureリスト
+    Returns:
+        np.ndarray: (座標数, NUM_SLOTS) のuint8配列（対応するFeatureがない座標はUNKNOWN）
+    """
+    slots = np.full((len(chunk), NUM_SLOTS), UNKNOWN, dtype=np.uint8)
+    if not chunk_features:
+        return slots
+    if len(chunk_features) == len(chunk):
+        aligned = chunk_features
+    else:
+        # 件数が合わない場合は座標文字列で対応付ける
+        by_coordinates = {feat.get("Geometry", {}).get("Coordinates"): feat for feat in chunk_features}
+        aligned = [by_coordinates.get(f'{coord.lon},{coord.lat}') for coord in chunk]
+        logger.warning("Chunk returned %d features for %d coordinates, matched %d by coordinates",
+                       len(chunk_features), len(chunk), sum(feat is not None for feat in aligned))
+    for i, feat in enumerate(aligned):
+        if feat is None:
+            continue
+        try:
+            slots[i] = feature_slots(feat)
+        except Exception as e:
+            logger.warning("Skip feature %s due to error: %s", feat.get("Id"), e)
+            slots[i] = 0
+    return slots
+
+
+_client: YahooWeatherClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_yahoo_client() -> YahooWeatherClient:
+    """
+    プロセス内で共有するYahooWeatherClientを返す。
+    Returns:
+        YahooWeatherClient: 共有クライアント
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = YahooWeatherClient()
+    return _client
+
+
+def bucket_date_str(date_str: str) -> str:
+    """
+    日時を含む10分単位の時間枠の先頭の日時を返す。
+    Args:
+        date_str (str): 日時（YYYYMMDDHHMM）
+    Returns:
+        str: 時間枠の先頭の日時（YYYYMMDDHHM0）
+    """
+    return date_str[:11] + "0"
+
+
+class _PendingCoordinate:
+    __slots__ = ("key", "coord", "future", "enqueued_at")
+
+    def __init__(self, key: tuple, coord: coordinate):
+        self.key = key
+        self.coord = coord
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class YahooFetchScheduler:
+    """
+    同時に処理中のリクエストの座標を短い時間だけ集め、重複を除いて10座標ずつのチャンクで問い合わせる。
+    同じタイルを複数のリクエストが待っている場合は、1回の問い合わせの結果を共有する。
+    """
+
+    def __init__(self, client: YahooWeatherClient, window: float = YAHOO_BATCH_WINDOW):
+        self.client = client
+        self.window = window
+        # (appid, 10分単位の時間枠の先頭の日時) ごとの発行待ちの座標
+        self._queues: dict[tuple[str, str], list[_PendingCoordinate]] = {}
+        # 発行待ち・問い合わせ中の座標（キー: (appid, 時間枠の先頭の日時, タイルのキー)）
+        self._inflight: dict[tuple, _PendingCoordinate] = {}
+        self._condition = threading.Condition()
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True, name="yahoo-scheduler")
+        self._dispatcher.start()
+
+    def fetch(self, keys: list[tuple], coordinate_list: list[coordinate], appid: str, date_str: str,
+              deadline: float | None = None, on_late: LateCallback | None = None) -> np.ndarray:
+        """
+        座標の雨データを、他のリクエストとまとめて取得する。
+        Args:
+            keys (list[tuple]): 座標ごとの重複判定用のキー（タイルの (x, y, zoom)）
+            coordinate_list (list[coordinate]): 取得する座標のリスト
+            appid (str): Yahoo!のアプリケーションID
+            date_str (str): 取得日時（YYYYMMDDHHMM）
+            deadline (float | None): 結果を待つ期限（time.monotonic()の値、Noneなら既定の時間まで待つ）
+            on_late (LateCallback | None): 期限後に返った座標の結果を受け取る関数
+        Returns:
+            np.ndarray: (座標数, NUM_SLOTS) の観測値・予報値の降水強度（入力順、取得できなかった・期限までに返らなかった座標はUNKNOWN）
+        """
+        # 同じ10分の時間枠のリクエストは分が違ってもまとめ、時間枠の先頭の日時で問い合わせる
+        group = (appid, bucket_date_str(date_str))
+        pending = []
+        joined = 0
+        with self._condition:
+            queue = self._queues.setdefault(group, [])
+            for key, coord in zip(keys, coordinate_list):
+                item = self._inflight.get(group + (key,))
+                if item is None:
+                    item = _PendingCoordinate(key, coord)
+                    self._inflight[group + (key,)] = item
+                    queue.append(item)
+                else:
+                    joined += 1
+                pending.append(item)
+            if not queue:
+                del self._queues[group]
+            self._condition.notify()
+        if joined:
+            logger.debug("Joined %d in-flight Yahoo lookups from other requests", joined)
+
+        # 発行待ちの時間とリクエストのタイムアウトを合わせた時間までしか待たない
+        default_deadline = time.monotonic() + self.window + self.client.timeout * 2 + 1
+        deadline = default_deadline if deadline is None else min(deadline, default_deadline)
+        slots = np.full((len(pending), NUM_SLOTS), UNKNOWN, dtype=np.uint8)
+        timed_out = 0
+        for i, item in enumerate(pending):
+            try:
+                row = item.future.result(timeout=max(0.0, deadline - time.monotonic()))
+                if row is not None:
+                    slots[i] = row
+            except FutureTimeoutError:
+                timed_out += 1
+                if on_late is not None:
+                    item.future.add_done_callback(lambda f, i=i: _deliver_late_item(f, i, on_late))
+        if timed_out:
+            logger.warning("%d batched Yahoo lookups did not finish within the deadline", timed_out)
+        return slots
+
+    def _dispatch(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queues:
+                    self._condition.wait()
+                # 最も長く待っている座標のグループから発行する
+                group, queue = min(self._queues.items(), key=lambda entry: entry[1][0].enqueued_at)
+                remaining = queue[0].enqueued_at + self.window - time.monotonic()
+                if len(queue) < YAHOO_CHUNK_SIZE and remaining > 0:
+                    self._condition.wait(timeout=remaining)
+                    continue
+                chunk = queue[:YAHOO_CHUNK_SIZE]
+                del queue[:YAHOO_CHUNK_SIZE]
+                if not queue:
+                    del self._queues[group]
+            self.client.executor.submit(self._run_chunk, group, chunk)
+
+    def _run_chunk(self, group: tuple[str, str], chunk: list[_PendingCoordinate]) -> None:
+        appid, date_str = group
+        coords = [item.coord for item in chunk]
+        try:
+            slots = self.client._fetch_chunk_hedged(0, 1, coords, appid, date_str)
+        except Exception as e:
+            logger.error("Batched Yahoo lookup failed: %s", e)
+            slots = None
+        with self._condition:
+            for item in chunk:
+                self._inflight.pop(group + (item.key,), None)
+        for i, item in enumerate(chunk):
+            # 取得できなかった座標はNoneを渡す（各行は他の行と配列を共有しないようコピーする）
+            row = None if slots is None or slots[i, 0] == UNKNOWN else slots[i].copy()
+            item.future.set_result(row)
+
+
+_scheduler: YahooFetchScheduler | None = None
+
+
+def get_yahoo_scheduler() -> YahooFetchScheduler | None:
+    """
+    YAHOO_BATCHINGが有効なら、プロセス内で共有するYahooFetchSchedulerを返す。
+    Returns:
+        YahooFetchScheduler | None: 共有スケジューラ（無効な場合はNone）
+    """
+    global _scheduler
+    if not YAHOO_BATCHING:
+        return None
+    client = get_yahoo_client()
+    with _client_lock:
+        if _scheduler is None:
+            _scheduler = YahooFetchScheduler(client)
+    return _scheduler
@@ -0,0 +1,72 @@
+import time
+from datetime import datetime
+
+import numpy as np
+
+from src.modules.rain_data import RainData, _ancestors
+from src.modules.rain_grid import NUM_SLOTS
+from src.modules.values import TileSet
+
+_CENTER = (35.60, 139.60)
+_RADIUS_DEG = 0.2
+
+
+class _FieldRainData(RainData):
+    # タイルの中心が円の中なら雨とする。failingのタイルは値なし
+    def __init__(self, failing=frozenset()):
+        super().__init__("appid")
+        self.failing = failing
+
+    def get(self, coordinate_list, date, zoom_level=13, deadline=None):
+        tiles = coordinate_list
+        lat, lon = tiles.centers()
+        rainy = np.hypot(lat - _CENTER[0], lon - _CENTER[1]) < _RADIUS_DEG
+        found = np.array([key not in self.failing for key in tiles.keys()], dtype=bool)
+        self.feature_tiles = tiles[found]
+        self.slots = np.repeat(np.where(rainy, 10, 0).astype(np.uint8)[found, None], NUM_SLOTS, axis=1)
+        self.stale_tiles = TileSet([], [], [])
+        self.unknown_tiles = tiles[~found]
+
+
+def _region() -> TileSet:
+    # 雨の円が東端にはみ出す範囲
+    return TileSet.from_bounds(35.45, 139.40, 35.75, 139.65, 13)
+
+
+def test_adaptive_covers_fine_rain_and_keeps_coarse_tiles_inside():
+    region = _region()
+    fine = _FieldRainData()
+    fine.get(region, datetime.now())
+    fine_rainy = fine.feature_tiles[fine.rain_mask()]
+    assert len(fine_rainy) < len(region)
+
+    adaptive = _FieldRainData()
+    adaptive.get_adaptive(region, datetime.now(), coarse_zoom=10)
+    rainy = adaptive.feature_tiles[adaptive.rain_mask()]
+    assert adaptive.complete
+
+    # 雨の領域の境界の細かいタイルは、粗いタイルのまま残らない
+    fine_keys = set(fine_rainy.keys())
+    assert set(rainy[rainy.zoom == 13].keys()) <= fine_keys
+
+    # 粗いまま残った雨のタイルは、取得範囲の内部にあり周囲8タイルも雨
+    coarse = rainy[rainy.zoom < 13]
+    assert len(coarse) > 0
+    for x, y, z in coarse.keys():
+        inside = set(_ancestors(region, 13, z).keys())
+        neighbors = TileSet([x + dx for dx in (-1, 0, 1) for dy in (-1, 0, 1)],
+                            [y + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)], z)
+        assert set(neighbors.keys()) <= inside
+        lat, lon = neighbors.centers()
+        assert (np.hypot(lat - _CENTER[0], lon - _CENTER[1]) < _RADIUS_DEG).all()
+
+
+def test_adaptive_counts_unknown_tiles_on_every_level():
+    region = _region()
+    coarse = _ancestors(region, 13, 10).unique()
+    failing = frozenset([coarse.keys()[0]])
+    adaptive = _FieldRainData(failing)
+    # 期限切れなら値のない粗いタイルは細分化せず、そのまま値なしとして数える
+    adaptive.get_adaptive(region, datetime.now(), coarse_zoom=10, deadline=time.monotonic() - 1)
+    assert set(adaptive.unknown_tiles.keys()) == set(failing)
+    assert adaptive.status()["unknown_tiles"] == 1
@@ -0,0 +1,40 @@
+import numpy as np
+
+from src.modules.area_merge import merge_tiles
+from src.modules.values import TileSet
+
+
+def _covered_cells(rects) -> list[tuple[int, int]]:
+    cells = []
+    for x0, y0, x1, y1 in zip(rects.x0.tolist(), rects.y0.tolist(), rects.x1.tolist(), rects.y1.tolist()):
+        cells += [(x, y) for x in range(x0, x1) for y in range(y0, y1)]
+    return cells
+
+
+def test_rectangles_cover_tiles_exactly_once():
+    rng = np.random.default_rng(3)
+    mask = rng.random((30, 40)) < 0.4
+    mask[5:15, 10:25] = True
+    ys, xs = np.nonzero(mask)
+    tiles = TileSet(xs + 7200, ys + 3200, 13)
+
+    rects = merge_tiles(tiles, tolerance=0)
+    cells = _covered_cells(rects)
+    # 重なりも漏れもなく、入力のタイルと同じ範囲を覆う
+    assert len(cells) == len(set(cells))
+    assert set(cells) == {(x, y) for x, y, _ in tiles.keys()}
+    assert len(rects) < len(tiles)
+
+
+def test_mixed_zoom_tiles_are_merged_on_finest_grid():
+    tiles = TileSet([3600, 7202, 7203, 7202], [1600, 3200, 3200, 3203], [12, 13, 13, 13])
+    rects = merge_tiles(tiles, tolerance=0)
+    assert rects.zoom == 13
+    cells = _covered_cells(rects)
+    expected = {(7200, 3200), (7201, 3200), (7200, 3201), (7201, 3201), (7202, 3200), (7203, 3200), (7202, 3203)}
+    assert len(cells) == len(set(cells))
+    assert set(cells) == expected
+
+
+def test_empty_tiles_give_no_rectangles():
+    assert len(merge_tiles(TileSet([], [], []), tolerance=0)) == 0
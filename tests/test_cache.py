@@ -0,0 +1,45 @@
+import time
+
+from src.core.cache import TTLCache
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache(max_entries=10, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=10)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.get("a", "missing") == "missing"
+    assert cache.get("b") == 2
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_weight_limit_evicts_oldest_entries():
+    cache = TTLCache(max_entries=100, ttl=60, max_weight=100)
+    cache.set("a", "x", weight=40)
+    cache.set("b", "y", weight=40)
+    cache.set("c", "z", weight=40)
+    assert cache.get("a") is None
+    assert cache.weight == 80
+    # 上限より重い1件は残す
+    cache.set("d", "w", weight=500)
+    assert list(cache._entries) == ["d"]
+    assert cache.weight == 500
+    cache.set("d", "v", weight=10)
+    assert cache.weight == 10
+    cache.delete("d")
+    assert cache.weight == 0
@@ -0,0 +1,22 @@
+import numpy as np
+
+from src.modules.compact import compact_route_response, simplify_path, zoom_tolerance
+
+
+def test_empty_snapped_waypoints():
+    response = {"paths": [{
+        "points": {"type": "LineString", "coordinates": [[139.6, 35.6], [139.7, 35.7]]},
+        "snapped_waypoints": {"type": "LineString", "coordinates": []},
+    }]}
+    path = compact_route_response(response)["paths"][0]
+    assert path["snapped_waypoints"] == ""
+    assert path["num_points"] == 2
+
+
+def test_simplify_uses_pixel_size_at_latitude():
+    # 緯度35度では1ピクセルの南北の長さは緯度でcos(35°)倍になる
+    tolerance = zoom_tolerance(14)
+    pixel_lat = tolerance * np.cos(np.radians(35.0))
+    for offset, kept in ((1.1, True), (0.9, False)):
+        coords = np.array([[139.0, 35.0], [139.01, 35.0 + offset * pixel_lat], [139.02, 35.0]])
+        assert (1 in simplify_path(coords, tolerance)) is kept
@@ -0,0 +1,63 @@
+import numpy as np
+
+from src.modules.exposure import score_path, path_tiles
+from src.modules.rain_data import RainData
+from src.modules.rain_grid import NUM_SLOTS, SLOT_SECONDS
+from src.modules.values import TileSet
+
+
+def _path(num_points: int = 21) -> np.ndarray:
+    # 東西に約90km（区間ごとに別のタイルになるよう経度0.05度ごと）の直線
+    return np.stack([139.5 + np.arange(num_points) * 0.05, np.full(num_points, 35.6)], axis=1)
+
+
+def _rain_data(coords: np.ndarray, rainy_segments: dict[int, np.ndarray], missing: set[int] = frozenset()) -> RainData:
+    tiles = path_tiles([{"points": {"coordinates": coords.tolist()}}])
+    mid = (coords[:-1] + coords[1:]) / 2
+    segment_tiles = TileSet.from_coordinates(mid[:, 1], mid[:, 0], 13)
+    slots = np.zeros((len(tiles), NUM_SLOTS), dtype=np.uint8)
+    index = {key: i for i, key in enumerate(tiles.keys())}
+    for segment, row in rainy_segments.items():
+        slots[index[segment_tiles.keys()[segment]]] = row
+    keep = np.array([key not in {segment_tiles.keys()[s] for s in missing} for key in tiles.keys()], dtype=bool)
+    rain_data = RainData("appid")
+    rain_data.feature_tiles = tiles[keep]
+    rain_data.slots = slots[keep]
+    rain_data.observed_at = 1_000_000 * SLOT_SECONDS
+    return rain_data
+
+
+def test_intervals_distance_and_unknown():
+    coords = _path()
+    rain = np.full(NUM_SLOTS, 4, dtype=np.uint8)
+    heavy = np.full(NUM_SLOTS, 12, dtype=np.uint8)
+    rain_data = _rain_data(coords, {3: rain, 4: heavy, 5: rain, 10: rain}, missing={15})
+
+    exposure = score_path(coords, 20 * 60 * 1000, rain_data)
+    # 区間 i は点 i から点 i+1 まで
+    assert exposure["intervals"] == [[3, 6, 12], [10, 11, 4]]
+    assert exposure["max_intensity"] == 12
+    segment_m = exposure["distance"] / 4
+    assert 4400 < segment_m < 4600
+    assert exposure["time"] == 4 * 60 * 1000
+    assert abs(exposure["unknown_distance"] - segment_m) < 1
+
+
+def test_eta_window_ignores_rain_before_arrival():
+    coords = _path()
+    # 最初の区間は観測値だけ雨、最後の区間は60分先だけ雨
+    early = np.array([9, 0, 0, 0, 0, 0, 0], dtype=np.uint8)
+    late = np.array([0, 0, 0, 0, 0, 0, 9], dtype=np.uint8)
+    rain_data = _rain_data(coords, {0: early, 19: late})
+    now = rain_data.observed_at
+
+    assert score_path(coords, 60 * 60 * 1000, rain_data)["intervals"] == [[0, 1, 9], [19, 20, 9]]
+    # 60分かけて走る場合、最後の区間には約60分後に着く
+    assert score_path(coords, 60 * 60 * 1000, rain_data, now=now)["intervals"] == [[0, 1, 9], [19, 20, 9]]
+    # 10分で走り抜ける場合、60分先の雨には当たらない
+    assert score_path(coords, 10 * 60 * 1000, rain_data, now=now)["intervals"] == [[0, 1, 9]]
+
+
+def test_short_path_has_no_exposure():
+    exposure = score_path(np.zeros((1, 2)), 0, RainData("appid"))
+    assert exposure == {"distance": 0.0, "time": 0, "max_intensity": 0, "unknown_distance": 0.0, "intervals": []}
@@ -0,0 +1,48 @@
+import numpy as np
+
+from src.modules.overlay import cells_to_geojson, etag_matches, geojson_size, grid_cells, to_geojson, _TRANSPARENCY
+from src.modules.rain_grid import RainGrid, NUM_SLOTS, UNKNOWN
+from src.modules.values import TileSet
+
+
+def test_etag_matches_entity_tag_list():
+    tag = '"abc123"'
+    assert etag_matches('"abc123"', tag)
+    assert etag_matches('W/"abc123"', tag)
+    assert etag_matches('"other", W/"abc123"', tag)
+    assert etag_matches("*", tag)
+    assert not etag_matches("", tag)
+    assert not etag_matches('"abc1234"', tag)
+    assert not etag_matches('"xabc123"', tag)
+    assert not etag_matches('abc123', tag)
+    assert not etag_matches('"a*b"', tag)
+
+
+def test_unknown_cells_are_distinct_from_dry_cells():
+    assert _TRANSPARENCY[0] == 0
+    assert _TRANSPARENCY[UNKNOWN] > 0
+    values = np.array([[0, 5], [UNKNOWN, 0]], dtype=np.uint8)
+    features = to_geojson(values, 10, 900, 400)["features"]
+    properties = sorted((f["properties"]["tile_x"], f["properties"]["tile_y"], f["properties"]["rainfall"],
+                         f["properties"]["unknown"]) for f in features)
+    assert properties == [(1800, 801, None, True), (1801, 800, 5, False)]
+
+
+def test_grid_cells_match_tile_values():
+    grid = RainGrid(35.0, 139.0, 36.0, 140.0, zoom=13)
+    tiles = TileSet.from_bounds(35.2, 139.2, 35.8, 139.8, 13)
+    rng = np.random.default_rng(1)
+    slots = (rng.random((len(tiles), NUM_SLOTS)) < 0.1).astype(np.uint8) * 7
+    written = rng.random(len(tiles)) < 0.8
+    grid.update(tiles[written], slots[written], bucket=5)
+
+    z = 10
+    x, y = int(tiles.x[len(tiles) // 2]) >> 3, int(tiles.y[len(tiles) // 2]) >> 3
+    for slot in (None, 0, 3):
+        cells = grid_cells(grid, z, x, y, 5, slot)
+        assert cells is not None
+        values = grid.tile_values(z, x, y, 5, geojson_size(z, grid.zoom), slot)
+        assert cells_to_geojson(*cells) == to_geojson(values, z, x, y)
+    # 格子のセルより細かい分割や範囲外のタイルは格子から直接読まない
+    assert grid_cells(grid, 14, x << 4, y << 4, 5) is None
+    assert grid_cells(grid, 5, x >> 5, y >> 5, 5) is None
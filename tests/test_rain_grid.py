@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+
+from src.modules.rain_grid import RainGrid, NUM_SLOTS, UNKNOWN
+from src.modules.values import TileSet
+
+
+def _grid(**kwargs) -> RainGrid:
+    return RainGrid(35.0, 139.0, 36.0, 140.0, **kwargs)
+
+
+def test_values_roundtrip_and_unknown():
+    grid = _grid(zoom=13)
+    tiles = TileSet.from_bounds(35.5, 139.5, 35.6, 139.6, 13)
+    slots = np.zeros((len(tiles), NUM_SLOTS), dtype=np.uint8)
+    slots[3, 2] = 5
+    grid.update(tiles[:5], slots[:5], bucket=100)
+
+    values = grid.values(tiles, bucket=100)
+    assert (values[:5] == slots[:5]).all()
+    assert (values[5:] == UNKNOWN).all()
+    assert grid.lookup(int(tiles.x[3]), int(tiles.y[3]), 100) == 5
+    assert grid.lookup(int(tiles.x[0]), int(tiles.y[0]), 100) == 0
+    assert grid.lookup(int(tiles.x[6]), int(tiles.y[6]), 100) is None
+    assert (grid.values(tiles, bucket=101) == UNKNOWN).all()
+
+
+def test_rainy_in_bbox_matches_tile_scan():
+    grid = _grid(zoom=13)
+    tiles = TileSet.from_bounds(35.4, 139.4, 35.7, 139.7, 13)
+    rng = np.random.default_rng(0)
+    slots = (rng.random((len(tiles), NUM_SLOTS)) < 0.05).astype(np.uint8) * rng.integers(1, 80, (len(tiles), NUM_SLOTS), dtype=np.uint8)
+    slots[:10] = UNKNOWN
+    grid.update(tiles, slots, bucket=100)
+
+    cells, values = grid.rainy_in_bbox(35.4, 139.4, 35.7, 139.7, bucket=100)
+    intensity = np.where(slots[:, 0] == UNKNOWN, 0, slots.max(axis=1))
+    expected = dict(zip(tiles.keys(), intensity.tolist()))
+    assert dict(zip(cells.keys(), values.tolist())) == {key: v for key, v in expected.items() if v > 0}
+
+    cells, values = grid.rainy_in_bbox(35.4, 139.4, 35.7, 139.7, bucket=100, include_unknown=True)
+    assert set(tiles[:10].keys()) <= set(cells.keys())
+    assert (values[np.isin(cells.x, tiles.x[:10]) & np.isin(cells.y, tiles.y[:10])] == UNKNOWN).any()
+
+
+def test_memmap_shared_and_only_creator_removes(tmp_path):
+    writer = _grid(zoom=10, keep_buckets=1, directory=str(tmp_path))
+    reader = _grid(zoom=10, keep_buckets=1, directory=str(tmp_path))
+    tiles = TileSet.from_bounds(35.2, 139.2, 35.8, 139.8, 10)
+    slots = np.full((len(tiles), NUM_SLOTS), 7, dtype=np.uint8)
+    writer.update(tiles, slots, bucket=1)
+    assert (reader.values(tiles, bucket=1) == 7).all()
+
+    # 作成していないプロセスが時間枠を捨ててもファイルは残る
+    reader.snapshot(2, create=True)
+    assert os.path.exists(writer._path(1))
+    assert (writer.values(tiles, bucket=1) == 7).all()
+
+    # 作成したプロセスが捨てると削除される
+    writer.snapshot(2, create=True)
+    assert not os.path.exists(writer._path(1))
+    writer.clear()
+    assert os.path.exists(writer._path(2))
+    reader.clear()
+    assert not os.path.exists(writer._path(2))
@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+
+from src.modules import prefetch, rain_grid, rain_store
+from src.modules.prefetch import RainPrefetcher, parse_regions
+from src.modules.rain_grid import NUM_SLOTS
+from src.modules.rain_store import RainStore
+
+
+def _store(tmp_path, **kwargs) -> RainStore:
+    return RainStore(str(tmp_path / "rain.db"), **kwargs)
+
+
+def test_get_many_matches_bucket_and_expiry(tmp_path):
+    store = _store(tmp_path, ttl=60, purge_interval=3600)
+    store.put_many([((1, 2, 13), b"\x01" * NUM_SLOTS), ((3, 4, 13), b"\x02" * NUM_SLOTS)], bucket=10)
+    assert store.get_many([(1, 2, 13), (3, 4, 13), (5, 6, 13)], bucket=10) == {
+        (1, 2, 13): b"\x01" * NUM_SLOTS,
+        (3, 4, 13): b"\x02" * NUM_SLOTS,
+    }
+    assert store.get_many([(1, 2, 13)], bucket=11) == {}
+
+    # 有効期限を過ぎた行は読めず、purgeで削除される
+    expired = _store(tmp_path, ttl=-1, purge_interval=3600)
+    expired._last_purge = time.time()
+    expired.put_many([((7, 8, 13), b"\x03" * NUM_SLOTS)], bucket=10)
+    assert store.get_many([(7, 8, 13)], bucket=10) == {}
+    assert store.purge() == 1
+    assert len(store.get_many([(1, 2, 13), (3, 4, 13)], bucket=10)) == 2
+
+
+def test_claim_once_per_bucket(tmp_path):
+    first, second = _store(tmp_path), _store(tmp_path)
+    assert first.claim("prefetch", 10)
+    assert not second.claim("prefetch", 10)
+    assert not first.claim("prefetch", 9)
+    assert second.claim("prefetch", 11)
+
+
+class _CountingClient:
+    def __init__(self):
+        self.num_coordinates = 0
+
+    def fetch(self, coordinate_list, appid, date_str, deadline=None, on_late=None, prefetch=False):
+        self.num_coordinates += len(coordinate_list)
+        return np.full((len(coordinate_list), NUM_SLOTS), 3, dtype=np.uint8)
+
+
+def test_prefetch_fetches_once_across_processes(tmp_path, monkeypatch):
+    store = _store(tmp_path)
+    client = _CountingClient()
+    monkeypatch.setattr(prefetch, "get_rain_store", lambda: store)
+    monkeypatch.setattr(prefetch, "get_yahoo_client", lambda: client)
+    regions = parse_regions("35.6,139.6,35.65,139.65")
+
+    # 格子を共有しない2つのワーカープロセス
+    leader = RainPrefetcher("appid", regions)
+    monkeypatch.setattr(rain_grid, "_grid", None)
+    leader.refresh()
+    assert client.num_coordinates == len(leader.tiles)
+
+    follower = RainPrefetcher("appid", regions)
+    monkeypatch.setattr(rain_grid, "_grid", None)
+    follower.refresh()
+    assert client.num_coordinates == len(leader.tiles)
+    bucket, snapshot = follower.snapshot
+    assert len(snapshot) == len(follower.tiles)
+    assert follower.lookup(follower.tile_keys[0], bucket) == b"\x03" * NUM_SLOTS
@@ -0,0 +1,21 @@
+from src.modules.route_cache import RouteCache, estimate_bytes
+
+
+def _response(num_points: int) -> dict:
+    coordinates = [[139.0 + i * 1e-4, 35.0] for i in range(num_points)]
+    return {"paths": [{"points": {"type": "LineString", "coordinates": coordinates}, "instructions": []}]}
+
+
+def test_fingerprints_do_not_evict_each_other():
+    cache = RouteCache()
+    shared, per_pair = _response(2), _response(3)
+    cache.set("35.0,139.0", "35.1,139.1", "route", shared, fingerprint="shared")
+    cache.set("35.0,139.0", "35.1,139.1", "route", per_pair, fingerprint="pair")
+    assert cache.get("35.0,139.0", "35.1,139.1", "route", fingerprint="shared") is shared
+    assert cache.get("35.0,139.0", "35.1,139.1", "route", fingerprint="pair") is per_pair
+    assert cache.get("35.00001,139.00001", "35.1,139.1", "route", fingerprint="pair") is per_pair
+    assert cache.get("35.0,139.0", "35.1,139.1", "normal_route", fingerprint="pair") is None
+
+
+def test_estimate_grows_with_points():
+    assert estimate_bytes(_response(1000)) > estimate_bytes(_response(10)) + 10000
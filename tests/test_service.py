@@ -0,0 +1,36 @@
+import asyncio
+
+from src.modules import service
+
+
+class _RecordingClient:
+    def __init__(self):
+        self.bodies = []
+
+    async def route(self, request_body: dict) -> dict:
+        self.bodies.append(request_body)
+        return {"paths": []}
+
+
+def _route_body(monkeypatch, rain_avoidance_data: dict | None) -> dict:
+    client = _RecordingClient()
+    monkeypatch.setattr(service, "get_graphhopper_client", lambda: client)
+    monkeypatch.setattr(service, "ROUTING_MODE", "auto")
+    asyncio.run(service.get_route_from_graphhopper("35.6762,139.6503", "35.7169,139.7774", rain_avoidance_data))
+    return client.bodies[0]
+
+
+def test_dry_route_uses_ch_without_custom_model(monkeypatch):
+    body = _route_body(monkeypatch, {"priority": [], "areas": {"type": "FeatureCollection", "features": []}})
+    assert "custom_model" not in body
+    assert body["ch.disable"] is False
+    assert body["points"] == [[139.6503, 35.6762], [139.7774, 35.7169]]
+
+
+def test_rainy_route_uses_lm_with_custom_model(monkeypatch):
+    priority = [{"if": "in_rain", "multiply_by": "0"}]
+    areas = {"type": "FeatureCollection", "features": [{"type": "Feature", "id": "rain"}]}
+    body = _route_body(monkeypatch, {"priority": priority, "areas": areas})
+    assert body["custom_model"] == {"priority": priority, "areas": areas}
+    assert body["ch.disable"] is True
+    assert body["lm.disable"] is False
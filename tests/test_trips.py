@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from src.modules import trips
+
+
+def _fail(*args, **kwargs):
+    raise ValueError("could not convert string to float: 'notacoord'")
+
+
+def test_failed_registration_does_not_leave_trip(monkeypatch):
+    monkeypatch.setattr(trips, "get_rain_info", _fail)
+    manager = trips.TripManager(max_active=10)
+    with pytest.raises(ValueError):
+        asyncio.run(manager.register("35.6,139.6", "notacoord"))
+    assert manager.trips == {}
+
+
+def test_refresh_retries_until_route_found(monkeypatch):
+    calls = []
+
+    async def get_route(start, goal, rain_data):
+        calls.append(start)
+        if len(calls) == 1:
+            return {"error": "GraphHopper unavailable", "status_code": 503}, False
+        return {"paths": [{"points": {"coordinates": [[139.6, 35.6], [139.7, 35.7]]}}]}, False
+
+    monkeypatch.setattr(trips, "get_rain_info", lambda *args: ({"rain_status": None}, []))
+    monkeypatch.setattr(trips, "get_route", get_route)
+    monkeypatch.setattr(trips, "watched_rain", lambda trip: set())
+    manager = trips.TripManager(max_active=10)
+
+    async def scenario():
+        trip = await manager.register("35.6,139.6", "35.7,139.7")
+        assert trip.response is None
+        await manager.refresh(trip)
+        return trip
+
+    trip = asyncio.run(scenario())
+    assert len(calls) == 2
+    assert trip.response is not None
+    events = [trip.queue.get_nowait() for _ in range(trip.queue.qsize())]
+    assert [event.split(b"\n", 1)[0] for event in events] == [b"event: error", b"event: route"]
@@ -0,0 +1,38 @@
+import numpy as np
+
+from src.modules.values import TileSet, deg2num_array, num2deg_array, tile
+
+
+def test_tile_list_roundtrip():
+    tiles = [tile(7270, 3225, 13), tile(3635, 1612, 12), tile(7271, 3225, 13)]
+    tile_set = TileSet.from_tiles(tiles)
+    assert tile_set.to_tiles() == tiles
+    assert tile_set.keys() == [(7270, 3225, 13), (3635, 1612, 12), (7271, 3225, 13)]
+    assert tile_set[np.array([2, 0])].keys() == [(7271, 3225, 13), (7270, 3225, 13)]
+
+
+def test_centers_map_back_to_same_tiles():
+    tiles = TileSet.from_bounds(35.5, 139.5, 35.8, 139.9, 13)
+    lat, lon = tiles.centers()
+    assert TileSet.from_coordinates(lat, lon, 13).keys() == tiles.keys()
+    x, y = deg2num_array(lat, lon, 13)
+    assert (x == tiles.x).all() and (y == tiles.y).all()
+    lat_max, lon_min = num2deg_array(tiles.x, tiles.y, tiles.zoom)
+    assert (lat_max > lat).all() and (lon_min < lon).all()
+
+
+def test_from_bounds_covers_corners_without_duplicates():
+    tiles = TileSet.from_bounds(35.5, 139.5, 35.8, 139.9, 13)
+    corners = TileSet.from_coordinates(np.array([35.5, 35.8, 35.5, 35.8]), np.array([139.5, 139.5, 139.9, 139.9]), 13)
+    assert set(corners.keys()) <= set(tiles.keys())
+    assert len(tiles.unique()) == len(tiles)
+    assert (tiles.x.max() - tiles.x.min() + 1) * (tiles.y.max() - tiles.y.min() + 1) == len(tiles)
+
+
+def test_unique_and_concatenate_keep_first_occurrence_order():
+    a = TileSet([1, 2, 3], [1, 1, 1], 13)
+    b = TileSet([2, 4], [1, 1], [13, 12])
+    merged = TileSet.concatenate([a, b])
+    assert merged.keys() == [(1, 1, 13), (2, 1, 13), (3, 1, 13), (2, 1, 13), (4, 1, 12)]
+    assert merged.unique_index().tolist() == [0, 1, 2, 4]
+    assert set(merged.unique().keys()) == {(1, 1, 13), (2, 1, 13), (3, 1, 13), (4, 1, 12)}
@@ -0,0 +1,96 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.modules.rain_grid import NUM_SLOTS, UNKNOWN
+from src.modules.values import coordinate
+from src.modules.yahoo_client import RateLimiter, YahooFetchScheduler, parse_features
+
+
+class _FakeClient:
+    timeout = 1.0
+
+    def __init__(self, latency: float = 0.2):
+        self.latency = latency
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _fetch_chunk_hedged(self, chunk_index, num_chunks, chunk, appid, date_str):
+        with self._lock:
+            self.calls.append((len(chunk), date_str))
+        time.sleep(self.latency)
+        return np.ones((len(chunk), NUM_SLOTS), dtype=np.uint8)
+
+
+def _fetch_concurrently(scheduler, date_strs):
+    keys = [(7270 + i, 3225, 13) for i in range(3)]
+    coords = [coordinate(35.6, 139.5 + i * 0.01) for i in range(3)]
+    results = [None] * len(date_strs)
+
+    def run(i):
+        results[i] = scheduler.fetch(keys, coords, "appid", date_strs[i])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(date_strs))]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_fetch_in_same_bucket_shares_http_call():
+    client = _FakeClient()
+    scheduler = YahooFetchScheduler(client, window=0.01)
+    # 2つ目は1つ目の問い合わせ中に、同じ時間枠の別の分で同じタイルを要求する
+    results = _fetch_concurrently(scheduler, ["202610181203", "202610181208"])
+    assert client.calls == [(3, "202610181200")]
+    assert all((result == 1).all() for result in results)
+
+
+def test_fetch_in_different_buckets_is_not_shared():
+    client = _FakeClient()
+    scheduler = YahooFetchScheduler(client, window=0.01)
+    _fetch_concurrently(scheduler, ["202610181209", "202610181210"])
+    assert sorted(date for _, date in client.calls) == ["202610181200", "202610181210"]
+
+
+def test_rate_limiter_spaces_requests_after_burst():
+    limiter = RateLimiter(rate=20, burst=2)
+    started = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    # 2つはすぐに、残りの4つは1/20秒ごとに発行される
+    assert time.monotonic() - started >= 0.19
+
+
+def test_rate_limiter_disabled_with_zero_rate():
+    limiter = RateLimiter(rate=0, burst=1)
+    started = time.monotonic()
+    for _ in range(100):
+        limiter.acquire()
+    assert time.monotonic() - started < 0.05
+
+
+def _feature(lon: float, lat: float, rainfalls: list[float]) -> dict:
+    # Yahoo!は時刻順に並べて返すとは限らないため、逆順にする
+    weather = [{"Date": f"2026101812{i:02d}", "Rainfall": r} for i, r in enumerate(rainfalls)]
+    return {"Geometry": {"Coordinates": f"{lon},{lat}"}, "Property": {"WeatherList": {"Weather": weather[::-1]}}}
+
+
+def test_parse_features_orders_slots_and_fills_missing_forecasts():
+    chunk = [coordinate(35.6, 139.5), coordinate(35.7, 139.6)]
+    features = [_feature(139.5, 35.6, [0, 0.3, 1.5, 300]), _feature(139.6, 35.7, [2, 0, 0, 0, 0, 0, 4, 9])]
+    slots = parse_features(chunk, features)
+    assert slots.dtype == np.uint8
+    assert slots.tolist() == [[0, 1, 2, 254, 254, 254, 254], [2, 0, 0, 0, 0, 0, 4]]
+
+
+def test_parse_features_matches_by_coordinates_when_counts_differ():
+    chunk = [coordinate(35.6, 139.5), coordinate(35.7, 139.6), coordinate(35.8, 139.7)]
+    slots = parse_features(chunk, [_feature(139.7, 35.8, [3]), _feature(139.5, 35.6, [1])])
+    assert slots[:, 0].tolist() == [1, UNKNOWN, 3]
+    assert (parse_features(chunk, []) == UNKNOWN).all()